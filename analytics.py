@@ -0,0 +1,472 @@
+"""Ad-hoc aggregates over invoices and invoice lines, computed with NumPy.
+
+Columns are read from SQLite in fixed-size chunks of rows, each chunk
+becoming one NumPy array per column, and every group-by, date bucket and
+aging calculation runs on whole arrays. Partial totals are merged as the
+chunks go by, so memory depends on the chunk size and the number of
+groups, not on how many rows are read.
+
+Python tuples per row would cost more than the whole aggregation, so each
+chunk is fetched as a single row: SQLite joins every column's values into
+one comma-separated string (group_concat) and NumPy parses it in C. Dates
+travel as day numbers (days since 1970-01-01) and amounts as integer cents.
+Invoices moved to the archive (see archive.py) are read after the ledger's
+whenever the date range and statuses reach them.
+
+NumPy is optional for the rest of the app; this module needs it
+(`pip install numpy`).
+
+    python analytics.py revenue --by customer,week --source items --output revenue.csv
+    python analytics.py tax --by quarter --from 2024-01-01
+    python analytics.py aging --by customer
+    python analytics.py dso --days 90
+"""
+import argparse
+import csv
+import os
+from datetime import date
+
+import numpy as np
+
+import archive
+import schema
+from ledger import INVOICE_STATUSES
+from reports import AGING_BUCKETS, RECEIVABLE_STATUSES, REVENUE_STATUSES
+
+# Rows read per chunk; each chunk is a few MiB of text and arrays
+CHUNK_ROWS = 200000
+# Merge the partial totals once they hold this many groups
+MERGE_GROUPS = 1000000
+# Page cache while scanning, in KiB; as for exports, a one-pass scan gains nothing from caching
+SCAN_CACHE_KIB = 2048
+# Rows formatted at a time when writing a result
+FORMAT_ROWS = 50000
+# Customer names are looked up this many at a time
+NAME_BATCH = 500
+
+EPOCH = date(1970, 1, 1)
+PERIODS = ("day", "week", "month", "quarter", "year")
+GROUPS = ("customer", "status") + PERIODS
+
+
+def _day_number(column):
+    return f"CAST(julianday({column}) - 2440587.5 AS INTEGER)"
+
+
+def _status_code(column):
+    cases = " ".join(f"WHEN '{status}' THEN {code}" for code, status in enumerate(INVOICE_STATUSES))
+    return f"CASE {column} {cases} ELSE -1 END"
+
+
+# Source -> (FROM, keyset column, {column: integer SQL expression}, names of the summed values)
+SOURCES = {
+    "invoices": (
+        "{schema}.invoices i", "i.id",
+        {
+            "customer": "i.customer_id",
+            "day": _day_number("i.invoice_date"),
+            "due": _day_number("i.due_date"),
+            "status": _status_code("i.status"),
+            "total": "CAST(round(i.total_amount * 100) AS INTEGER)",
+            "tax": "CAST(round(i.tax_amount * 100) AS INTEGER)",
+        },
+        ("invoices", "net", "tax", "total"),
+    ),
+    "items": (
+        "{schema}.invoice_items it JOIN {schema}.invoices i ON i.id = it.invoice_id", "it.id",
+        {
+            "customer": "i.customer_id",
+            "day": _day_number("i.invoice_date"),
+            "status": _status_code("i.status"),
+            "amount": "CAST(round(it.quantity * it.unit_price * 100) AS INTEGER)",
+        },
+        ("lines", "amount"),
+    ),
+}
+
+
+def read_chunks(conn, source, columns, date_from=None, date_to=None, statuses=None, chunk_rows=CHUNK_ROWS):
+    """Yield {column: int64 array} for the rows of `source`, `chunk_rows` rows read at a time.
+
+    `columns` are names from SOURCES; NULLs read as 0. Dates filter on the
+    invoice date (YYYY-MM-DD, inclusive) and `statuses` on the invoice status.
+    """
+    from_sql, key, expressions, _ = SOURCES[source]
+    # The filters are applied to the arrays: any condition on invoices makes
+    # SQLite build a Bloom filter over the whole table for every chunk
+    names = list(columns)
+    names += [name for name in ("day", "status") if name not in names]
+    first_day = _to_day(date_from) if date_from else None
+    last_day = _to_day(date_to) if date_to else None
+    codes = [INVOICE_STATUSES.index(status) if status in INVOICE_STATUSES else -1 for status in statuses or ()]
+    selected = ", ".join(f"COALESCE({expressions[name]}, 0) AS c{index}" for index, name in enumerate(names))
+    joined = ", ".join(f"group_concat(c{index})" for index in range(len(names)))
+    # The keyset walk reads each chunk in primary key order without an OFFSET
+    query = f"""
+        SELECT MAX(k), COUNT(*), {joined} FROM (
+            SELECT {key} AS k, {selected} FROM {from_sql}
+            WHERE {key} > ? ORDER BY {key} LIMIT ?
+        )
+    """
+    schemas = ["main"]
+    if archive.reaches(conn, date_from, statuses):
+        schemas.append(archive.SCHEMA)
+    cache_size = conn.execute("PRAGMA cache_size").fetchone()[0]
+    mmap_size = conn.execute("PRAGMA mmap_size").fetchone()[0]
+    conn.execute(f"PRAGMA cache_size = -{SCAN_CACHE_KIB}")
+    conn.execute("PRAGMA mmap_size = 0")
+    try:
+        for schema_name in schemas:
+            last = 0
+            while True:
+                last_key, count, *texts = conn.execute(query.format(schema=schema_name), (last, chunk_rows)).fetchone()
+                if not count:
+                    break
+                chunk = {name: np.fromstring(text, dtype=np.int64, sep=",") for name, text in zip(names, texts)}
+                keep = np.ones(count, dtype=bool)
+                if first_day is not None:
+                    keep &= chunk["day"] >= first_day
+                if last_day is not None:
+                    keep &= chunk["day"] <= last_day
+                if statuses:
+                    # Statuses outside INVOICE_STATUSES all read as -1 ("Other")
+                    keep &= np.isin(chunk["status"], codes)
+                yield {name: chunk[name][keep] for name in columns}
+                last = last_key
+    finally:
+        # The connection may be shared with other jobs; put its settings back
+        conn.execute(f"PRAGMA cache_size = {cache_size}")
+        conn.execute(f"PRAGMA mmap_size = {mmap_size}")
+
+
+def _to_day(iso_date):
+    return (date.fromisoformat(iso_date) - EPOCH).days
+
+
+# --- Bucketing and grouping ---
+
+def period_start(days, period):
+    """The first day (as a day number) of the day/week/month/quarter/year each day number falls in."""
+    if period == "day":
+        return days
+    if period == "week":
+        # Weeks start on Monday; day 0 was a Thursday
+        return (days + 3) // 7 * 7 - 3
+    as_dates = days.astype("datetime64[D]")
+    if period == "year":
+        return as_dates.astype("datetime64[Y]").astype("datetime64[D]").astype(np.int64)
+    months = as_dates.astype("datetime64[M]").astype(np.int64)
+    if period == "quarter":
+        months -= months % 3
+    elif period != "month":
+        raise ValueError(f"Unknown period: {period}")
+    return months.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+
+
+def period_labels(starts, period):
+    """Labels for period start day numbers: 2024-03-04 (day, week), 2024-03, 2024-Q1 or 2024."""
+    # Far fewer periods than rows, so format each period once and look the
+    # rows up in a table indexed by day (object arrays index much faster than strings)
+    starts = np.asarray(starts, dtype=np.int64)
+    if not len(starts):
+        return np.zeros(0, dtype=object)
+    first = int(starts.min())
+    present = np.zeros(int(starts.max()) - first + 1, dtype=bool)
+    present[starts - first] = True
+    distinct = np.flatnonzero(present)
+    labels = np.empty(len(present), dtype=object)
+    labels[distinct] = _format_periods(distinct + first, period)
+    return labels[starts - first]
+
+
+def _format_periods(starts, period):
+    as_dates = starts.astype("datetime64[D]")
+    if period in ("day", "week"):
+        return as_dates.astype(str)
+    if period == "month":
+        return as_dates.astype("datetime64[M]").astype(str)
+    years = as_dates.astype("datetime64[Y]").astype(str)
+    if period == "year":
+        return years
+    quarters = (as_dates.astype("datetime64[M]").astype(np.int64) % 12 // 3 + 1).astype(str)
+    return np.char.add(np.char.add(years, "-Q"), quarters)
+
+
+def unique_rows(keys):
+    """Distinct rows of the key columns and, for each input row, the index of its group.
+
+    Keys are packed into one int64 where their ranges allow, which sorts far
+    faster than NumPy's row-wise unique.
+    """
+    lows = [int(column.min()) for column in keys]
+    spans = [int(column.max()) - low + 1 for column, low in zip(keys, lows)]
+    if np.prod([float(span) for span in spans]) >= 2 ** 62:
+        stacked = np.stack(keys, axis=1)
+        groups, inverse = np.unique(stacked, axis=0, return_inverse=True)
+        return [groups[:, index] for index in range(len(keys))], inverse.ravel()
+    packed = np.zeros(len(keys[0]), dtype=np.int64)
+    for column, low, span in zip(keys, lows, spans):
+        packed = packed * span + (column - low)
+    groups, inverse = np.unique(packed, return_inverse=True)
+    unpacked = []
+    for low, span in zip(reversed(lows), reversed(spans)):
+        unpacked.append(groups % span + low)
+        groups = groups // span
+    return unpacked[::-1], inverse
+
+
+class GroupTotals:
+    """Integer totals per group, added to a chunk at a time."""
+
+    def __init__(self, value_names):
+        self.value_names = value_names
+        self._parts = []
+        self._pending = 0   # Groups in the parts added since the last merge
+        self._merged = 0    # Groups in the merged part
+
+    def add(self, keys, values):
+        """Add one chunk: `keys` is a list of int64 arrays, `values` a list of arrays to sum."""
+        if not len(keys[0]):
+            return
+        groups, inverse = unique_rows(keys)
+        sums = [np.bincount(inverse, weights=column, minlength=len(groups[0])) for column in values]
+        self._parts.append((groups, sums))
+        self._pending += len(groups[0])
+        # Merging costs a sort of everything held, so wait until the new parts are at least as big
+        if self._pending >= max(MERGE_GROUPS, self._merged):
+            self._merge()
+
+    def _merge(self):
+        if len(self._parts) > 1:
+            keys = [np.concatenate(columns) for columns in zip(*(groups for groups, _ in self._parts))]
+            groups, inverse = unique_rows(keys)
+            sums = [np.bincount(inverse, weights=np.concatenate(columns), minlength=len(groups[0]))
+                    for columns in zip(*(sums for _, sums in self._parts))]
+            self._parts = [(groups, sums)]
+        self._pending = 0
+        self._merged = len(self._parts[0][0][0]) if self._parts else 0
+
+    def result(self, key_count):
+        """(key columns, value columns) in key order; sums of cents are exact below 2**53."""
+        self._merge()
+        if not self._parts:
+            empty = np.zeros(0, dtype=np.int64)
+            return [empty] * key_count, [empty] * len(self.value_names)
+        groups, sums = self._parts[0]
+        return groups, [np.rint(column).astype(np.int64) for column in sums]
+
+
+class Table:
+    """A result with named columns, one NumPy array or list per column."""
+
+    def __init__(self, names, columns):
+        self.names = list(names)
+        self.columns = list(columns)
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def rows(self):
+        return zip(*self.columns)
+
+    def to_csv(self, path):
+        """Write the table to `path` as CSV (under a temporary name until complete)."""
+        temp_path = path + ".part"
+        try:
+            with open(temp_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(self.names)
+                writer.writerows(self._formatted())
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def format(self, limit=None):
+        """The table as aligned text, for printing."""
+        rows = [self.names] + [[str(value) for value in row] for row in self._formatted(limit)]
+        widths = [max(len(row[index]) for row in rows) for index in range(len(self.names))]
+        return "\n".join("  ".join(value.rjust(width) for value, width in zip(row, widths)) for row in rows)
+
+    def _formatted(self, limit=None):
+        """Rows with amounts to two decimals, formatted a block of rows and a column at a time."""
+        end = len(self) if limit is None else min(limit, len(self))
+        for start in range(0, end, FORMAT_ROWS):
+            columns = []
+            for column in self.columns:
+                values = column[start:min(start + FORMAT_ROWS, end)]
+                if isinstance(values, np.ndarray):
+                    floats = values.dtype.kind == "f"
+                    values = values.tolist()
+                    if floats:
+                        values = [f"{value:.2f}" for value in values]
+                columns.append(values)
+            yield from zip(*columns)
+
+
+def _customer_names(conn, customer_ids):
+    names = {}
+    ids = [int(customer_id) for customer_id in customer_ids]
+    for start in range(0, len(ids), NAME_BATCH):
+        batch = ids[start:start + NAME_BATCH]
+        names.update(conn.execute(f"SELECT id, name FROM customers WHERE id IN ({', '.join('?' * len(batch))})",
+                                  batch))
+    return names
+
+
+def _key_columns(conn, by, groups):
+    """Readable columns for the group keys: customer id and name, status name, period label."""
+    names = []
+    columns = []
+    for group, values in zip(by, groups):
+        if group == "customer":
+            lookup = _customer_names(conn, np.unique(values))
+            names += ["customer_id", "customer"]
+            columns += [values, [lookup.get(value, "") for value in values.tolist()]]
+        elif group == "status":
+            names.append("status")
+            columns.append([INVOICE_STATUSES[value] if value >= 0 else "Other" for value in values.tolist()])
+        else:
+            names.append(group)
+            columns.append(period_labels(values, group))
+    return names, columns
+
+
+def _check_groups(by):
+    unknown = [group for group in by if group not in GROUPS]
+    if unknown:
+        raise ValueError(f"Cannot group by: {', '.join(unknown)} (choose from {', '.join(GROUPS)})")
+
+
+def _key_sources(by):
+    """The columns to read for grouping `by`; periods are all computed from the invoice date."""
+    return {group if group in ("customer", "status") else "day" for group in by}
+
+
+def _key_arrays(chunk, by, rows):
+    """The group key columns of a chunk; one constant key when there are no groups."""
+    if not by:
+        return [np.zeros(rows, dtype=np.int64)]
+    return [chunk[group] if group in ("customer", "status") else period_start(chunk["day"], group) for group in by]
+
+
+# --- Aggregates ---
+
+def aggregate(conn, by, source="invoices", date_from=None, date_to=None, statuses=REVENUE_STATUSES,
+              chunk_rows=CHUNK_ROWS):
+    """Count and sum `source` ("invoices" or "items") grouped by customer, status and/or a period.
+
+    Invoices give count, net, tax and total per group; invoice lines give
+    count and line amount (lines carry no tax of their own). Defaults to
+    the statuses that count as revenue.
+    """
+    _check_groups(by)
+    if source not in SOURCES:
+        raise ValueError(f"Unknown source: {source}")
+    value_names = SOURCES[source][3]
+    amounts = ["total", "tax"] if source == "invoices" else ["amount"]
+    totals = GroupTotals(value_names)
+    for chunk in read_chunks(conn, source, sorted(_key_sources(by) | set(amounts)), date_from, date_to, statuses,
+                             chunk_rows):
+        ones = np.ones(len(chunk[amounts[0]]), dtype=np.int64)
+        if source == "invoices":
+            values = [ones, chunk["total"] - chunk["tax"], chunk["tax"], chunk["total"]]
+        else:
+            values = [ones, chunk["amount"]]
+        totals.add(_key_arrays(chunk, by, len(ones)), values)
+    groups, sums = totals.result(max(len(by), 1))
+    names, columns = _key_columns(conn, by, groups)
+    # Counts stay integers, cents become currency
+    values = [sums[0]] + [column / 100 for column in sums[1:]]
+    return Table(names + list(value_names), columns + values)
+
+
+def aging(conn, by=(), today=None, statuses=RECEIVABLE_STATUSES, chunk_rows=CHUNK_ROWS):
+    """Open invoices per reports.AGING_BUCKETS (days past due), optionally also by customer or status."""
+    _check_groups(by)
+    today = today or date.today()
+    # Bucket i holds invoices up to edges[i] days overdue
+    edges = np.array([days for _, days in AGING_BUCKETS if days is not None], dtype=np.int64)
+    totals = GroupTotals(["invoices", "amount"])
+    read = sorted(_key_sources(by) | {"due", "total"})
+    for chunk in read_chunks(conn, "invoices", read, statuses=statuses, chunk_rows=chunk_rows):
+        overdue = (today - EPOCH).days - chunk["due"]
+        buckets = np.searchsorted(edges, overdue, side="left")
+        totals.add(_key_arrays(chunk, by, len(buckets)) + [buckets],
+                   [np.ones(len(buckets), dtype=np.int64), chunk["total"]])
+    groups, (counts, cents) = totals.result(max(len(by), 1) + 1)
+    names, columns = _key_columns(conn, by, groups[:-1])
+    labels = [AGING_BUCKETS[bucket][0] for bucket in groups[-1]]
+    return Table(names + ["overdue", "invoices", "amount"], columns + [labels, counts, cents / 100])
+
+
+def days_sales_outstanding(conn, days=90, by=(), today=None, chunk_rows=CHUNK_ROWS):
+    """Receivables divided by the average daily sales of the last `days` days, optionally per group.
+
+    Receivables are the invoices still open today (the ledger keeps no
+    payment dates, so earlier balances can't be reconstructed). Sales are
+    the revenue invoices dated in the window.
+    """
+    _check_groups(by)
+    today = today or date.today()
+    today_day = (today - EPOCH).days
+    totals = GroupTotals(["receivable", "sales"])
+    receivable_codes = [INVOICE_STATUSES.index(status) for status in RECEIVABLE_STATUSES]
+    statuses = sorted(set(RECEIVABLE_STATUSES) | set(REVENUE_STATUSES))
+    read = sorted(_key_sources(by) | {"day", "status", "total"})
+    for chunk in read_chunks(conn, "invoices", read, date_to=today.isoformat(), statuses=statuses,
+                             chunk_rows=chunk_rows):
+        receivable = np.where(np.isin(chunk["status"], receivable_codes), chunk["total"], 0)
+        in_window = (chunk["day"] > today_day - days) & (chunk["day"] <= today_day)
+        sales = np.where(in_window, chunk["total"], 0)
+        totals.add(_key_arrays(chunk, by, len(sales)), [receivable, sales])
+    groups, (receivable, sales) = totals.result(max(len(by), 1))
+    names, columns = _key_columns(conn, by, groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dso = np.where(sales > 0, receivable / np.where(sales > 0, sales, 1) * days, np.nan)
+    return Table(names + ["receivable", f"sales_{days}d", "dso_days"],
+                 columns + [receivable / 100, sales / 100, np.round(dso, 1)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute an ad-hoc aggregate over the ledger.")
+    parser.add_argument("command", choices=("revenue", "tax", "aging", "dso"))
+    parser.add_argument("--db", default="mybookkeeping.db")
+    parser.add_argument("--by", default="", help=f"comma-separated groups: {', '.join(GROUPS)}")
+    parser.add_argument("--source", choices=sorted(SOURCES), default="invoices",
+                        help="what revenue sums: invoice totals or invoice lines")
+    parser.add_argument("--from", dest="date_from", help="first invoice date to include (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", help="last invoice date to include (YYYY-MM-DD)")
+    parser.add_argument("--status", help="comma-separated invoice statuses (default: Sent,Paid)")
+    parser.add_argument("--days", type=int, default=90, help="sales window for dso")
+    parser.add_argument("--output", help="write the result to this CSV file instead of printing it")
+    parser.add_argument("--limit", type=int, default=50, help="rows to print")
+    args = parser.parse_args()
+
+    by = [group.strip() for group in args.by.split(",") if group.strip()]
+    statuses = args.status.split(",") if args.status else REVENUE_STATUSES
+    conn = schema.connect(args.db)
+    try:
+        if args.command == "revenue":
+            table = aggregate(conn, by, args.source, args.date_from, args.date_to, statuses)
+        elif args.command == "tax":
+            table = aggregate(conn, by or ["month"], "invoices", args.date_from, args.date_to, statuses)
+        elif args.command == "aging":
+            table = aging(conn, by)
+        else:
+            table = days_sales_outstanding(conn, args.days, by)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.output:
+        table.to_csv(args.output)
+        print(f"Wrote {len(table)} rows to {args.output}")
+    else:
+        print(table.format(args.limit))
+        if len(table) > args.limit:
+            print(f"... {len(table) - args.limit} more rows (use --output to save them all)")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+"""Archiving of settled invoices into a second, attached database.
+
+Paid invoices dated before a cutoff, and their items, move to
+`<name>-archive.db` next to the ledger, so the working database only
+holds the invoices people still open and edit and stays small enough to
+live in the page cache. Every connection from schema.connect attaches
+the archive as `archive` when it exists, along with two temporary views
+over both files:
+
+    all_invoices       the invoices columns plus `archived` (0 or 1)
+    all_invoice_items  the invoice_items columns
+
+Read paths use the working tables unless a date range or filter reaches
+into archived periods (see `reaches`). The report summaries keep
+counting archived invoices, so the reports cover the whole history.
+
+Moving rows between two files can't be one transaction: with the ledger
+in WAL mode SQLite commits attached databases one after the other, and a
+crash in between would lose the invoices. So the move goes a chunk of
+invoices at a time. It copies a chunk into the archive and commits there
+without locking the ledger. Then, holding the ledger's write lock only
+briefly, it deletes the chunk's invoices from the ledger, but only those
+whose copy is still identical. Others may have edited one in between;
+an edited invoice stays in the ledger and its copy is dropped. Other
+instances' saves wait at most one chunk's delete. A marker in the
+settings table records a move in progress; `resume` finishes one that
+was interrupted, since every step can be repeated safely.
+
+    python archive.py move --before 2023-01-01
+    python archive.py status
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import date
+
+import changelog
+import reports
+import schema
+from transactions import BUSY_TIMEOUT_S, write_transaction
+
+# Name the archive is attached under
+SCHEMA = "archive"
+# Invoices that are settled and so never edited again
+ARCHIVED_STATUSES = ("Paid",)
+# Settings key holding the cutoff of a move that has not finished
+PENDING_KEY = "archive_pending_before"
+# Invoices moved per chunk; the ledger is locked for one chunk's delete at a time
+CHUNK_INVOICES = 2000
+
+INVOICE_COLUMNS = "id, customer_id, invoice_date, due_date, total_amount, tax_amount, status"
+ITEM_COLUMNS = "id, invoice_id, description, quantity, unit_price"
+
+# The same tables as the ledger's, with the indexes the invoice list sorts and filters by
+_ARCHIVE_TABLES = [
+    """CREATE TABLE IF NOT EXISTS {schema}.invoices (
+        id INTEGER PRIMARY KEY,
+        customer_id INTEGER NOT NULL,
+        invoice_date TEXT NOT NULL,
+        due_date TEXT NOT NULL,
+        total_amount REAL NOT NULL,
+        tax_amount REAL NOT NULL,
+        status TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS {schema}.invoice_items (
+        id INTEGER PRIMARY KEY,
+        invoice_id INTEGER NOT NULL,
+        description TEXT NOT NULL,
+        quantity REAL NOT NULL,
+        unit_price REAL NOT NULL
+    )""",
+    "CREATE TABLE IF NOT EXISTS {schema}.archive_info (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_invoices_invoice_date ON invoices (invoice_date)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_invoices_due_date ON invoices (due_date)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_invoices_status_due_date ON invoices (status, due_date)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_invoices_total_amount ON invoices (total_amount)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_invoices_customer_date ON invoices (customer_id, invoice_date)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_invoice_items_invoice_id ON invoice_items (invoice_id)",
+]
+
+
+def archive_path(db_path):
+    """The archive that belongs to a ledger: `<name>-archive.db` beside it."""
+    stem, _ = os.path.splitext(db_path)
+    return f"{stem}-archive.db"
+
+
+def is_attached(conn):
+    return any(name == SCHEMA for _, name, _ in conn.execute("PRAGMA database_list"))
+
+
+def attach(conn, create=False):
+    """Attach the ledger's archive and create the views over both; returns whether it is attached.
+
+    Without `create`, a ledger that has no archive yet is left alone.
+    """
+    if is_attached(conn):
+        return True
+    db_path = schema.database_path(conn)
+    if not db_path:
+        return False  # In-memory databases have nowhere to keep one
+    path = archive_path(db_path)
+    if not create and not os.path.exists(path):
+        return False
+    conn.execute(f"ATTACH DATABASE ? AS {SCHEMA}", (path,))
+    if create:
+        conn.execute(f"PRAGMA {SCHEMA}.journal_mode = WAL")
+        for statement in _ARCHIVE_TABLES:
+            conn.execute(statement.format(schema=SCHEMA))
+        conn.commit()
+    conn.execute(f"""
+        CREATE TEMP VIEW IF NOT EXISTS all_invoices AS
+        SELECT {INVOICE_COLUMNS}, 0 AS archived FROM main.invoices
+        UNION ALL
+        SELECT {INVOICE_COLUMNS}, 1 AS archived FROM {SCHEMA}.invoices
+    """)
+    conn.execute(f"""
+        CREATE TEMP VIEW IF NOT EXISTS all_invoice_items AS
+        SELECT {ITEM_COLUMNS} FROM main.invoice_items
+        UNION ALL
+        SELECT {ITEM_COLUMNS} FROM {SCHEMA}.invoice_items
+    """)
+    return True
+
+
+def detach(conn):
+    conn.execute("DROP VIEW IF EXISTS temp.all_invoices")
+    conn.execute("DROP VIEW IF EXISTS temp.all_invoice_items")
+    conn.execute(f"DETACH DATABASE {SCHEMA}")
+
+
+def archived_before(conn):
+    """The date before which settled invoices may be archived, or None if nothing is."""
+    if not is_attached(conn):
+        return None
+    row = conn.execute(f"SELECT value FROM {SCHEMA}.archive_info WHERE key = 'archived_before'").fetchone()
+    return row[0] if row else None
+
+
+def reaches(conn, date_from=None, statuses=None):
+    """Whether invoices from `date_from` on (ISO date; None for all) with these statuses can be archived."""
+    before = archived_before(conn)
+    if before is None:
+        return False
+    if statuses is not None and not set(statuses).intersection(ARCHIVED_STATUSES):
+        return False
+    return date_from is None or date_from < before
+
+
+def invoice_table(conn, archived, alias="i"):
+    """The FROM item for invoices: the view over both files if `archived`, otherwise the ledger's table."""
+    return f"all_invoices {alias}" if archived and is_attached(conn) else f"invoices {alias}"
+
+
+def _criteria(alias=""):
+    prefix = f"{alias}." if alias else ""
+    statuses = ", ".join(f"'{status}'" for status in ARCHIVED_STATUSES)
+    return f"{prefix}status IN ({statuses}) AND {prefix}invoice_date < ?"
+
+
+def move_invoices(conn, before, progress=None, chunk_invoices=CHUNK_INVOICES):
+    """Move settled invoices dated before `before` (ISO date) and their items into the archive.
+
+    Returns the number of invoices and items moved. `progress(message)`
+    is called at each step.
+    """
+    before = date.fromisoformat(before).isoformat()
+    if conn.in_transaction:
+        conn.commit()
+    db_path = schema.database_path(conn)
+    path = archive_path(db_path)
+    attach(conn, create=True)
+    with write_transaction(conn):
+        conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (PENDING_KEY, before))
+        # Left by an interrupted move of invoices that have since been reopened
+        conn.execute(f"DELETE FROM {SCHEMA}.invoice_items WHERE invoice_id IN (SELECT id FROM main.invoices)")
+        conn.execute(f"DELETE FROM {SCHEMA}.invoices WHERE id IN (SELECT id FROM main.invoices)")
+    copier = sqlite3.connect(path, timeout=BUSY_TIMEOUT_S)
+    moved_invoices = moved_items = 0
+    after_id = 0
+    try:
+        copier.execute("ATTACH DATABASE ? AS ledger", (db_path,))
+        # First, so readers look in the archive for the invoices as soon as they move
+        _record_cutoff(copier, before)
+        while True:
+            if progress:
+                progress(f"Moving invoices to the archive ({moved_invoices} so far)")
+            chunk = _copy_chunk(copier, before, after_id, chunk_invoices)
+            if chunk is None:
+                break
+            invoices, items = _delete_copied(conn, before, *chunk)
+            moved_invoices += invoices
+            moved_items += items
+            after_id = chunk[1]
+        # Without statistics SQLite sorts filtered archive pages in a temp B-tree
+        copier.execute("ANALYZE main")
+    finally:
+        copier.close()
+    with write_transaction(conn):
+        conn.execute("DELETE FROM settings WHERE key = ?", (PENDING_KEY,))
+    return moved_invoices, moved_items
+
+
+def _copy_chunk(copier, before, after_id, limit):
+    """Copy the next settled invoices after `after_id`, and their items, into the archive and commit.
+
+    `copier` is a connection to the archive with the ledger attached as
+    `ledger`; the ledger is only read, so nobody waits for this. Returns
+    the chunk's (first, last) invoice id, or None when nothing is left.
+    """
+    # A plain BEGIN: IMMEDIATE would also lock the ledger
+    copier.execute("BEGIN")
+    try:
+        ids = copier.execute(f"SELECT id FROM ledger.invoices WHERE {_criteria()} AND id > ? ORDER BY id LIMIT ?",
+                             (before, after_id, limit)).fetchall()
+        if not ids:
+            copier.rollback()
+            return None
+        chunk = (ids[0][0], ids[-1][0])
+        settled = f"SELECT id FROM ledger.invoices WHERE id BETWEEN ? AND ? AND {_criteria()}"
+        copier.execute(f"""
+            INSERT OR REPLACE INTO invoices ({INVOICE_COLUMNS})
+            SELECT {INVOICE_COLUMNS} FROM ledger.invoices WHERE id BETWEEN ? AND ? AND {_criteria()}
+        """, chunk + (before,))
+        # Copied again after an interruption: the lines may have changed since
+        copier.execute(f"DELETE FROM invoice_items WHERE invoice_id IN ({settled})", chunk + (before,))
+        copier.execute(f"""
+            INSERT INTO invoice_items ({ITEM_COLUMNS})
+            SELECT {ITEM_COLUMNS} FROM ledger.invoice_items WHERE invoice_id IN ({settled})
+        """, chunk + (before,))
+        copier.commit()
+    except BaseException:
+        copier.rollback()
+        raise
+    return chunk
+
+
+def _delete_copied(conn, before, first_id, last_id):
+    """Delete the chunk's invoices whose archive copy matches them from the ledger; returns (invoices, items).
+
+    Runs in one short write transaction. Invoices changed since they were
+    copied stay in the ledger, and their copies are removed from the
+    archive.
+    """
+    chunk = (first_id, last_id)
+    with write_transaction(conn):
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_moved (id INTEGER PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.archive_moved")
+        # Still settled, and every column and line the same as the copy
+        conn.execute(f"""
+            INSERT INTO temp.archive_moved (id)
+            SELECT id FROM (
+                SELECT {INVOICE_COLUMNS} FROM main.invoices WHERE id BETWEEN ? AND ? AND {_criteria()}
+                INTERSECT
+                SELECT {INVOICE_COLUMNS} FROM {SCHEMA}.invoices WHERE id BETWEEN ? AND ?)
+            EXCEPT
+            SELECT invoice_id FROM (
+                SELECT {ITEM_COLUMNS} FROM main.invoice_items WHERE invoice_id BETWEEN ? AND ?
+                EXCEPT
+                SELECT {ITEM_COLUMNS} FROM {SCHEMA}.invoice_items WHERE invoice_id BETWEEN ? AND ?)
+            EXCEPT
+            SELECT invoice_id FROM (
+                SELECT {ITEM_COLUMNS} FROM {SCHEMA}.invoice_items WHERE invoice_id BETWEEN ? AND ?
+                EXCEPT
+                SELECT {ITEM_COLUMNS} FROM main.invoice_items WHERE invoice_id BETWEEN ? AND ?)
+        """, chunk + (before,) + chunk * 5)
+        # The report summaries go on counting the archived invoices, and
+        # the change log doesn't report them deleted
+        reports.drop_summary_triggers(conn)
+        changelog.drop_triggers(conn, ["invoices", "invoice_items"])
+        items = conn.execute("DELETE FROM main.invoice_items WHERE invoice_id IN (SELECT id FROM temp.archive_moved)"
+                             ).rowcount
+        invoices = conn.execute("DELETE FROM main.invoices WHERE id IN (SELECT id FROM temp.archive_moved)").rowcount
+        reports.create_summary_triggers(conn)
+        if changelog.has_change_log(conn):
+            changelog.create_triggers(conn, ["invoices", "invoice_items"])
+        # Copies of invoices that were edited meanwhile, and so are still in the ledger
+        conn.execute(f"""
+            DELETE FROM {SCHEMA}.invoice_items WHERE invoice_id IN (
+                SELECT id FROM main.invoices WHERE id BETWEEN ? AND ?)
+        """, chunk)
+        conn.execute(f"""
+            DELETE FROM {SCHEMA}.invoices WHERE id IN (SELECT id FROM main.invoices WHERE id BETWEEN ? AND ?)
+        """, chunk)
+    return invoices, items
+
+
+def _record_cutoff(copier, before):
+    with copier:
+        copier.execute("""
+            INSERT INTO archive_info (key, value) VALUES ('archived_before', ?)
+            ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)
+        """, (before,))
+
+
+def resume(conn):
+    """Finish a move that was interrupted; returns what it moved, or None if none was."""
+    row = conn.execute("SELECT value FROM settings WHERE key = ?", (PENDING_KEY,)).fetchone()
+    return move_invoices(conn, row[0]) if row else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move settled invoices into the archive, or show what it holds.")
+    parser.add_argument("command", choices=("move", "status"))
+    parser.add_argument("--db", default="mybookkeeping.db")
+    parser.add_argument("--before", help="archive paid invoices dated before this day (YYYY-MM-DD)")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="then shrink the ledger file (rewrites it; other instances must be closed)")
+    args = parser.parse_args()
+
+    conn = schema.connect(args.db)
+    schema.migrate(conn)
+    if args.command == "move":
+        if not args.before:
+            parser.error("move needs --before")
+        resumed = resume(conn)
+        if resumed:
+            print(f"Finished an interrupted move of {resumed[0]} invoices.")
+        start = time.perf_counter()
+        invoices, items = move_invoices(conn, args.before, progress=print)
+        print(f"Archived {invoices} invoices and {items} items in {time.perf_counter() - start:.2f} s "
+              f"to {archive_path(args.db)}")
+        if args.vacuum:
+            detach(conn)
+            conn.execute("VACUUM")
+            print(f"Ledger is now {os.path.getsize(args.db) / 1024 ** 2:,.1f} MiB")
+    else:
+        if not is_attached(conn):
+            print("No archive.")
+            conn.close()
+            sys.exit(0)
+        for label, query in (("Working", "SELECT COUNT(*) FROM main.invoices"),
+                             ("Archived", f"SELECT COUNT(*) FROM {SCHEMA}.invoices")):
+            print(f"{label} invoices: {conn.execute(query).fetchone()[0]}")
+        print(f"Archived paid invoices dated before {archived_before(conn)}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
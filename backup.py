@@ -0,0 +1,360 @@
+"""Online backups of the bookkeeping database.
+
+A backup is copied with SQLite's backup API a few hundred pages at a
+time, so the copying connection holds the GIL and the file only briefly
+per step. The copy runs inside one read transaction on the source: in WAL
+mode that never blocks writers, and it pins a single snapshot, so commits
+made meanwhile by the app or other instances don't restart the backup.
+(Without it, every commit by another connection sends the backup back to
+the first page.)
+
+Each copy is checked with PRAGMA quick_check, optionally gzipped, and
+renamed into place only when complete, so a cancelled or failed backup
+never leaves a torn file. The oldest backups beyond `keep` are then
+removed.
+
+When invoices have been archived (see archive.py), the archive is copied
+from the same snapshot into a companion file, `<backup>-archive.db`,
+which is checked, compressed, rotated and restored along with the main
+one. `restore` puts both files back; it must run while nothing has the
+ledger open. (The full integrity_check also compares every index with its
+table; it takes minutes on a large ledger and can only find problems a
+page-for-page copy inherited from the live database, so it is optional.)
+
+    python backup.py --db mybookkeeping.db --keep 7 --compress
+    python backup.py verify backups/mybookkeeping-20240131-180000.db.gz
+    python backup.py restore backups/mybookkeeping-20240131-180000.db.gz --db mybookkeeping.db
+"""
+import argparse
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import archive
+import schema
+from transactions import write_transaction
+
+# Pages copied per backup step (256 pages of 4 KiB is 1 MiB)
+STEP_PAGES = 256
+# Backups kept in the backup directory; older ones are removed
+KEEP_BACKUPS = 7
+# Hours between scheduled backups by default
+BACKUP_INTERVAL_HOURS = 24
+# gzip level for compressed backups. Level 1 is several times faster than the
+# default and database pages compress nearly as well.
+COMPRESS_LEVEL = 1
+# Bytes read and written at a time while compressing
+COPY_CHUNK = 1024 * 1024
+# Page cache used while backing up, in KiB; a one-pass copy gains nothing from caching
+BACKUP_CACHE_KIB = 2048
+# Partial files untouched for this long were left by a backup that never finished
+STALE_PART_S = 3600
+# The settings key recording when the last scheduled backup started
+LAST_BACKUP_KEY = "last_backup_at"
+
+
+class BackupCancelled(Exception):
+    """Raised when a backup is cancelled before it finishes."""
+
+
+class BackupFailed(Exception):
+    """Raised when a backup copy does not pass its integrity check."""
+
+
+def default_directory(db_path):
+    """Where backups go unless configured: a `backups` folder next to the database."""
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), "backups")
+
+
+def _pattern(db_path):
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    return re.compile(re.escape(stem) + r"-\d{8}-\d{6}\.db(\.gz)?$")
+
+
+def companion_path(path):
+    """The archive's copy belonging to a backup: `<stem>-archive.db[.gz]` beside it."""
+    return re.sub(r"\.db(\.gz)?$", r"-archive.db\1", path)
+
+
+def list_backups(directory, db_path):
+    """Completed backups of a database in `directory`, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    pattern = _pattern(db_path)
+    # The timestamp in the name sorts in time order
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if pattern.match(name)]
+
+
+def rotate(directory, db_path, keep=KEEP_BACKUPS):
+    """Remove all but the newest `keep` backups and stale partial files; returns the removed paths."""
+    removed = list_backups(directory, db_path)[:-keep] if keep > 0 else []
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    # Left behind if the app was closed mid-backup; recent ones may be another instance's backup in progress
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if (name.startswith(stem + "-") and name.endswith(".part")
+                and time.time() - os.path.getmtime(path) > STALE_PART_S):
+            removed.append(path)
+    for path in removed[:]:
+        if path.endswith(".part"):
+            continue
+        companion = companion_path(path)
+        if os.path.exists(companion):
+            removed.append(companion)
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def copy_database(conn, path, step_pages=STEP_PAGES, progress=None, cancelled=None, archive_copy=None):
+    """Copy the database behind `conn` to a new file at `path`, a snapshot as of the start.
+
+    With `archive_copy`, the attached archive is copied to that path too,
+    from the same snapshot. `progress(done, total, message)` is called
+    after every step, in pages. If `cancelled()` returns True,
+    BackupCancelled is raised; the caller removes the partial files.
+    """
+    def on_step(message):
+        def step(status, remaining, total):
+            if cancelled and cancelled():
+                raise BackupCancelled("Backup cancelled")
+            if progress:
+                progress(total - remaining, total, message)
+        return step
+
+    copies = [("main", path, "Copying")]
+    if archive_copy:
+        copies.append((archive.SCHEMA, archive_copy, "Copying archive"))
+    owns_transaction = not conn.in_transaction
+    cache_size = conn.execute("PRAGMA cache_size").fetchone()[0]
+    conn.execute(f"PRAGMA cache_size = -{BACKUP_CACHE_KIB}")
+    try:
+        if owns_transaction:
+            # Start reading now, so every step copies the same snapshot (of both files)
+            conn.execute("BEGIN")
+            for name, _, _ in copies:
+                conn.execute(f"SELECT COUNT(*) FROM {name}.sqlite_master").fetchone()
+        for name, copy_path, message in copies:
+            target = sqlite3.connect(copy_path)
+            try:
+                conn.backup(target, pages=step_pages, progress=on_step(message), name=name)
+                # The copy is a single file; it needs no -wal or -shm beside it
+                target.execute("PRAGMA journal_mode = DELETE")
+            finally:
+                target.close()
+    finally:
+        if owns_transaction and conn.in_transaction:
+            conn.rollback()
+        conn.execute(f"PRAGMA cache_size = {cache_size}")
+
+
+def check_database(path, full=False):
+    """Run SQLite's quick or full integrity check on a database file; returns its problems ([] if none)."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("PRAGMA integrity_check" if full else "PRAGMA quick_check").fetchall()
+    finally:
+        conn.close()
+    problems = [row[0] for row in rows]
+    return [] if problems == ["ok"] else problems
+
+
+def compress_file(source, path, progress=None, cancelled=None):
+    """gzip `source` into `path`, reporting bytes done."""
+    total = os.path.getsize(source)
+    done = 0
+    with open(source, "rb") as src, gzip.open(path, "wb", compresslevel=COMPRESS_LEVEL) as dst:
+        while True:
+            if cancelled and cancelled():
+                raise BackupCancelled("Backup cancelled")
+            chunk = src.read(COPY_CHUNK)
+            if not chunk:
+                break
+            dst.write(chunk)
+            done += len(chunk)
+            if progress:
+                progress(done, total, "Compressing")
+
+
+def backup_database(conn, directory=None, keep=KEEP_BACKUPS, compress=False, full_check=False,
+                    progress=None, cancelled=None, step_pages=STEP_PAGES):
+    """Back up the database behind `conn` into `directory` and return the new backup's path.
+
+    The copy is integrity-checked, then compressed if asked, renamed into
+    place and the oldest backups beyond `keep` removed. The archive, when
+    attached, goes to the backup's companion_path the same way. Raises
+    BackupFailed if a check finds problems and BackupCancelled if cancelled.
+    """
+    db_path = schema.database_path(conn)
+    directory = directory or default_directory(db_path)
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    path = os.path.join(directory, f"{stem}-{datetime.now():%Y%m%d-%H%M%S}.db")
+    if compress:
+        path += ".gz"
+    # (final path, copy, compressed copy) of the backup and of the archive's copy if there is one
+    files = [(path, path + ".copy.part", path + ".part")]
+    if archive.is_attached(conn):
+        companion = companion_path(path)
+        files.append((companion, companion + ".copy.part", companion + ".part"))
+    try:
+        copy_database(conn, files[0][1], step_pages, progress, cancelled,
+                      archive_copy=files[1][1] if len(files) > 1 else None)
+        for final_path, copy_path, temp_path in files:
+            if progress:
+                progress(0, None, "Checking")
+            problems = check_database(copy_path, full_check)
+            if problems:
+                raise BackupFailed(f"The backup copy of {os.path.basename(final_path)} failed its integrity "
+                                   f"check: {'; '.join(problems[:5])}")
+            if compress:
+                compress_file(copy_path, temp_path, progress, cancelled)
+                os.remove(copy_path)
+            else:
+                os.replace(copy_path, temp_path)
+        # The main file last: a backup is listed only once its archive copy is in place
+        for final_path, _, temp_path in reversed(files):
+            os.replace(temp_path, final_path)
+    except BaseException:
+        for _, copy_path, temp_path in files:
+            for partial in (copy_path, temp_path):
+                if os.path.exists(partial):
+                    os.remove(partial)
+        # An archive copy without its main file is no backup
+        if len(files) > 1 and not os.path.exists(path) and os.path.exists(files[1][0]):
+            os.remove(files[1][0])
+        raise
+    rotate(directory, db_path, keep)
+    return path
+
+
+def _check_file(path, full):
+    if not path.endswith(".gz"):
+        return check_database(path, full)
+    fd, temp_path = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "wb") as dst, gzip.open(path, "rb") as src:
+            shutil.copyfileobj(src, dst, COPY_CHUNK)
+        return check_database(temp_path, full)
+    finally:
+        os.remove(temp_path)
+
+
+def verify_backup(path, full=False):
+    """Integrity-check a backup and its archive copy, decompressing them to temporary files if gzipped."""
+    problems = _check_file(path, full)
+    companion = companion_path(path)
+    if os.path.exists(companion):
+        problems += [f"{os.path.basename(companion)}: {problem}" for problem in _check_file(companion, full)]
+    return problems
+
+
+def _restore_file(source, path):
+    """Replace the database at `path` with a backup file, leaving no stale -wal or -shm beside it."""
+    temp_path = path + ".restore.part"
+    try:
+        opener = gzip.open if source.endswith(".gz") else open
+        with opener(source, "rb") as src, open(temp_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, COPY_CHUNK)
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def restore_backup(path, db_path):
+    """Put a backup, and its archive copy if it has one, back in place of the database at `db_path`.
+
+    Nothing may have the database open. An archive the backup has no copy
+    of (one made after the backup was taken) is renamed to
+    `<archive>.before-restore` rather than deleted, since the restored
+    ledger would otherwise list its invoices twice or not at all.
+    Returns the paths written.
+    """
+    problems = verify_backup(path)
+    if problems:
+        raise BackupFailed(f"{path} failed its integrity check: {'; '.join(problems[:5])}")
+    archive_db = archive.archive_path(db_path)
+    companion = companion_path(path)
+    restored = [db_path]
+    if os.path.exists(companion):
+        _restore_file(companion, archive_db)
+        restored.append(archive_db)
+    elif os.path.exists(archive_db):
+        os.replace(archive_db, archive_db + ".before-restore")
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(archive_db + suffix):
+                os.remove(archive_db + suffix)
+    _restore_file(path, db_path)
+    return restored
+
+
+def claim_scheduled_backup(conn, interval_hours, now=None):
+    """Whether a scheduled backup is due; if so, record that this connection is taking it.
+
+    Instances sharing the database all ask, but the check and the update
+    happen in one write transaction, so only one of them gets True.
+    """
+    if interval_hours <= 0:
+        return False
+    now = time.time() if now is None else now
+    with write_transaction(conn):
+        row = conn.execute("SELECT value FROM settings WHERE key = ?", (LAST_BACKUP_KEY,)).fetchone()
+        if row and now - float(row[0]) < interval_hours * 3600:
+            return False
+        conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (LAST_BACKUP_KEY, str(now)))
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Back up the bookkeeping database, or verify or restore a backup.")
+    parser.add_argument("command", nargs="?", choices=("backup", "verify", "restore"), default="backup")
+    parser.add_argument("backup_path", nargs="?", help="the backup to verify or restore")
+    parser.add_argument("--db", default="mybookkeeping.db")
+    parser.add_argument("--dir", help="backup directory (default: backups/ next to the database)")
+    parser.add_argument("--keep", type=int, default=KEEP_BACKUPS, help="backups to keep")
+    parser.add_argument("--compress", action="store_true", help="gzip the backup")
+    parser.add_argument("--full", action="store_true", help="run the full, much slower integrity_check")
+    args = parser.parse_args()
+
+    if args.command == "verify":
+        if not args.backup_path:
+            parser.error("verify needs the path of a backup")
+        problems = verify_backup(args.backup_path, args.full)
+        for line in problems[:50]:
+            print(line)
+        print(f"{args.backup_path} is intact." if not problems else f"{len(problems)} problems found.")
+        sys.exit(1 if problems else 0)
+    if args.command == "restore":
+        if not args.backup_path:
+            parser.error("restore needs the path of a backup")
+        try:
+            restored = restore_backup(args.backup_path, args.db)
+        except BackupFailed as e:
+            parser.exit(1, f"{e}\n")
+        print(f"Restored {', '.join(restored)} from {args.backup_path}.")
+        return
+
+    conn = schema.connect(args.db)
+    start = time.perf_counter()
+    path = backup_database(conn, args.dir, args.keep, args.compress, args.full,
+                           progress=lambda done, total, message: print(
+                               f"  {message}: {done}/{total}..." if total else f"  {message}...", end="\r"))
+    print()
+    print(f"Backed up {args.db} to {path} ({os.path.getsize(path) / 1024 ** 2:,.1f} MiB) "
+          f"in {time.perf_counter() - start:.2f} s")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
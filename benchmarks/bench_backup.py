@@ -0,0 +1,96 @@
+"""Check that an online backup doesn't stall the app or other writers.
+
+Backs up a database on a background thread, as the app does, while the
+main thread ticks every few milliseconds (standing in for the Tk event
+loop) and another process keeps committing invoices. Reports how late
+the longest tick and the slowest commit were:
+
+    python benchmarks/bench_backup.py --db /tmp/bench.db --compress
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import backup  # noqa: E402
+import ledger  # noqa: E402
+import schema  # noqa: E402
+
+TICK_S = 0.005
+
+
+def writer(path, stop, results):
+    conn = schema.connect(path)
+    customer_id = conn.execute("SELECT MIN(id) FROM customers").fetchone()[0]
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        ledger.save_invoice(conn, None, customer_id, "2024-01-15", "2024-02-15", [("Backup test", 1, 10.0)],
+                            tax_rate=0.2)
+        latencies.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.01)
+    conn.close()
+    results.put(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", required=True, help="database to back up (it is copied first)")
+    parser.add_argument("--compress", action="store_true")
+    parser.add_argument("--full-check", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        shutil.copy(args.db, path)
+        size_mib = os.path.getsize(path) / 1024 ** 2
+        # Write the setup copy out first, or flushing it stalls the measurement
+        os.sync()
+
+        stop = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=writer, args=(path, stop, results))
+        process.start()
+
+        outcome = {}
+
+        def run_backup():
+            conn = schema.connect(path, check_same_thread=False)
+            start = time.perf_counter()
+            try:
+                outcome["path"] = backup.backup_database(conn, os.path.join(directory, "backups"),
+                                                         compress=args.compress, full_check=args.full_check)
+            except Exception as e:
+                outcome["error"] = e
+            outcome["seconds"] = time.perf_counter() - start
+            conn.close()
+
+        thread = threading.Thread(target=run_backup)
+        thread.start()
+        worst_tick = 0
+        while thread.is_alive():
+            start = time.perf_counter()
+            time.sleep(TICK_S)
+            worst_tick = max(worst_tick, time.perf_counter() - start - TICK_S)
+        thread.join()
+        stop.set()
+        latencies = results.get()
+        process.join()
+
+        if "error" in outcome:
+            print(f"Backup failed: {outcome['error']}")
+            sys.exit(1)
+        print(f"Backed up {size_mib:,.0f} MiB in {outcome['seconds']:.1f} s "
+              f"({os.path.getsize(outcome['path']) / 1024 ** 2:,.0f} MiB written)")
+        print(f"Longest main-thread stall: {worst_tick * 1000:.1f} ms")
+        print(f"Writer: {len(latencies)} commits during the backup, slowest {max(latencies, default=0):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
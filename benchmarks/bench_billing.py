@@ -0,0 +1,92 @@
+"""Time a monthly billing run over many recurring invoices.
+
+Creates a fresh database (or copies --db) with the given number of
+subscription customers, each with a recurring invoice of --lines lines,
+bills one month, then bills it again to check that the second run adds
+nothing. Also checks the report summaries against the new invoices:
+
+    python benchmarks/bench_billing.py --customers 20000 --lines 10
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import billing  # noqa: E402
+import reports  # noqa: E402
+import schema  # noqa: E402
+from transactions import write_transaction  # noqa: E402
+
+MONTH = "2024-03"
+
+
+def create_templates(conn, customers, lines):
+    with write_transaction(conn):
+        first = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM customers").fetchone()[0]
+        conn.executemany("INSERT INTO customers (id, name, email, contact) VALUES (?, ?, ?, '')",
+                         [(first + n, f"Subscriber {n}", f"subscriber{n}@example.com") for n in range(customers)])
+    for n in range(customers):
+        billing.add_template(conn, first + n, [(f"Service {k}", 1 + k % 3, 9.99 + k) for k in range(lines)],
+                             "2024-01-01", interval_months=1 if n % 4 else 3)
+
+
+def check_mid_month_start(conn):
+    """A template starting after the invoice date isn't billed that month; returns the problems found."""
+    customer_id = conn.execute("SELECT MIN(id) FROM customers").fetchone()[0]
+    template_id = billing.add_template(conn, customer_id, [("Late starter", 1, 10.0)], "2024-03-20")
+    due = {row[0] for row in billing.due_templates(conn, MONTH)}
+    problems = []
+    if template_id in due:
+        problems.append("a template starting 2024-03-20 is due in the 2024-03-01 run")
+    if template_id not in {row[0] for row in billing.due_templates(conn, MONTH, date(2024, 3, 25))}:
+        problems.append("a template starting 2024-03-20 is not due in a run dated 2024-03-25")
+    if not billing.is_due("2024-03-20", 1, None, billing.parse_month("2024-04")):
+        problems.append("a template starting 2024-03-20 is not due in 2024-04")
+    billing.set_active(conn, template_id, False)
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--customers", type=int, default=20000)
+    parser.add_argument("--lines", type=int, default=10)
+    parser.add_argument("--db", help="database to add the subscribers to (it is copied first)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        if args.db:
+            shutil.copy(args.db, path)
+        conn = schema.connect(path)
+        schema.migrate(conn)
+        start = time.perf_counter()
+        create_templates(conn, args.customers, args.lines)
+        print(f"Created {args.customers} recurring invoices in {time.perf_counter() - start:.1f} s")
+        date_problems = check_mid_month_start(conn)
+
+        result = billing.run_billing(conn, MONTH)
+        print(result)
+        again = billing.run_billing(conn, MONTH)
+        print(f"Second run: {again}")
+        due = len(billing.due_templates(conn, MONTH))
+        billed = conn.execute("SELECT COUNT(*) FROM recurring_billed WHERE month = ?", (MONTH,)).fetchone()[0]
+        problems = reports.verify(conn)
+        conn.close()
+
+    failed = again.invoices or billed != due or result.invoices != due or problems or date_problems
+    if failed:
+        print(f"FAILED: {due} due, {billed} billed, {again.invoices} billed twice, "
+              f"{len(problems)} summary differences")
+        for problem in date_problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
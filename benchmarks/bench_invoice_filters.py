@@ -0,0 +1,159 @@
+"""Time the Invoices tab's filtered views.
+
+For each typical filter this does what the tab does when the filter is
+applied: count the matching invoices, read the first page and then the
+next one. Uses the same pager and filter code as the app. First checks
+that every sort lists the invoices of a deleted customer and walks the
+whole list in both directions.
+
+    python benchmarks/bench_invoice_filters.py --invoices 5000000
+    python benchmarks/bench_invoice_filters.py --db mybookkeeping.db --sort invoice_date
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ledger  # noqa: E402
+import schema  # noqa: E402
+import search  # noqa: E402
+
+PAGE_ROWS = 60
+TODAY = date(2026, 6, 15)
+
+
+def build(path, invoices, seed):
+    """Invoices spread over ten years up to TODAY; almost all old ones are paid."""
+    rng = random.Random(seed)
+    conn = schema.connect(path)
+    schema.migrate(conn)
+    customers = max(1, invoices // 50)
+    with conn:
+        conn.executemany("INSERT INTO customers (name, email, contact) VALUES (?, ?, ?)",
+                         ((f"Customer {n:06d}", f"c{n}@example.com", f"555-{n:07d}") for n in range(customers)))
+    first = TODAY.toordinal() - 3650
+
+    def rows():
+        for n in range(invoices):
+            invoice_date = date.fromordinal(first + 3650 * n // invoices)
+            recent = TODAY.toordinal() - invoice_date.toordinal() < 60
+            roll = rng.random()
+            if recent:
+                status = "Draft" if roll < 0.5 else "Sent"
+            else:
+                status = "Paid" if roll < 0.985 else "Sent" if roll < 0.995 else "Draft"
+            yield (rng.randint(1, customers), invoice_date.isoformat(),
+                   (invoice_date + timedelta(days=30)).isoformat(), round(rng.uniform(10, 5000), 2), 0.0, status)
+
+    with conn:
+        conn.executemany("INSERT INTO invoices (customer_id, invoice_date, due_date, total_amount, tax_amount, status) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", rows())
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def check_deleted_customer(path):
+    """Page through 3 customers' invoices after deleting one; returns the sorts that lose or repeat rows."""
+    conn = schema.connect(path)
+    schema.migrate(conn)
+    with conn:
+        conn.executemany("INSERT INTO customers (name, email, contact) VALUES (?, '', '')",
+                         [(f"Customer {n}",) for n in range(3)])
+        conn.executemany("INSERT INTO invoices (customer_id, invoice_date, due_date, total_amount, tax_amount, status) "
+                         "VALUES (?, ?, ?, ?, 0, ?)",
+                         [(n % 3 + 1, f"2024-01-{n % 28 + 1:02d}", "2024-03-01", n % 7, ("Draft", "Paid")[n % 2])
+                          for n in range(150)])
+    ledger.delete_customers(conn, [2])
+    pager = ledger.invoice_pager()
+    problems = []
+    for sort in sorted(pager.sort_columns):
+        for descending in (False, True):
+            pager.set_sort(sort, descending)
+            total = pager.count(conn)
+            forward = pager.first(conn, 20)
+            while forward and len(forward) < total + 1:
+                page = pager.page_after(conn, pager.key(forward[-1]), 20)
+                if not page:
+                    break
+                forward += page
+            backward = pager.last(conn, 20)
+            while backward and len(backward) < total + 1:
+                page = pager.page_before(conn, pager.key(backward[0]), 20)
+                if not page:
+                    break
+                backward = page + backward
+            jumps = [row for offset in range(0, total, 20) for row in pager.page_at(conn, offset, 20, total)]
+            ordered = all(pager.comes_before(a, b) for a, b in zip(forward, forward[1:]))
+            if total != 150 or not forward == backward == jumps or len({row[0] for row in forward}) != 150 \
+                    or not ordered:
+                problems.append(f"{sort}{' descending' if descending else ''}")
+    conn.close()
+    return problems
+
+
+def filters(fts_enabled):
+    quarter = ledger.period_dates("This quarter", TODAY)
+    last_month = ledger.period_dates("Last month", TODAY)
+    return [
+        ("Everything", {}),
+        ("Draft", dict(status="Draft")),
+        ("Overdue", dict(overdue=True, today=TODAY)),
+        ("This quarter", dict(date_from=quarter[0], date_to=quarter[1])),
+        ("Sent last month", dict(status="Sent", date_from=last_month[0], date_to=last_month[1])),
+        ("One customer", dict(customer=search.customer_filter("Customer 000042", fts_enabled))),
+        ("One customer, last year", dict(customer=search.customer_filter("000042", fts_enabled),
+                                         date_from=f"{TODAY.year - 1}-01-01", date_to=f"{TODAY.year - 1}-12-31")),
+        ("Total 4990 to 5000", dict(min_amount=4990, max_amount=5000)),
+    ]
+
+
+def measure(conn, sort, repeat):
+    pager = ledger.invoice_pager()
+    pager.set_sort(sort)
+    fts_enabled = search.has_customer_index(conn)
+    for label, criteria in filters(fts_enabled):
+        pager.set_filter(*ledger.invoice_filter(**criteria))
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            total = pager.count(conn)
+            rows = pager.page_at(conn, 0, PAGE_ROWS, total)
+            if rows:
+                pager.page_after(conn, pager.key(rows[-1]), PAGE_ROWS)
+            best = min(best, time.perf_counter() - start)
+        print(f"  {label:<26} {total:>9} invoices {best * 1000:>9.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invoices", type=int, default=500000)
+    parser.add_argument("--db", help="measure an existing database instead of building one")
+    parser.add_argument("--sort", default="id", choices=sorted(ledger.invoice_pager().sort_columns))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        problems = check_deleted_customer(os.path.join(directory, "deleted.db"))
+        if problems:
+            print(f"FAILED: invoices of a deleted customer lost or repeated when sorted by {', '.join(problems)}")
+            sys.exit(1)
+        path = args.db
+        if not path:
+            path = os.path.join(directory, "bench.db")
+            print(f"Building {args.invoices} invoices...")
+            build(path, args.invoices, args.seed)
+        conn = schema.connect(path)
+        schema.migrate(conn)
+        print(f"Count + first two pages of {PAGE_ROWS} rows, sorted by {args.sort} (best of {args.repeat}):")
+        measure(conn, args.sort, args.repeat)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Time saving a one-line edit to invoices of different sizes.
+
+Compares replacing every item (the old save) with writing only the lines
+that changed, on invoices with few and many lines:
+
+    python benchmarks/bench_invoice_save.py --lines 5 500 50000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import ledger  # noqa: E402
+import schema  # noqa: E402
+
+
+def build_invoice(conn, lines):
+    conn.execute("INSERT INTO customers (name, email, contact) VALUES ('Bench', 'bench@example.com', '')")
+    items = [(f"Meter reading {n}", 1.0, 0.25) for n in range(lines)]
+    invoice_id = ledger.save_invoice(conn, None, 1, "2024-01-01", "2024-01-31", items)
+    loaded = {item_id: (description, quantity, unit_price) for item_id, description, quantity, unit_price in
+              conn.execute("SELECT id, description, quantity, unit_price FROM invoice_items WHERE invoice_id = ?",
+                           (invoice_id,))}
+    return invoice_id, loaded
+
+
+def time_save(conn, invoice_id, loaded, diff, repeat):
+    # Edit the last line, as a user changing one reading would
+    items = [(item_id,) + values for item_id, values in loaded.items()]
+    best = float("inf")
+    for n in range(repeat):
+        item_id, description, quantity, unit_price = items[-1]
+        items[-1] = (item_id, description, quantity + 1, unit_price)
+        start = time.perf_counter()
+        if diff:
+            ledger.save_invoice(conn, invoice_id, 1, "2024-01-01", "2024-01-31", items,
+                                tax_rate=0.2, loaded_items=loaded)
+            loaded[item_id] = items[-1][1:]
+        else:
+            ledger.save_invoice(conn, invoice_id, 1, "2024-01-01", "2024-01-31", [item[1:] for item in items],
+                                tax_rate=0.2)
+            # Replacing gives every line a new id
+            loaded = {item_id: values for item_id, *values in
+                      conn.execute("SELECT id, description, quantity, unit_price FROM invoice_items "
+                                   "WHERE invoice_id = ?", (invoice_id,))}
+            loaded = {item_id: tuple(values) for item_id, values in loaded.items()}
+            items = [(item_id,) + values for item_id, values in loaded.items()]
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, nargs="+", default=[5, 500, 50000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'lines':>8} {'replace all':>14} {'changes only':>14}")
+    for lines in args.lines:
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = schema.connect(os.path.join(tmp, "bench.db"))
+            schema.migrate(conn)
+            invoice_id, loaded = build_invoice(conn, lines)
+            replace = time_save(conn, invoice_id, dict(loaded), False, args.repeat)
+            invoice_id, loaded = build_invoice(conn, lines)
+            diff = time_save(conn, invoice_id, loaded, True, args.repeat)
+            conn.close()
+        print(f"{lines:>8} {replace * 1000:>12.2f}ms {diff * 1000:>12.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Back up a ledger with archived invoices and restore it from the backup.
+
+Generates a database (or copies --db), archives the paid invoices dated
+before --before, backs it up, then damages both files (deleting every
+invoice in the ledger and in the archive) and restores the backup.
+Checks that the backup has an archive copy and that the invoices on
+both sides, archived ones included, come back as they were:
+
+    python benchmarks/bench_restore.py --items 50000 --compress
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import archive  # noqa: E402
+import backup  # noqa: E402
+import datagen  # noqa: E402
+import reports  # noqa: E402
+import schema  # noqa: E402
+
+
+def fingerprint(conn):
+    """(invoices, items, total) in the ledger and in the archive."""
+    counts = []
+    for name in ("main", archive.SCHEMA):
+        counts.append(conn.execute(f"""
+            SELECT (SELECT COUNT(*) FROM {name}.invoices), (SELECT COUNT(*) FROM {name}.invoice_items),
+                   (SELECT ROUND(COALESCE(SUM(total_amount), 0), 2) FROM {name}.invoices)""").fetchone())
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=50000, help="invoice items to generate")
+    parser.add_argument("--db", help="database to use instead (it is copied first)")
+    parser.add_argument("--before", default="2022-01-01", help="archive paid invoices dated before this")
+    parser.add_argument("--compress", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        if args.db:
+            shutil.copy(args.db, path)
+        else:
+            datagen.generate(path, args.items)
+        conn = schema.connect(path)
+        schema.migrate(conn)
+        invoices, items = archive.move_invoices(conn, args.before)
+        print(f"Archived {invoices} invoices and {items} items")
+        before = fingerprint(conn)
+
+        start = time.perf_counter()
+        backup_path = backup.backup_database(conn, os.path.join(directory, "backups"), compress=args.compress)
+        print(f"Backed up in {time.perf_counter() - start:.2f} s: {os.path.basename(backup_path)} and "
+              f"{os.path.basename(backup.companion_path(backup_path))}")
+
+        with conn:
+            for name in ("main", archive.SCHEMA):
+                conn.execute(f"DELETE FROM {name}.invoice_items")
+                conn.execute(f"DELETE FROM {name}.invoices")
+        conn.close()
+
+        start = time.perf_counter()
+        restored = backup.restore_backup(backup_path, path)
+        print(f"Restored {len(restored)} files in {time.perf_counter() - start:.2f} s")
+        conn = schema.connect(path)
+        after = fingerprint(conn)
+        problems = reports.verify(conn)
+        conn.close()
+
+    print(f"Ledger:  {before[0]} before, {after[0]} after")
+    print(f"Archive: {before[1]} before, {after[1]} after")
+    if after != before or not before[1][0] or len(restored) != 2 or problems:
+        print(f"FAILED ({len(problems)} summary differences)")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Before/after benchmark for the hot-path indexes and connection pragmas.
+
+Builds a synthetic database with only the base tables, times the app's
+invoice queries and prints their query plans, then applies the remaining
+migrations through a tuned connection and repeats the measurements.
+
+    python benchmarks/bench_schema.py --invoices 200000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import schema  # noqa: E402
+
+QUERIES = [
+    ("Invoice list (load_invoices)",
+     "SELECT i.id, c.name, i.invoice_date, i.due_date, i.total_amount, i.status "
+     "FROM invoices i JOIN customers c ON i.customer_id = c.id ORDER BY i.id", None),
+    ("Items of one invoice (load_invoice_data)",
+     "SELECT description, quantity, unit_price FROM invoice_items WHERE invoice_id = ?", "invoice"),
+    ("Delete items of one invoice (delete_invoice/save_invoice)",
+     "DELETE FROM invoice_items WHERE invoice_id = ?", "invoice"),
+    ("Invoices of one customer",
+     "SELECT id, invoice_date, total_amount FROM invoices WHERE customer_id = ?", "customer"),
+    ("Overdue invoices",
+     "SELECT id, due_date FROM invoices WHERE status = 'Sent' AND due_date < '2024-01-01'", None),
+]
+
+
+def build(path, invoices, items_per_invoice, seed):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    schema.migrate(conn, target=2)
+    customers = max(1, invoices // 10)
+    conn.executemany("INSERT INTO customers (name, email, contact) VALUES (?, ?, ?)",
+                     ((f"Customer {n}", f"c{n}@example.com", f"555-{n:07d}") for n in range(customers)))
+    statuses = ["Draft", "Sent", "Paid"]
+    conn.executemany(
+        "INSERT INTO invoices (customer_id, invoice_date, due_date, total_amount, tax_amount, status) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        ((rng.randint(1, customers), f"20{rng.randint(20, 24)}-{rng.randint(1, 12):02d}-01",
+          f"20{rng.randint(20, 24)}-{rng.randint(1, 12):02d}-28", 120.0, 20.0, rng.choice(statuses))
+         for _ in range(invoices)))
+    conn.executemany(
+        "INSERT INTO invoice_items (invoice_id, description, quantity, unit_price) VALUES (?, ?, ?, ?)",
+        ((n, f"Item {k}", 1.0, 100.0) for n in range(1, invoices + 1) for k in range(items_per_invoice)))
+    conn.commit()
+    conn.close()
+    return customers
+
+
+def measure(conn, invoices, customers, repeat, seed):
+    rng = random.Random(seed)
+    results = []
+    for label, query, argument in QUERIES:
+        params = ()
+        if argument == "invoice":
+            params = (rng.randint(1, invoices),)
+        elif argument == "customer":
+            params = (rng.randint(1, customers),)
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+
+        runs = 1 if argument is None else repeat
+        conn.execute(query, params).fetchall()  # Warm the page cache first
+        start = time.perf_counter()
+        for _ in range(runs):
+            if argument == "invoice":
+                params = (rng.randint(1, invoices),)
+            elif argument == "customer":
+                params = (rng.randint(1, customers),)
+            conn.execute(query, params).fetchall()
+        elapsed_ms = (time.perf_counter() - start) * 1000 / runs
+        # Keep the data identical for the second pass
+        conn.rollback()
+        results.append((label, elapsed_ms, plan))
+    return results
+
+
+def report(title, conn, results):
+    print(f"\n=== {title} ===")
+    for pragma in ("journal_mode", "synchronous", "cache_size", "mmap_size"):
+        print(f"  PRAGMA {pragma} = {conn.execute(f'PRAGMA {pragma}').fetchone()[0]}")
+    for label, elapsed_ms, plan in results:
+        print(f"\n  {label}: {elapsed_ms:.3f} ms")
+        for step in plan:
+            print(f"    {step}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invoices", type=int, default=100000)
+    parser.add_argument("--items-per-invoice", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=200, help="runs of each per-row lookup")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        print(f"Building {args.invoices} invoices with {args.items_per_invoice} items each...")
+        customers = build(path, args.invoices, args.items_per_invoice, args.seed)
+
+        conn = sqlite3.connect(path)
+        before = measure(conn, args.invoices, customers, args.repeat, args.seed)
+        report("Before: base schema, default pragmas", conn, before)
+        conn.close()
+
+        conn = schema.connect(path)
+        start = time.perf_counter()
+        applied = schema.migrate(conn)
+        print(f"\nApplied migrations {applied} in {time.perf_counter() - start:.2f} s")
+        after = measure(conn, args.invoices, customers, args.repeat, args.seed)
+        report("After: all migrations, tuned pragmas", conn, after)
+        conn.close()
+
+        print("\n=== Speed-up ===")
+        for (label, before_ms, _), (_, after_ms, _) in zip(before, after):
+            print(f"  {label}: {before_ms:.3f} ms -> {after_ms:.3f} ms ({before_ms / max(after_ms, 1e-6):.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
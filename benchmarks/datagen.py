@@ -0,0 +1,148 @@
+"""Deterministic synthetic data for benchmarking the bookkeeping app.
+
+Writes a complete database (every migration applied, search index built)
+with customers, invoices and invoice items. The same scale and seed always
+produce the same rows, so benchmark runs on different machines or commits
+are comparable.
+
+    python benchmarks/datagen.py --scale medium                 # 1M invoice items
+    python benchmarks/datagen.py --items 250000 --output /tmp/bench.db
+
+Rows are loaded into the base tables first; the search index and the
+secondary indexes are built afterwards by the later migrations, which is
+much faster than maintaining them row by row.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ledger  # noqa: E402
+import schema  # noqa: E402
+
+# Invoice items at each named scale
+SCALES = {
+    "small": 10_000,
+    "medium": 1_000_000,
+    "large": 10_000_000,
+}
+# Invoices are dated over the ten years up to this day
+LAST_DATE = date(2026, 6, 30)
+DAYS = 3650
+MAX_ITEMS_PER_INVOICE = 9  # 5 on average
+INVOICES_PER_CUSTOMER = 20
+TAX_RATE = 0.2
+CHUNK_INVOICES = 10_000
+
+FIRST_NAMES = ["Ada", "Ben", "Chloé", "Dmitri", "Elena", "Farah", "Gustav", "Hana", "Ivan", "Jana", "Kofi",
+               "Lena", "Mateo", "Nia", "Omar", "Priya", "Quinn", "Rosa", "Sven", "Tariq", "Uma", "Viktor",
+               "Wen", "Xavier", "Yara", "Zoltán"]
+LAST_NAMES = ["Andersson", "Brown", "Castillo", "Dubois", "Eriksen", "Fischer", "García", "Hughes", "Ito",
+              "Jensen", "Kowalski", "López", "Müller", "Nakamura", "O'Brien", "Patel", "Quispe", "Rossi",
+              "Smith", "Tanaka", "Urquhart", "Virtanen", "Wójcik", "Xu", "Yilmaz", "Zhang"]
+COMPANY_SUFFIXES = ["", "", "", " Ltd", " & Co", " Consulting", " Trading"]
+ITEMS = [("Consulting hour", 40.0, 180.0), ("Support plan", 20.0, 120.0), ("Meter reading", 0.1, 0.5),
+         ("Hosting (monthly)", 5.0, 80.0), ("Licence seat", 10.0, 60.0), ("Travel", 15.0, 400.0),
+         ("Hardware", 50.0, 2500.0), ("Training day", 300.0, 1200.0)]
+
+
+def customer_rows(count, rng):
+    for n in range(1, count + 1):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        name = f"{first} {last}{rng.choice(COMPANY_SUFFIXES)}"
+        email = f"{first.lower()}.{last.lower().replace(chr(39), '')}{n}@example.com"
+        yield (n, name, email, f"+44 20 {rng.randint(1000, 9999)} {n % 10000:04d}")
+
+
+def invoice_status(invoice_date, rng):
+    """Recent invoices are still open; old ones are almost all paid."""
+    age = LAST_DATE.toordinal() - invoice_date.toordinal()
+    roll = rng.random()
+    if age < 60:
+        return "Draft" if roll < 0.4 else "Sent"
+    return "Paid" if roll < 0.985 else "Sent" if roll < 0.995 else "Draft"
+
+
+def generate(path, items, seed=1, progress=None):
+    """Create a database at `path` with about `items` invoice items; returns row counts."""
+    rng = random.Random(seed)
+    invoices = max(1, items // ((1 + MAX_ITEMS_PER_INVOICE) // 2))
+    customers = max(10, invoices // INVOICES_PER_CUSTOMER)
+
+    conn = schema.connect(path)
+    schema.migrate(conn, target=1)
+    with conn:
+        conn.executemany("INSERT INTO customers (id, name, email, contact) VALUES (?, ?, ?, ?)",
+                         customer_rows(customers, rng))
+
+    first_day = LAST_DATE.toordinal() - DAYS
+    item_id = 0
+    invoice_id = 0
+    while item_id < items:
+        invoice_rows = []
+        item_rows = []
+        for _ in range(CHUNK_INVOICES):
+            if item_id >= items:
+                break
+            invoice_id += 1
+            # Ids grow with the date, as they do in real use
+            invoice_date = date.fromordinal(first_day + DAYS * invoice_id // (invoices + 1))
+            lines = []
+            for _ in range(min(rng.randint(1, MAX_ITEMS_PER_INVOICE), items - item_id)):
+                description, low, high = rng.choice(ITEMS)
+                item_id += 1
+                lines.append((description, float(rng.randint(1, 20)), round(rng.uniform(low, high), 2)))
+                item_rows.append((item_id, invoice_id) + lines[-1])
+            _, tax_amount, total_amount = ledger.calculate_totals(lines, TAX_RATE)
+            invoice_rows.append((invoice_id, rng.randint(1, customers), invoice_date.isoformat(),
+                                 (invoice_date + timedelta(days=30)).isoformat(), round(total_amount, 2),
+                                 round(tax_amount, 2), invoice_status(invoice_date, rng)))
+        with conn:
+            conn.executemany("INSERT INTO invoices (id, customer_id, invoice_date, due_date, total_amount, "
+                             "tax_amount, status) VALUES (?, ?, ?, ?, ?, ?, ?)", invoice_rows)
+            conn.executemany("INSERT INTO invoice_items (id, invoice_id, description, quantity, unit_price) "
+                             "VALUES (?, ?, ?, ?, ?)", item_rows)
+        if progress:
+            progress(item_id, items)
+
+    with conn:
+        conn.execute("UPDATE settings SET value = ? WHERE key = 'tax_rate'", (str(TAX_RATE),))
+    # Search index and secondary indexes, built in one pass each
+    schema.migrate(conn)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return {"customers": customers, "invoices": invoice_id, "invoice_items": item_id}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument("--scale", choices=SCALES, default="small")
+    size.add_argument("--items", type=int, help="number of invoice items (overrides --scale)")
+    parser.add_argument("--output", default="mybookkeeping.db")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--force", action="store_true", help="replace the output database if it exists")
+    args = parser.parse_args()
+
+    items = args.items or SCALES[args.scale]
+    if os.path.exists(args.output):
+        if not args.force:
+            parser.error(f"{args.output} already exists; pass --force to replace it")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.output + suffix):
+                os.remove(args.output + suffix)
+
+    start = time.perf_counter()
+    counts = generate(args.output, items, args.seed,
+                      progress=lambda done, total: print(f"  {done}/{total} invoice items...", end="\r"))
+    print()
+    print(f"Wrote {counts['customers']} customers, {counts['invoices']} invoices and "
+          f"{counts['invoice_items']} invoice items to {args.output} in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Measure how long the app takes to start, from source or a PyInstaller build.
+
+Each run launches the app as a new process in a scratch directory, with
+BOOKKEEPING_STARTUP_PROBE set. The app then prints when its window was
+first painted and when the deferred theme and icon were in, and quits.
+Times are measured from just before the process is started, so they
+include interpreter start-up (or the frozen bootloader).
+
+    python benchmarks/startup.py --runs 20
+    pyinstaller bookkeeping.spec && python benchmarks/startup.py --frozen dist/bookkeeping/bookkeeping
+    sudo python benchmarks/startup.py --drop-caches          # Truly cold: empty the OS file cache first
+    python benchmarks/startup.py --imports                   # Slowest imports of the source build
+
+The app needs a display; on a headless machine run this under xvfb-run.
+The exit status is 1 if the median time to first paint is over --budget-ms.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_MS = 300
+TIMEOUT_S = 60
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def drop_caches():
+    """Empty the Linux page cache so the next launch reads everything from disk (needs root)."""
+    subprocess.run(["sync"], check=True)
+    with open("/proc/sys/vm/drop_caches", "w") as f:
+        f.write("3\n")
+
+
+def launch(command, directory):
+    """Start the app once; returns {milestone: ms since launch}."""
+    env = dict(os.environ, BOOKKEEPING_STARTUP_PROBE="1")
+    start = time.monotonic()
+    result = subprocess.run(command, cwd=directory, env=env, capture_output=True, text=True, timeout=TIMEOUT_S)
+    exited = time.monotonic()
+    milestones = {}
+    for line in result.stdout.splitlines():
+        if line.startswith("startup-probe "):
+            _, name, stamp = line.split()
+            milestones[name] = (float(stamp) - start) * 1000
+    if "first-paint" not in milestones:
+        raise RuntimeError(f"The app did not report its first paint (exit code {result.returncode}):\n"
+                           f"{result.stdout}{result.stderr}")
+    milestones["exited"] = (exited - start) * 1000
+    return milestones
+
+
+def slowest_imports(count=15):
+    """The source build's top-level imports, most expensive first."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import bookkeeping"], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Each level of nesting adds two spaces; level 1 is imported by bookkeeping itself
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        if level <= 1:
+            imports.append((int(cumulative) / 1000, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frozen", help="path to a PyInstaller-built executable to time instead of the source")
+    parser.add_argument("--db", help="database to start with (copied; default: a new, empty one)")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS, help="target median time to first paint")
+    parser.add_argument("--drop-caches", action="store_true", help="empty the OS file cache before each run")
+    parser.add_argument("--imports", action="store_true", help="list the slowest imports and exit")
+    parser.add_argument("--output", help="write the timings as JSON to this file")
+    args = parser.parse_args()
+
+    if args.imports:
+        for ms, name in slowest_imports():
+            print(f"  {ms:8.1f} ms  {name}")
+        return
+
+    if args.frozen:
+        command = [os.path.abspath(args.frozen)]
+    else:
+        command = [sys.executable, os.path.join(ROOT, "bookkeeping.py")]
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.db:
+            shutil.copy(args.db, os.path.join(directory, "mybookkeeping.db"))
+        # One untimed launch creates the database and config.json, as on a machine that has run it before
+        launch(command, directory)
+        runs = []
+        for _ in range(args.runs):
+            if args.drop_caches:
+                drop_caches()
+            runs.append(launch(command, directory))
+
+    label = "frozen build" if args.frozen else "source"
+    print(f"Startup of the {label} over {len(runs)} runs{' (cold file cache)' if args.drop_caches else ''}:")
+    summary = {}
+    for milestone in ("first-paint", "themed", "exited"):
+        samples = [run[milestone] for run in runs if milestone in run]
+        if not samples:
+            continue
+        summary[milestone] = {"min_ms": min(samples), "p50_ms": percentile(samples, 50),
+                              "p90_ms": percentile(samples, 90), "max_ms": max(samples)}
+        stats = summary[milestone]
+        print(f"  {milestone:<12} min {stats['min_ms']:7.1f} ms  p50 {stats['p50_ms']:7.1f} ms  "
+              f"p90 {stats['p90_ms']:7.1f} ms  max {stats['max_ms']:7.1f} ms")
+
+    median = summary["first-paint"]["p50_ms"]
+    within = median <= args.budget_ms
+    print(f"Median first paint {median:.1f} ms is {'within' if within else 'OVER'} the {args.budget_ms:g} ms budget")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"build": label, "command": command, "runs": runs, "summary": summary,
+                       "budget_ms": args.budget_ms}, f, indent=2)
+    sys.exit(0 if within else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Run several app instances' worth of writers and readers against one database.
+
+Each writer process saves invoices, adds customers and changes a setting
+in a loop, as a user of one instance would; each reader process polls
+PRAGMA data_version, as the app does, and pages the lists when it sees a
+commit. At the end every write must have succeeded, the row counts must
+add up and the report summaries must match the invoices:
+
+    python benchmarks/stress.py --writers 4 --readers 4 --duration 10
+
+Exits with status 1 if any write failed or any check did not hold.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ledger  # noqa: E402
+import reports  # noqa: E402
+import schema  # noqa: E402
+from settings import Settings  # noqa: E402
+from suite import load_window, percentile, scroll  # noqa: E402
+from transactions import is_locked, write_transaction  # noqa: E402
+
+STATUSES = ("Draft", "Sent", "Paid")
+# How often readers look for other connections' commits (the app uses bookkeeping.CHANGE_CHECK_MS)
+POLL_S = 0.01
+
+
+def create_database(path, customers=200):
+    conn = schema.connect(path)
+    schema.migrate(conn)
+    with write_transaction(conn):
+        conn.executemany("INSERT INTO customers (name, email, contact) VALUES (?, ?, '')",
+                         [(f"Customer {n}", f"customer{n}@example.com") for n in range(customers)])
+    conn.close()
+
+
+def writer(path, number, deadline, results):
+    """Save invoices, add customers and change settings until the deadline."""
+    rng = random.Random(number)
+    conn = schema.connect(path)
+    settings = Settings(conn)
+    customer_ids = [row[0] for row in conn.execute("SELECT id FROM customers")]
+    saved = {"invoices": 0, "items": 0, "customers": 0, "settings": 0}
+    failures = []
+    latencies = []
+    while time.time() < deadline:
+        action = rng.random()
+        start = time.perf_counter()
+        try:
+            if action < 0.7:
+                items = [(f"Line {n}", rng.randint(1, 5), rng.randint(100, 10000) / 100)
+                         for n in range(rng.randint(1, 5))]
+                ledger.save_invoice(conn, None, rng.choice(customer_ids), "2024-01-15", "2024-02-15", items,
+                                    status=rng.choice(STATUSES), tax_rate=0.2)
+                saved["invoices"] += 1
+                saved["items"] += len(items)
+            elif action < 0.9:
+                with write_transaction(conn):
+                    conn.execute("INSERT INTO customers (name, email, contact) VALUES (?, ?, '')",
+                                 (f"Writer {number} customer", f"writer{number}@example.com"))
+                saved["customers"] += 1
+            else:
+                settings.set(f"stress_last_commit_{number}", time.time())
+                saved["settings"] += 1
+        except sqlite3.Error as e:
+            failures.append(f"{'locked' if is_locked(e) else 'error'}: {e}")
+        latencies.append((time.perf_counter() - start) * 1000)
+    conn.close()
+    results.put(("writer", number, saved, failures, latencies))
+
+
+def reader(path, number, deadline, results):
+    """Watch for other connections' commits and reload the lists when one lands."""
+    conn = schema.connect(path)
+    customers = ledger.customer_pager()
+    invoices = ledger.invoice_pager()
+    version = conn.execute("PRAGMA data_version").fetchone()[0]
+    seen = 0
+    failures = []
+    latencies = []
+    while time.time() < deadline:
+        try:
+            current = conn.execute("PRAGMA data_version").fetchone()[0]
+            if current == version:
+                time.sleep(POLL_S)
+                continue
+            version = current
+            seen += 1
+            start = time.perf_counter()
+            load_window(conn, invoices)
+            scroll(conn, customers, 2)
+            reports.aging(conn)
+            latencies.append((time.perf_counter() - start) * 1000)
+        except sqlite3.Error as e:
+            failures.append(f"{'locked' if is_locked(e) else 'error'}: {e}")
+    conn.close()
+    results.put(("reader", number, seen, failures, latencies))
+
+
+def summarize(label, latencies):
+    if not latencies:
+        return f"{label}: none"
+    return (f"{label}: {len(latencies)}, p50 {percentile(latencies, 50):.1f} ms, "
+            f"p99 {percentile(latencies, 99):.1f} ms, max {max(latencies):.1f} ms")
+
+
+def check(path, expected):
+    """Compare the database with what the writers say they saved; returns the problems."""
+    conn = schema.connect(path)
+    problems = []
+    for table, key in (("invoices", "invoices"), ("invoice_items", "items")):
+        count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        if count != expected[key]:
+            problems.append(f"{table}: {count} rows, writers saved {expected[key]}")
+    count = conn.execute("SELECT COUNT(*) FROM customers").fetchone()[0]
+    if count != expected["customers"]:
+        problems.append(f"customers: {count} rows, expected {expected['customers']}")
+    orphans = conn.execute("SELECT COUNT(*) FROM invoice_items WHERE invoice_id NOT IN "
+                           "(SELECT id FROM invoices)").fetchone()[0]
+    if orphans:
+        problems.append(f"{orphans} items without an invoice")
+    mismatches = reports.verify(conn)
+    if mismatches:
+        problems.append(f"report summaries differ from the invoices in {len(mismatches)} rows")
+    conn.close()
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10, help="seconds to run for")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "stress.db")
+        initial_customers = 200
+        create_database(path, initial_customers)
+
+        results = multiprocessing.Queue()
+        deadline = time.time() + args.duration
+        processes = ([multiprocessing.Process(target=writer, args=(path, n, deadline, results))
+                      for n in range(args.writers)]
+                     + [multiprocessing.Process(target=reader, args=(path, n, deadline, results))
+                        for n in range(args.readers)])
+        for process in processes:
+            process.start()
+        # Drain the queue before joining, or a process with a large result never exits
+        reported = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        expected = {"invoices": 0, "items": 0, "customers": initial_customers}
+        failures = []
+        write_latencies = []
+        read_latencies = []
+        for kind, number, outcome, errors, latencies in sorted(reported):
+            failures += [f"{kind} {number}: {error}" for error in errors]
+            if kind == "writer":
+                for key in ("invoices", "items", "customers"):
+                    expected[key] += outcome[key]
+                write_latencies += latencies
+                print(f"writer {number}: {outcome['invoices']} invoices, {outcome['customers']} customers, "
+                      f"{outcome['settings']} settings, {len(errors)} failed")
+            else:
+                read_latencies += latencies
+                print(f"reader {number}: saw {outcome} commits, {len(errors)} failed")
+        print(summarize("Writes", write_latencies))
+        print(summarize("Reloads after a commit", read_latencies))
+
+        problems = check(path, expected)
+        for line in failures[:20] + problems:
+            print(f"FAILED {line}")
+        if failures or problems:
+            sys.exit(1)
+        print("OK")
+
+
+if __name__ == "__main__":
+    main()
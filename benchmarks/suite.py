@@ -0,0 +1,341 @@
+"""Benchmark suite for the bookkeeping app's hot paths.
+
+Runs, without Tk, the same data-layer work each UI action does: the
+pagers, filters, reports, analytics and ledger/exporter functions the windows call. It
+reports latency percentiles and peak memory per operation and writes the
+results as JSON so runs can be compared over time.
+
+    python benchmarks/datagen.py --scale medium --output /tmp/bench.db
+    python benchmarks/suite.py --db /tmp/bench.db --output results.json
+    python benchmarks/suite.py --db /tmp/bench.db --compare results.json
+
+The database is copied to a temporary file first, so the operations that
+write (saving invoices) never touch the original.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import exporter  # noqa: E402
+import ledger  # noqa: E402
+import reports  # noqa: E402
+import schema  # noqa: E402
+from search import customer_filter, find_customers, has_customer_index  # noqa: E402
+
+try:
+    import analytics  # noqa: E402  (needs NumPy)
+except ImportError:
+    analytics = None
+
+# A list view shows about this many rows and keeps PREFETCH_ROWS either side
+# (see virtual_tree.PREFETCH_ROWS)
+VISIBLE_ROWS = 30
+PREFETCH_ROWS = 64
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def _reset_peak_rss():
+    """Reset the process's peak RSS (Linux); returns False where unsupported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_kib():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux and bytes on macOS, and never resets
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+class Suite:
+    """Runs named operations and collects their timings."""
+
+    def __init__(self, conn, repeat, seed):
+        self.conn = conn
+        self.repeat = repeat
+        self.rng = random.Random(seed)
+        self.results = {}
+
+    def run(self, name, operation, repeat=None):
+        """Time `operation()` `repeat` times after one warm-up call."""
+        operation()
+        resettable = _reset_peak_rss()
+        baseline = _peak_rss_kib()
+        samples = []
+        for _ in range(repeat or self.repeat):
+            start = time.perf_counter()
+            operation()
+            samples.append((time.perf_counter() - start) * 1000)
+        peak = _peak_rss_kib()
+        result = {
+            "runs": len(samples),
+            "mean_ms": sum(samples) / len(samples),
+            "max_ms": max(samples),
+            "peak_rss_kib": peak,
+            # Growth of the peak during the runs; only meaningful where it can be reset
+            "peak_rss_growth_kib": peak - baseline if resettable else None,
+        }
+        for pct in PERCENTILES:
+            result[f"p{pct}_ms"] = percentile(samples, pct)
+        self.results[name] = result
+        growth = result["peak_rss_growth_kib"]
+        print(f"  {name:<34} p50 {result['p50_ms']:9.2f} ms  p90 {result['p90_ms']:9.2f} ms  "
+              f"p99 {result['p99_ms']:9.2f} ms  peak {peak / 1024:7.1f} MiB"
+              + (f" (+{growth / 1024:.1f})" if growth is not None else ""))
+
+
+def load_window(conn, pager, top=0):
+    """What VirtualTreeview.reload reads: the row count and the window around `top`."""
+    total = pager.count(conn)
+    start = max(0, min(top, total - VISIBLE_ROWS))
+    cache_start = max(0, start - PREFETCH_ROWS)
+    return pager.page_at(conn, cache_start, start - cache_start + VISIBLE_ROWS + PREFETCH_ROWS, total)
+
+
+def scroll(conn, pager, pages):
+    """What scrolling down reads: successive keyset pages after the cached rows."""
+    rows = pager.first(conn, VISIBLE_ROWS + PREFETCH_ROWS)
+    for _ in range(pages):
+        if not rows:
+            break
+        rows = pager.page_after(conn, pager.key(rows[-1]), PREFETCH_ROWS)
+
+
+def search_terms(conn, rng, count):
+    """Prefixes of real names and emails, as a user would type them, plus a miss."""
+    rows = conn.execute("SELECT name, email FROM customers WHERE id IN "
+                        "(SELECT id FROM customers ORDER BY id LIMIT 1000)").fetchall()
+    terms = []
+    for _ in range(count):
+        name, email = rng.choice(rows)
+        source = rng.choice([name.split()[0], name.split()[-1], email])
+        terms.append(source[:rng.randint(2, max(2, min(6, len(source))))])
+    return terms + ["zzqx"]
+
+
+def benchmark_lists(suite):
+    conn, rng = suite.conn, suite.rng
+    customers = ledger.customer_pager()
+    invoices = ledger.invoice_pager()
+    customer_total = customers.count(conn)
+    invoice_total = invoices.count(conn)
+
+    print("Lists")
+    suite.run("load_customers", lambda: load_window(conn, customers))
+    suite.run("load_invoices", lambda: load_window(conn, invoices))
+    suite.run("scroll_customers (10 pages)", lambda: scroll(conn, customers, 10))
+    suite.run("scroll_invoices (10 pages)", lambda: scroll(conn, invoices, 10))
+    suite.run("jump_invoices", lambda: load_window(conn, invoices, rng.randrange(max(1, invoice_total))))
+    suite.run("jump_customers", lambda: load_window(conn, customers, rng.randrange(max(1, customer_total))))
+
+    print("Search")
+    fts_enabled = has_customer_index(conn)
+    terms = iter(search_terms(conn, rng, 1000) * 10)
+
+    def search():
+        customers.set_filter(*customer_filter(next(terms), fts_enabled))
+        load_window(conn, customers)
+    suite.run("search_customers", search)
+    customers.set_filter()
+    suite.run("find_customers (invoice picker)", lambda: find_customers(conn, next(terms), fts_enabled=fts_enabled))
+
+    print("Sorting")
+    for pager, label in ((customers, "customers"), (invoices, "invoices")):
+        for column in sorted(pager.sort_columns):
+            if column in pager.joined_columns and column != "customer":
+                continue  # Hidden tie-breaker, not a view column
+            for descending in (False, True):
+                pager.set_sort(column, descending)
+                suite.run(f"sort_{label}:{column}{' desc' if descending else ''}",
+                          lambda: load_window(conn, pager))
+        pager.set_sort(pager.id_column)
+
+    print("Invoice filters")
+    for status in ("Draft", "Overdue"):
+        invoices.set_filter(*ledger.invoice_filter(status=None if status == "Overdue" else status,
+                                                   overdue=status == "Overdue"))
+        suite.run(f"filter_invoices:{status.lower()}", lambda: load_window(conn, invoices))
+    first, last = ledger.period_dates("This year")
+    invoices.set_filter(*ledger.invoice_filter(date_from=first, date_to=last))
+    suite.run("filter_invoices:this_year", lambda: load_window(conn, invoices))
+    invoices.set_filter()
+
+
+def benchmark_reports(suite):
+    conn = suite.conn
+    print("Reports")
+    suite.run("report:aging", lambda: reports.aging(conn))
+    suite.run("report:revenue_by_month", lambda: reports.revenue_by_month(conn))
+    suite.run("report:top_customers", lambda: reports.top_customers(conn))
+    suite.run("report:top_customers outstanding", lambda: reports.top_customers(conn, by="outstanding"))
+
+
+def benchmark_analytics(suite, repeat):
+    if analytics is None:
+        print("Analytics skipped: NumPy is not installed")
+        return
+    conn = suite.conn
+    print("Analytics")
+    suite.run("analytics:revenue by month", lambda: analytics.aggregate(conn, ["month"]), repeat=repeat)
+    suite.run("analytics:lines by customer,week",
+              lambda: analytics.aggregate(conn, ["customer", "week"], source="items"), repeat=repeat)
+    suite.run("analytics:aging by customer", lambda: analytics.aging(conn, ["customer"]), repeat=repeat)
+    suite.run("analytics:dso", lambda: analytics.days_sales_outstanding(conn), repeat=repeat)
+
+
+def benchmark_saves(suite):
+    conn, rng = suite.conn, suite.rng
+    print("Saving invoices")
+    customer_count = conn.execute("SELECT MAX(id) FROM customers").fetchone()[0]
+    created = []
+
+    def save_new():
+        items = [("Consulting hour", 2.0, 150.0), ("Travel", 1.0, 85.5), ("Licence seat", 10.0, 12.0)]
+        created.append(ledger.save_invoice(conn, None, rng.randint(1, customer_count), "2026-06-01", "2026-07-01",
+                                           items, tax_rate=0.2))
+    suite.run("save_invoice:new (3 lines)", save_new)
+
+    # Edit one line of the largest invoice, as the editor would save it
+    invoice_id = conn.execute("SELECT invoice_id FROM invoice_items GROUP BY invoice_id "
+                              "ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0]
+    loaded = {row[0]: tuple(row[1:]) for row in conn.execute(
+        "SELECT id, description, quantity, unit_price FROM invoice_items WHERE invoice_id = ? ORDER BY id",
+        (invoice_id,))}
+    customer_id, invoice_date, due_date = conn.execute(
+        "SELECT customer_id, invoice_date, due_date FROM invoices WHERE id = ?", (invoice_id,)).fetchone()
+
+    def save_edit():
+        items = [(item_id,) + values for item_id, values in loaded.items()]
+        item_id, description, quantity, unit_price = items[-1]
+        items[-1] = (item_id, description, quantity + 1, unit_price)
+        ledger.save_invoice(conn, invoice_id, customer_id, invoice_date, due_date, items,
+                            tax_rate=0.2, loaded_items=loaded)
+        loaded[item_id] = items[-1][1:]
+    suite.run(f"save_invoice:edit one of {len(loaded)} lines", save_edit)
+
+    with conn:
+        conn.executemany("DELETE FROM invoice_items WHERE invoice_id = ?", ((i,) for i in created))
+        conn.executemany("DELETE FROM invoices WHERE id = ?", ((i,) for i in created))
+
+
+def benchmark_exports(suite, directory, repeat):
+    print("Export to CSV")
+    for name in exporter.LEDGERS:
+        path = os.path.join(directory, f"{name}.csv")
+        suite.run(f"export_csv:{name}", lambda: exporter.export_csv(suite.conn, name, path), repeat=repeat)
+        os.remove(path)
+
+
+def metadata(path, conn):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ("customers", "invoices", "invoice_items")}
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "database": os.path.abspath(path),
+        "database_bytes": os.path.getsize(path),
+        "rows": counts,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+    }
+
+
+def compare(previous_path, results):
+    """Print p50/p90 changes against an earlier results file."""
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nCompared with {previous_path} ({previous['meta'].get('commit')}, {previous['meta']['timestamp']}):")
+    for name, result in results.items():
+        before = previous["results"].get(name)
+        if not before:
+            print(f"  {name:<34} (new)")
+            continue
+        changes = []
+        for key in ("p50_ms", "p90_ms"):
+            change = (result[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+            changes.append(f"{key[:3]} {before[key]:9.2f} -> {result[key]:9.2f} ms ({change:+6.1f}%)")
+        print(f"  {name:<34} " + "  ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default="mybookkeeping.db", help="database to measure (see datagen.py)")
+    parser.add_argument("--repeat", type=int, default=50, help="timed runs of each interactive operation")
+    parser.add_argument("--export-repeat", type=int, default=3, help="timed runs of each export")
+    parser.add_argument("--skip-exports", action="store_true")
+    parser.add_argument("--analytics-repeat", type=int, default=3, help="timed runs of each analytics query")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="an earlier JSON results file to compare against")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} does not exist; create one with benchmarks/datagen.py")
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Work on a copy so the write benchmarks leave the original untouched
+        path = os.path.join(directory, "bench.db")
+        source = sqlite3.connect(args.db)
+        target = sqlite3.connect(path)
+        source.backup(target)
+        source.close()
+        target.close()
+
+        conn = schema.connect(path)
+        schema.migrate(conn)
+        meta = metadata(args.db, conn)
+        print(f"{meta['rows']} on SQLite {meta['sqlite']}, {args.repeat} runs per operation\n")
+
+        suite = Suite(conn, args.repeat, args.seed)
+        benchmark_lists(suite)
+        benchmark_reports(suite)
+        benchmark_analytics(suite, args.analytics_repeat)
+        benchmark_saves(suite)
+        if not args.skip_exports:
+            benchmark_exports(suite, directory, args.export_repeat)
+        conn.close()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"meta": meta, "results": suite.results}, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare(args.compare, suite.results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""Recurring invoices: templates stored in the database and billing runs over them.
+
+A template is a customer, its invoice lines and how often to bill it
+(every `interval_months` months from `start_date`, until `end_date` if
+set). A billing run creates one invoice for every active template due in
+a month, with the same line and tax arithmetic as an invoice saved from
+the app (ledger.calculate_totals, at the configured tax rate).
+
+Runs are idempotent per period: `recurring_billed` records the invoice
+made for each (template, month), so running a month again only bills the
+templates it missed, e.g. ones added since or a run that was stopped.
+
+A run reads every due template and its lines up front and writes the
+invoices in batches of a few thousand, one transaction per batch, with
+explicit ids so invoices and their items go in with one executemany
+each. Within each batch the report summary and change log triggers are
+replaced by one grouped statement for the whole batch; the triggers are
+dropped and recreated inside the batch's transaction, so other instances
+never write while they are missing.
+
+    python billing.py add --customer 42 --line "Hosting,1,49.00" --line "Support,2,15.00"
+    python billing.py list
+    python billing.py run --month 2024-03
+"""
+import argparse
+import time
+from datetime import date, timedelta
+
+import changelog
+import ledger
+import reports
+import schema
+from transactions import write_transaction
+
+# Invoices written per transaction
+BATCH_INVOICES = 5000
+# Status of the invoices a run creates, unless the template says otherwise
+DEFAULT_STATUS = "Sent"
+DEFAULT_DUE_DAYS = 30
+
+
+class BillingResult:
+    """Counts and timing for one billing run."""
+
+    def __init__(self, month, invoices, items, skipped, seconds):
+        self.month = month
+        self.invoices = invoices
+        self.items = items
+        self.skipped = skipped
+        self.seconds = seconds
+
+    @property
+    def invoices_per_second(self):
+        return self.invoices / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        text = (f"Billed {self.invoices} invoices ({self.items} lines) for {self.month} in {self.seconds:.2f} s "
+                f"({self.invoices_per_second:,.0f} invoices/s)")
+        if self.skipped:
+            text += f"; {self.skipped} templates were already billed for {self.month}"
+        return text
+
+
+def create_tables(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS recurring_invoices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id INTEGER NOT NULL,
+            interval_months INTEGER NOT NULL DEFAULT 1,
+            start_date TEXT NOT NULL,
+            end_date TEXT,
+            due_days INTEGER NOT NULL DEFAULT 30,
+            status TEXT NOT NULL DEFAULT 'Sent',
+            active INTEGER NOT NULL DEFAULT 1
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS recurring_invoice_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            template_id INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            quantity REAL NOT NULL,
+            unit_price REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_recurring_invoice_items_template "
+                 "ON recurring_invoice_items (template_id)")
+    # One row per invoice a run created; the key makes a second run of a month skip it
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS recurring_billed (
+            template_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            invoice_id INTEGER NOT NULL,
+            PRIMARY KEY (month, template_id)
+        ) WITHOUT ROWID
+    """)
+
+
+def add_template(conn, customer_id, items, start_date, interval_months=1, end_date=None,
+                 due_days=DEFAULT_DUE_DAYS, status=DEFAULT_STATUS):
+    """Store a recurring invoice for a customer; `items` are (description, quantity, unit_price). Returns its id."""
+    if interval_months < 1:
+        raise ValueError("A recurring invoice repeats at least every month")
+    if status not in ledger.INVOICE_STATUSES:
+        raise ValueError(f"Unknown invoice status: {status}")
+    if not items:
+        raise ValueError("A recurring invoice needs at least one line")
+    start_date = date.fromisoformat(start_date).isoformat()
+    end_date = date.fromisoformat(end_date).isoformat() if end_date else None
+    with write_transaction(conn):
+        template_id = conn.execute("""
+            INSERT INTO recurring_invoices (customer_id, interval_months, start_date, end_date, due_days, status)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (customer_id, interval_months, start_date, end_date, due_days, status)).lastrowid
+        conn.executemany("""
+            INSERT INTO recurring_invoice_items (template_id, description, quantity, unit_price)
+            VALUES (?, ?, ?, ?)
+        """, ((template_id, description, float(quantity), float(unit_price))
+              for description, quantity, unit_price in items))
+    return template_id
+
+
+def set_active(conn, template_id, active):
+    """Pause or resume a recurring invoice."""
+    with write_transaction(conn):
+        conn.execute("UPDATE recurring_invoices SET active = ? WHERE id = ?", (int(bool(active)), template_id))
+
+
+def parse_month(month):
+    """The first day of a YYYY-MM month."""
+    year, number = month.split("-")
+    return date(int(year), int(number), 1)
+
+
+def is_due(start_date, interval_months, end_date, month_start, invoice_date=None):
+    """Whether a template starting on `start_date` bills in the month beginning `month_start`.
+
+    The invoice would be dated `invoice_date` (default `month_start`),
+    which must fall within the template's start and end dates, so a
+    template starting mid-month first bills a period later.
+    """
+    start = date.fromisoformat(start_date)
+    months = (month_start.year - start.year) * 12 + month_start.month - start.month
+    if months < 0 or months % interval_months:
+        return False
+    billed_on = (invoice_date or month_start).isoformat()
+    return start_date <= billed_on and (end_date is None or billed_on <= end_date)
+
+
+def due_templates(conn, month, invoice_date=None):
+    """The active templates due in `month` (YYYY-MM) whose customer still exists.
+
+    `invoice_date` is the date the invoices would carry (a date; default
+    the first of the month). Returns (template id, customer id, due days,
+    status) tuples.
+    """
+    month_start = parse_month(month)
+    rows = conn.execute("""
+        SELECT r.id, r.customer_id, r.interval_months, r.start_date, r.end_date, r.due_days, r.status
+        FROM recurring_invoices r JOIN customers c ON c.id = r.customer_id
+        WHERE r.active ORDER BY r.id
+    """)
+    return [(template_id, customer_id, due_days, status)
+            for template_id, customer_id, interval_months, start_date, end_date, due_days, status in rows
+            if is_due(start_date, interval_months, end_date, month_start, invoice_date)]
+
+
+def _template_items(conn):
+    """Template id -> [(description, quantity, unit_price)], for every template, in one indexed pass."""
+    items = {}
+    for template_id, description, quantity, unit_price in conn.execute(
+            "SELECT template_id, description, quantity, unit_price FROM recurring_invoice_items "
+            "ORDER BY template_id, id"):
+        items.setdefault(template_id, []).append((description, quantity, unit_price))
+    return items
+
+
+def _next_id(conn, table):
+    """The id AUTOINCREMENT would give the next row of `table` (call with the write lock held)."""
+    return conn.execute(f"""
+        SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = '{table}'), 0),
+                   COALESCE((SELECT MAX(id) FROM {table}), 0)) + 1
+    """).fetchone()[0]
+
+
+def _write_batch(conn, month, batch, invoice_date, tax_rate):
+    """Insert one batch of (template id, customer id, due days, status, items); returns (invoices, lines) written."""
+    billed = {row[0] for row in conn.execute("SELECT template_id FROM recurring_billed WHERE month = ?", (month,))}
+    batch = [template for template in batch if template[0] not in billed]
+    if not batch:
+        return 0, 0
+    first_invoice = invoice_id = _next_id(conn, "invoices")
+    first_item = item_id = _next_id(conn, "invoice_items")
+    invoices = []
+    lines = []
+    billed_rows = []
+    for template_id, customer_id, due_days, status, items in batch:
+        _, tax_amount, total_amount = ledger.calculate_totals(items, tax_rate)
+        due_date = (invoice_date + timedelta(days=due_days)).isoformat()
+        invoices.append((invoice_id, customer_id, invoice_date.isoformat(), due_date, total_amount, tax_amount,
+                         status))
+        for description, quantity, unit_price in items:
+            lines.append((item_id, invoice_id, description, quantity, unit_price))
+            item_id += 1
+        billed_rows.append((template_id, month, invoice_id))
+        invoice_id += 1
+
+    # A grouped statement per batch instead of the triggers' work per row
+    suspend_summaries = reports.has_summary_tables(conn)
+    suspend_changes = changelog.has_change_log(conn)
+    if suspend_summaries:
+        reports.drop_summary_triggers(conn)
+    if suspend_changes:
+        changelog.drop_triggers(conn, ["invoices", "invoice_items"])
+    conn.executemany("""
+        INSERT INTO invoices (id, customer_id, invoice_date, due_date, total_amount, tax_amount, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, invoices)
+    conn.executemany("""
+        INSERT INTO invoice_items (id, invoice_id, description, quantity, unit_price) VALUES (?, ?, ?, ?, ?)
+    """, lines)
+    conn.executemany("INSERT INTO recurring_billed (template_id, month, invoice_id) VALUES (?, ?, ?)", billed_rows)
+    if suspend_summaries:
+        reports.add_invoices(conn, first_invoice - 1)
+        reports.create_summary_triggers(conn)
+    if suspend_changes:
+        changelog.log_inserted(conn, "invoices", first_invoice - 1)
+        changelog.log_inserted(conn, "invoice_items", first_item - 1)
+        changelog.create_triggers(conn, ["invoices", "invoice_items"])
+    return len(invoices), len(lines)
+
+
+def run_billing(conn, month, invoice_date=None, batch_invoices=BATCH_INVOICES, progress=None, cancelled=None):
+    """Create the invoices due in `month` (YYYY-MM) that have not been billed yet; returns a BillingResult.
+
+    Invoices are dated `invoice_date` (ISO date; default the first of the
+    month) and fall due their template's `due_days` later. `progress(done,
+    total)` is called after every batch and `cancelled()`, if given, is
+    checked between batches; batches already written stay committed and
+    the rest are billed by running the month again.
+    """
+    start = time.perf_counter()
+    month_start = parse_month(month)
+    month = month_start.strftime("%Y-%m")
+    invoice_date = date.fromisoformat(invoice_date) if invoice_date else month_start
+    tax_rate = ledger.get_tax_rate(conn)
+
+    templates = due_templates(conn, month, invoice_date)
+    billed = {row[0] for row in conn.execute("SELECT template_id FROM recurring_billed WHERE month = ?", (month,))}
+    items = _template_items(conn)
+    pending = [(template_id, customer_id, due_days, status, items[template_id])
+               for template_id, customer_id, due_days, status in templates
+               if template_id not in billed and template_id in items]
+
+    invoices = lines = 0
+    for offset in range(0, len(pending), batch_invoices):
+        if cancelled and cancelled():
+            break
+        with write_transaction(conn):
+            written, written_lines = _write_batch(conn, month, pending[offset:offset + batch_invoices],
+                                                  invoice_date, tax_rate)
+        invoices += written
+        lines += written_lines
+        if progress:
+            progress(invoices, len(pending))
+    return BillingResult(month, invoices, lines, len(templates) - len(pending), time.perf_counter() - start)
+
+
+def _parse_line(text):
+    description, quantity, unit_price = text.rsplit(",", 2)
+    return description.strip(), float(quantity), float(unit_price)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage recurring invoices and run monthly billing.")
+    parser.add_argument("command", choices=("add", "list", "pause", "resume", "run"))
+    parser.add_argument("--db", default="mybookkeeping.db")
+    parser.add_argument("--month", help="month to bill (YYYY-MM; default this month)")
+    parser.add_argument("--date", help="date the invoices are issued (default the first of the month)")
+    parser.add_argument("--customer", type=int, help="customer id of a new recurring invoice")
+    parser.add_argument("--line", action="append", default=[], help='a line of a new recurring invoice: '
+                                                                     '"description,quantity,unit price"')
+    parser.add_argument("--every", type=int, default=1, help="months between invoices")
+    parser.add_argument("--start", help="when it starts (YYYY-MM-DD; default today); it bills from that month on")
+    parser.add_argument("--end", help="last day it may bill (YYYY-MM-DD)")
+    parser.add_argument("--due-days", type=int, default=DEFAULT_DUE_DAYS)
+    parser.add_argument("--status", default=DEFAULT_STATUS, choices=ledger.INVOICE_STATUSES)
+    parser.add_argument("--template", type=int, help="the recurring invoice to pause or resume")
+    args = parser.parse_args()
+
+    conn = schema.connect(args.db)
+    schema.migrate(conn)
+    if args.command == "add":
+        if args.customer is None or not args.line:
+            parser.error("add needs --customer and at least one --line")
+        try:
+            items = [_parse_line(line) for line in args.line]
+        except ValueError:
+            parser.error('lines are "description,quantity,unit price"')
+        template_id = add_template(conn, args.customer, items, args.start or date.today().isoformat(),
+                                   args.every, args.end, args.due_days, args.status)
+        print(f"Added recurring invoice {template_id}.")
+    elif args.command in ("pause", "resume"):
+        if args.template is None:
+            parser.error(f"{args.command} needs --template")
+        set_active(conn, args.template, args.command == "resume")
+    elif args.command == "list":
+        for template_id, customer_id, every, start, end, active, lines, amount in conn.execute("""
+                SELECT r.id, r.customer_id, r.interval_months, r.start_date, r.end_date, r.active,
+                       COUNT(it.id), COALESCE(SUM(ROUND(it.quantity * it.unit_price, 2)), 0)
+                FROM recurring_invoices r LEFT JOIN recurring_invoice_items it ON it.template_id = r.id
+                GROUP BY r.id ORDER BY r.id"""):
+            state = "" if active else " (paused)"
+            print(f"{template_id:>8} customer {customer_id:<8} every {every} month(s) from {start}"
+                  f"{' to ' + end if end else ''}: {lines} lines, {amount:,.2f} before tax{state}")
+    else:
+        result = run_billing(conn, args.month or date.today().strftime("%Y-%m"), args.date,
+                             progress=lambda done, total: print(f"  {done}/{total} invoices written...", end="\r"))
+        print()
+        print(result)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
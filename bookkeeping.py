@@ -1,24 +1,55 @@
+import os
 import sqlite3
+import time
 import tkinter as tk
-import csv
 import json
 from datetime import date, timedelta
 from tkinter import messagebox
-from PIL import Image, ImageTk
 
 from tkinter import ttk
-import sv_ttk
+
+# The theme, the icon and the modules behind rarely used windows (sv_ttk,
+# exporter, importer, backup, filedialog) are imported when first needed, so they
+# don't delay the first paint
+import archive
+import ledger
+import reports
+import schema
+from customer_picker import CustomerPicker
+from diagnostics import HISTOGRAM_MS, SLOW_QUERY_MS, QueryStats, TracedConnection
+from executor import QueryExecutor
+from search import customer_filter, has_customer_index
+from settings import Settings
+from transactions import write_transaction
+from virtual_tree import VirtualTreeview
+
+DB_PATH = "mybookkeeping.db"
+
+# Wait this long after the last keystroke before running a search
+SEARCH_DELAY_MS = 250
+# How often to check whether another instance changed the settings or data
+CHANGE_CHECK_MS = 1000
+# How often to check whether a scheduled backup is due
+BACKUP_CHECK_MS = 60 * 1000
+# The notebook's tabs, in order
+TABS = ("customers", "invoices")
+# When set, report startup milestones on stdout and quit once started (see benchmarks/startup.py)
+STARTUP_PROBE = os.environ.get("BOOKKEEPING_STARTUP_PROBE")
 
 class BookkeepingApp:
     def __init__(self, root_window):
         self.root = root_window
         self.root.title("Bookkeeping App")
 
+        # Query timings, recorded while the diagnostics window has recording on
+        self.query_stats = QueryStats()
+
         try:
             # Connect to SQLite DB and get cursor
-            self.conn = sqlite3.connect("mybookkeeping.db")
+            self.conn = schema.connect(DB_PATH, factory=TracedConnection)
+            self.conn.stats = self.query_stats
             self.cursor = self.conn.cursor()
-            print("Database connection to 'mybookkeeping.db' successful!")
+            print(f"Database connection to '{DB_PATH}' successful!")
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", f"Failed to connect to database: {e}")
             self.root.destroy()
@@ -31,12 +62,23 @@ class BookkeepingApp:
         self._create_menu()
 
         self.create_table()
+
+        # Settings are read once and served from memory
+        self.settings = Settings(self.conn)
+        self.query_stats.slow_ms = self.settings.get("slow_query_ms", SLOW_QUERY_MS)
+        self._data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        self._change_listeners = []
+        self._change_timer = self.root.after(CHANGE_CHECK_MS, self._check_for_changes)
+
+        # Slow queries run on worker threads with their own connections
+        self.executor = QueryExecutor(self.root, DB_PATH, connect=self._connect_worker)
+
         # Create UI widgets
         self.create_widgets()
 
-        # Load initial data into the view
-        self.load_customers()
-        self.load_invoices()
+        # Each tab is read the first time it is shown, and again only once it is stale
+        self._stale_tabs = set(TABS)
+        self._load_visible_tab()
 
         # Bind tab change event
         self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_selected)
@@ -44,50 +86,72 @@ class BookkeepingApp:
         # Ensure DB connection is closed when window is closed
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
-        # For the Undo feature
-        self._last_deleted_customer = None
+        # For the Undo feature: (menu label, function reversing the last delete or status change)
+        self._undo = None
+
+        # Scheduled backups are checked once the app has started
+        self._backup_timer = None
+        self._backup_job = None
+
+        # The theme and icon are applied once the window has been drawn
+        self.root.bind("<Expose>", self._on_first_paint)
 
     def create_table(self):
-        """Create the tables if they don't already exist."""
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS customers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                email TEXT,
-                contact TEXT
-            )
-        ''')
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS invoices (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                customer_id INTEGER NOT NULL,
-                invoice_date TEXT NOT NULL,
-                due_date TEXT NOT NULL,
-                total_amount REAL NOT NULL,
-                tax_amount REAL NOT NULL,
-                status TEXT NOT NULL,
-                FOREIGN KEY (customer_id) REFERENCES customers (id)
-            )
-        ''')
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS invoice_items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                invoice_id INTEGER NOT NULL,
-                description TEXT NOT NULL,
-                quantity REAL NOT NULL,
-                unit_price REAL NOT NULL,
-                FOREIGN KEY (invoice_id) REFERENCES invoices (id)
-            )
-        ''')
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT NOT NULL
-            )
-        ''')
-        # Add default tax rate if not present
-        self.cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('tax_rate', '0.2')")
-        self.conn.commit()
+        """Bring the database schema up to date."""
+        applied = schema.migrate(self.conn)
+        if applied:
+            print(f"Applied database migrations: {applied}")
+        # Finish moving invoices into the archive if an earlier run was interrupted
+        resumed = archive.resume(self.conn)
+        if resumed:
+            print(f"Finished archiving {resumed[0]} invoices")
+        # Rebuild indexes an interrupted CSV import left dropped (importer.PENDING_KEY)
+        if self.conn.execute("SELECT 1 FROM settings WHERE key = 'import_pending_indexes'").fetchone():
+            import importer
+            importer.resume(self.conn)
+            print("Rebuilt the indexes of an interrupted import")
+        # Full-text index used by the customer search
+        self.fts_enabled = has_customer_index(self.conn)
+
+    def _connect_worker(self, path):
+        """Open a worker thread's connection, timed along with the main one."""
+        conn = schema.connect(path, factory=TracedConnection)
+        conn.stats = self.query_stats
+        return conn
+
+    def _check_for_changes(self):
+        """Pick up settings and data changed by other connections (a cheap PRAGMA unless they did)."""
+        try:
+            self.settings.refresh()
+            data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                # Someone else committed; we can't tell what, so every tab may be out of date
+                self._data_version = data_version
+                # Another instance may have archived invoices for the first time
+                if not archive.is_attached(self.conn) and archive.attach(self.conn):
+                    self.executor.reconnect()
+                self.mark_stale(*TABS)
+                for listener in list(self._change_listeners):
+                    listener()
+        except sqlite3.Error as e:
+            print(f"Warning: Could not check for changes: {e}")
+        self._change_timer = self.root.after(CHANGE_CHECK_MS, self._check_for_changes)
+
+    def note_own_write(self):
+        """Take the database as it is now as seen, after one of our workers committed.
+
+        Call it from the job's callback, which updates the views itself;
+        otherwise _check_for_changes would reload every tab for our own write.
+        """
+        self._data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def add_change_listener(self, listener):
+        """Call `listener()` whenever another connection (e.g. another instance) commits."""
+        self._change_listeners.append(listener)
+
+    def remove_change_listener(self, listener):
+        if listener in self._change_listeners:
+            self._change_listeners.remove(listener)
 
     def _create_menu(self):
         """Creates the main application menu bar."""
@@ -99,6 +163,15 @@ class BookkeepingApp:
         self.undo_menu_item_index = file_menu.index("end") # Placeholder for undo
         file_menu.add_command(label="Preferences...", command=self.open_preferences_window)
         file_menu.add_command(label="Export to CSV...", command=self.export_to_csv)
+        import_menu = tk.Menu(file_menu, tearoff=0)
+        import_menu.add_command(label="Customers...", command=lambda: self.import_from_csv("customers"))
+        import_menu.add_command(label="Invoices...", command=lambda: self.import_from_csv("invoices"))
+        import_menu.add_command(label="Invoice Items...", command=lambda: self.import_from_csv("invoice_items"))
+        file_menu.add_cascade(label="Import from CSV", menu=import_menu)
+        file_menu.add_command(label="Back Up Now", command=self.start_backup)
+        file_menu.add_command(label="Archive Paid Invoices...", command=self.archive_invoices)
+        file_menu.add_command(label="Reports...", command=self.open_reports_window)
+        file_menu.add_command(label="Query Diagnostics...", command=self.open_diagnostics_window)
         menu_bar.add_cascade(label="File", menu=file_menu)
         file_menu.add_command(label="Exit", command=self.on_closing)
 
@@ -164,10 +237,12 @@ class BookkeepingApp:
         search_frame = ttk.LabelFrame(parent_frame, text="Search Customers", padding="10")
         search_frame.pack(fill=tk.X, pady=(0, 10))
 
-        ttk.Label(search_frame, text="Search by Name:").pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Label(search_frame, text="Search Name, Email or Contact:").pack(side=tk.LEFT, padx=(0, 5))
         self.search_entry = ttk.Entry(search_frame)
         self.search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
         self.search_entry.bind("<KeyRelease>", self.search_customers)
+        self._search_timer = None
+        self._last_search_term = ""
     
     def _create_treeview_frame(self, parent_frame):
         # --- Customer List Frame (using Treeview) ---
@@ -188,17 +263,22 @@ class BookkeepingApp:
         self.tree.column('contact', width=120)
 
         # Add a scrollbar
-        scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.tree.yview)
-        self.tree.configure(yscroll=scrollbar.set)
+        scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL)
 
         self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
+        # Only the visible rows live in the treeview; the rest are paged in from the database
+        self.customer_pager = ledger.customer_pager()
+        self.customer_view = VirtualTreeview(self.tree, scrollbar, self.customer_pager, self.executor)
+
         # Bind double-click event to the treeview for editing
         self.tree.bind("<Double-1>", self.open_edit_window)
 
         # Bind right-click event for the context menu
         self.tree.bind("<Button-3>", self.show_context_menu)
+        # Ctrl+A selects every listed customer; Delete removes the selection
+        self.tree.bind("<Delete>", lambda event: self.delete_customer())
 
         # Keep track of the last sorted column
         self._last_sort_column = None
@@ -206,7 +286,7 @@ class BookkeepingApp:
 
     def _create_action_buttons(self, parent_frame):
         # --- Delete Button ---
-        delete_button = ttk.Button(parent_frame, text="Delete Selected Customer", command=self.delete_customer)
+        delete_button = ttk.Button(parent_frame, text="Delete Selected Customers", command=self.delete_customer)
         delete_button.pack(pady=5)
 
     def _create_status_bar(self, parent_frame):
@@ -217,6 +297,8 @@ class BookkeepingApp:
 
     def _create_invoice_widgets(self, parent_frame):
         """Create and layout the UI elements for the invoices tab."""
+        self._create_invoice_filter_bar(parent_frame)
+
         # --- Invoice List Frame (using Treeview) ---
         invoice_tree_frame = ttk.LabelFrame(parent_frame, text="Invoices", padding="10")
         invoice_tree_frame.pack(fill=tk.BOTH, expand=True)
@@ -225,135 +307,274 @@ class BookkeepingApp:
         self.invoice_tree = ttk.Treeview(invoice_tree_frame, columns=columns, show='headings')
 
         # Define headings and column properties
-        self.invoice_tree.heading('id', text='ID')
+        self.invoice_tree.heading('id', text='ID', command=lambda: self.sort_invoices_by_column('id'))
         self.invoice_tree.column('id', width=40, anchor=tk.CENTER)
-        self.invoice_tree.heading('customer', text='Customer')
+        self.invoice_tree.heading('customer', text='Customer', command=lambda: self.sort_invoices_by_column('customer'))
         self.invoice_tree.column('customer', width=150)
-        self.invoice_tree.heading('invoice_date', text='Invoice Date')
+        self.invoice_tree.heading('invoice_date', text='Invoice Date',
+                                  command=lambda: self.sort_invoices_by_column('invoice_date'))
         self.invoice_tree.column('invoice_date', width=100)
-        self.invoice_tree.heading('due_date', text='Due Date')
+        self.invoice_tree.heading('due_date', text='Due Date', command=lambda: self.sort_invoices_by_column('due_date'))
         self.invoice_tree.column('due_date', width=100)
-        self.invoice_tree.heading('total_amount', text='Total')
+        self.invoice_tree.heading('total_amount', text='Total',
+                                  command=lambda: self.sort_invoices_by_column('total_amount'))
         self.invoice_tree.column('total_amount', width=80, anchor=tk.E)
-        self.invoice_tree.heading('status', text='Status')
+        self.invoice_tree.heading('status', text='Status', command=lambda: self.sort_invoices_by_column('status'))
         self.invoice_tree.column('status', width=80, anchor=tk.CENTER)
 
 
         # Add a scrollbar
-        scrollbar = ttk.Scrollbar(invoice_tree_frame, orient=tk.VERTICAL, command=self.invoice_tree.yview)
-        self.invoice_tree.configure(yscroll=scrollbar.set)
+        scrollbar = ttk.Scrollbar(invoice_tree_frame, orient=tk.VERTICAL)
 
         self.invoice_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
+        # Virtual like the customer list
+        self.invoice_pager = ledger.invoice_pager()
+        self.invoice_view = VirtualTreeview(self.invoice_tree, scrollbar, self.invoice_pager, self.executor)
+        self._last_invoice_sort_column = None
+        self._last_invoice_sort_reverse = False
+        # Ctrl+A selects every listed invoice; Delete removes the selection
+        self.invoice_tree.bind("<Delete>", lambda event: self.delete_invoice())
+
         # --- Action Buttons ---
         invoice_actions_frame = ttk.Frame(parent_frame, padding="10")
         invoice_actions_frame.pack(fill=tk.X)
         
         ttk.Button(invoice_actions_frame, text="Create New Invoice", command=self.create_invoice).pack(side=tk.LEFT, padx=5)
         ttk.Button(invoice_actions_frame, text="View/Edit Invoice", command=self.edit_invoice).pack(side=tk.LEFT, padx=5)
-        ttk.Button(invoice_actions_frame, text="Delete Invoice", command=self.delete_invoice).pack(side=tk.LEFT, padx=5)
+        ttk.Button(invoice_actions_frame, text="Delete Selected",
+                   command=self.delete_invoice).pack(side=tk.LEFT, padx=5)
+        status_button = ttk.Menubutton(invoice_actions_frame, text="Set Status")
+        status_menu = tk.Menu(status_button, tearoff=0)
+        for status in ledger.INVOICE_STATUSES:
+            status_menu.add_command(label=status, command=lambda status=status: self.set_invoice_status(status))
+        status_button["menu"] = status_menu
+        status_button.pack(side=tk.LEFT, padx=5)
+
+    def _create_invoice_filter_bar(self, parent_frame):
+        # --- Invoice Filter Bar ---
+        filter_frame = ttk.LabelFrame(parent_frame, text="Filter Invoices", padding="10")
+        filter_frame.pack(fill=tk.X, pady=(0, 10))
+
+        ttk.Label(filter_frame, text="Status:").grid(row=0, column=0, sticky="w", padx=(0, 5))
+        self.invoice_status_filter = ttk.Combobox(
+            filter_frame, values=("Any",) + ledger.INVOICE_STATUSES + ("Overdue",), state="readonly", width=10)
+        self.invoice_status_filter.set("Any")
+        self.invoice_status_filter.grid(row=0, column=1, sticky="w", padx=(0, 10))
+        self.invoice_status_filter.bind("<<ComboboxSelected>>", self.apply_invoice_filter)
+
+        ttk.Label(filter_frame, text="Period:").grid(row=0, column=2, sticky="w", padx=(0, 5))
+        self.invoice_period_filter = ttk.Combobox(
+            filter_frame, values=("Any time",) + ledger.PERIODS, state="readonly", width=12)
+        self.invoice_period_filter.set("Any time")
+        self.invoice_period_filter.grid(row=0, column=3, sticky="w", padx=(0, 10))
+        self.invoice_period_filter.bind("<<ComboboxSelected>>", self._on_invoice_period_selected)
+
+        ttk.Label(filter_frame, text="From:").grid(row=0, column=4, sticky="w", padx=(0, 5))
+        self.invoice_from_filter = ttk.Entry(filter_frame, width=11)
+        self.invoice_from_filter.grid(row=0, column=5, sticky="w", padx=(0, 10))
+        ttk.Label(filter_frame, text="To:").grid(row=0, column=6, sticky="w", padx=(0, 5))
+        self.invoice_to_filter = ttk.Entry(filter_frame, width=11)
+        self.invoice_to_filter.grid(row=0, column=7, sticky="w")
+
+        ttk.Label(filter_frame, text="Customer:").grid(row=1, column=0, sticky="w", padx=(0, 5), pady=(5, 0))
+        self.invoice_customer_filter = ttk.Entry(filter_frame)
+        self.invoice_customer_filter.grid(row=1, column=1, columnspan=3, sticky="we", padx=(0, 10), pady=(5, 0))
+
+        ttk.Label(filter_frame, text="Total:").grid(row=1, column=4, sticky="w", padx=(0, 5), pady=(5, 0))
+        self.invoice_min_filter = ttk.Entry(filter_frame, width=11)
+        self.invoice_min_filter.grid(row=1, column=5, sticky="w", padx=(0, 10), pady=(5, 0))
+        ttk.Label(filter_frame, text="to").grid(row=1, column=6, sticky="w", padx=(0, 5), pady=(5, 0))
+        self.invoice_max_filter = ttk.Entry(filter_frame, width=11)
+        self.invoice_max_filter.grid(row=1, column=7, sticky="w", pady=(5, 0))
+
+        for entry in (self.invoice_from_filter, self.invoice_to_filter, self.invoice_customer_filter,
+                      self.invoice_min_filter, self.invoice_max_filter):
+            entry.bind("<Return>", self.apply_invoice_filter)
+
+        # Archived invoices are listed when asked for or when the From date reaches back to them
+        self.invoice_archived_filter = tk.BooleanVar(value=False)
+        ttk.Checkbutton(filter_frame, text="Include archived", variable=self.invoice_archived_filter,
+                        command=self.apply_invoice_filter).grid(row=2, column=0, columnspan=4, sticky="w",
+                                                                pady=(5, 0))
+
+        ttk.Button(filter_frame, text="Apply", command=self.apply_invoice_filter).grid(row=0, column=8, padx=(10, 0))
+        ttk.Button(filter_frame, text="Clear", command=self.clear_invoice_filter).grid(row=1, column=8, padx=(10, 0),
+                                                                                      pady=(5, 0))
+
+    def _on_invoice_period_selected(self, event=None):
+        """Fill in the date range for the chosen period and apply it."""
+        period = self.invoice_period_filter.get()
+        first, last = ledger.period_dates(period) if period in ledger.PERIODS else ("", "")
+        for entry, value in ((self.invoice_from_filter, first), (self.invoice_to_filter, last)):
+            entry.delete(0, tk.END)
+            entry.insert(0, value)
+        self.apply_invoice_filter()
+
+    def apply_invoice_filter(self, event=None):
+        """Show only the invoices matching the filter bar, keeping the current sort."""
+        status = self.invoice_status_filter.get()
+        customer = self.invoice_customer_filter.get().strip()
+        date_from = self.invoice_from_filter.get().strip() or None
+        try:
+            min_amount = self.invoice_min_filter.get().strip()
+            max_amount = self.invoice_max_filter.get().strip()
+            where, params = ledger.invoice_filter(
+                status=status if status in ledger.INVOICE_STATUSES else None,
+                overdue=status == "Overdue",
+                date_from=date_from,
+                date_to=self.invoice_to_filter.get().strip() or None,
+                customer=customer_filter(customer, self.fts_enabled) if customer else None,
+                min_amount=float(min_amount) if min_amount else None,
+                max_amount=float(max_amount) if max_amount else None)
+        except ValueError:
+            messagebox.showerror("Error", "Dates must be YYYY-MM-DD and totals must be numbers.")
+            return
+        # The archive is only searched when it can hold matching invoices
+        include_archived = ((self.invoice_archived_filter.get() or date_from is not None)
+                            and archive.reaches(self.conn, date_from, [status] if status != "Any" else None))
+        ledger.set_invoice_sources(self.invoice_pager, include_archived)
+        self.invoice_pager.set_filter(where, params)
+        self.invoice_view.reload()
+
+    def clear_invoice_filter(self):
+        """Show every invoice again."""
+        self.invoice_status_filter.set("Any")
+        self.invoice_period_filter.set("Any time")
+        self.invoice_archived_filter.set(False)
+        for entry in (self.invoice_from_filter, self.invoice_to_filter, self.invoice_customer_filter,
+                      self.invoice_min_filter, self.invoice_max_filter):
+            entry.delete(0, tk.END)
+        self.apply_invoice_filter()
 
     def load_invoices(self):
-        """Clear the treeview and load all invoices from the database."""
-        self.root.config(cursor="watch") # Set a busy cursor
-        self.root.update_idletasks() # Ensure cursor updates immediately
-        try:
-            # Clear existing items to prevent duplication
-            for item in self.invoice_tree.get_children():
-                self.invoice_tree.delete(item)
-
-            # Fetch and display new data
-            query = """
-                SELECT i.id, c.name, i.invoice_date, i.due_date, i.total_amount, i.status
-                FROM invoices i
-                JOIN customers c ON i.customer_id = c.id
-                ORDER BY i.id
-            """
-            self.cursor.execute(query)
-
-            invoices = self.cursor.fetchall()
-            for invoice in invoices:
-                self.invoice_tree.insert('', tk.END, values=invoice)
-        finally:
-            self.root.config(cursor="") # Reset to the default cursor
+        """Reload the invoice list in the background, keeping the scroll position."""
+        self.invoice_view.reload(keep_position=True)
+
+    def sort_invoices_by_column(self, col):
+        """Sort the invoice list when a column header is clicked; a second click reverses it."""
+        if col == self._last_invoice_sort_column:
+            reverse = not self._last_invoice_sort_reverse
+        else:
+            reverse = False
+
+        self.invoice_pager.set_sort(col, reverse)
+        self.invoice_view.reload()
+
+        self._last_invoice_sort_column = col
+        self._last_invoice_sort_reverse = reverse
 
     def create_invoice(self):
         InvoiceWindow(self)
 
     def edit_invoice(self):
-        selected_item = self.invoice_tree.focus()
-        if not selected_item:
+        invoice = self.invoice_view.focused_row()
+        if not invoice:
             messagebox.showerror("Error", "Please select an invoice to edit.")
             return
-        invoice_id = self.invoice_tree.item(selected_item, 'values')[0]
-        InvoiceWindow(self, invoice_id)
+        InvoiceWindow(self, invoice[0], invoice)
+
+    def _selected_invoices(self, action):
+        """The selected invoices as listed, minus archived ones (which are read-only); None if there are none."""
+        invoice_ids = self.invoice_view.selected_ids()
+        if not invoice_ids:
+            messagebox.showerror("Error", f"Please select the invoices to {action}.")
+            return None
+        invoices = [row for row in self.invoice_pager.rows(self.conn, invoice_ids) if not row[7]]
+        if not invoices:
+            messagebox.showerror("Error", f"Archived invoices are kept as they were; they can't {action}.")
+            return None
+        return invoices
 
     def delete_invoice(self):
-        selected_item = self.invoice_tree.focus()
-        if not selected_item:
-            messagebox.showerror("Error", "Please select an invoice to delete.")
+        """Delete the selected invoices and their items in one transaction."""
+        invoices = self._selected_invoices("be deleted")
+        if not invoices:
             return
-        
-        invoice_id = self.invoice_tree.item(selected_item, 'values')[0]
+        if len(invoices) == 1:
+            question = f"Are you sure you want to delete invoice ID: {invoices[0][0]}?"
+        else:
+            question = f"Are you sure you want to delete {len(invoices)} invoices?"
+        skipped = len(self.invoice_view.selected_ids()) - len(invoices)
+        if skipped:
+            question += f"\n\n{skipped} archived invoices are kept."
+        if not messagebox.askyesno("Confirm Delete", question):
+            return
+        try:
+            deleted, items = ledger.delete_invoices(self.conn, [row[0] for row in invoices])
+        except sqlite3.Error as e:
+            messagebox.showerror("Database Error", f"Failed to delete invoices: {e}")
+            return
+        self.show_status(f"{len(deleted)} invoices deleted successfully.")
+        self.invoice_view.apply_changes([], old_rows=invoices)
 
-        if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete invoice ID: {invoice_id}?"):
-            try:
-                self.cursor.execute("DELETE FROM invoice_items WHERE invoice_id = ?", (invoice_id,))
-                self.cursor.execute("DELETE FROM invoices WHERE id = ?", (invoice_id,))
-                self.conn.commit()
-                self.show_status(f"Invoice ID: {invoice_id} deleted successfully.")
-                self.load_invoices()
-            except sqlite3.Error as e:
-                messagebox.showerror("Database Error", f"Failed to delete invoice: {e}")
+        def restore():
+            ledger.restore_invoices(self.conn, deleted, items)
+            self.invoice_view.apply_changes([row[0] for row in deleted])
+            return f"Restored {len(deleted)} invoices."
 
-    def load_customers(self, search_term=""):
-        """Clear the treeview and load all customers from the database."""
-        self.root.config(cursor="watch") # Set a busy cursor
-        self.root.update_idletasks() # Ensure cursor updates immediately
+        self._set_undo("Undo Delete", restore)
+
+    def set_invoice_status(self, status):
+        """Give the selected invoices a status with one statement."""
+        invoices = self._selected_invoices("change status")
+        if not invoices:
+            return
         try:
-            # Clear existing items to prevent duplication
-            for item in self.tree.get_children():
-                self.tree.delete(item)
-
-            # Fetch and display new data, with optional search
-            if search_term:
-                query = "SELECT id, name, email, contact FROM customers WHERE name LIKE ? ORDER BY id"
-                self.cursor.execute(query, ('%' + search_term + '%',))
-            else:
-                query = "SELECT id, name, email, contact FROM customers ORDER BY id"
-                self.cursor.execute(query)
-
-            customers = self.cursor.fetchall()
-            for customer in customers:
-                self.tree.insert('', tk.END, values=customer)
-        finally:
-            self.root.config(cursor="") # Reset to the default cursor
+            previous = ledger.set_invoice_status(self.conn, [row[0] for row in invoices], status)
+        except sqlite3.Error as e:
+            messagebox.showerror("Database Error", f"Failed to change the status: {e}")
+            return
+        changed = {invoice_id for invoice_id, _ in previous}
+        self.show_status(f"{len(changed)} invoices set to {status}.")
+        self.invoice_view.apply_changes(changed, old_rows=[row for row in invoices if row[0] in changed])
+
+        def restore():
+            listed = self.invoice_pager.rows(self.conn, changed)
+            ledger.restore_invoice_statuses(self.conn, previous)
+            self.invoice_view.apply_changes(changed, old_rows=listed)
+            return f"Restored the status of {len(changed)} invoices."
+
+        if changed:
+            self._set_undo("Undo Status Change", restore)
+
+    def load_customers(self, search_term=""):
+        """Reload the customer list, showing only the rows that fit on screen."""
+        # Apply the optional search, keeping the current sort order
+        if search_term:
+            self.customer_pager.set_filter(*customer_filter(search_term, self.fts_enabled))
+        else:
+            self.customer_pager.set_filter()
+        self._last_search_term = search_term
+        # Runs in the background; a newer search supersedes one still running
+        self.customer_view.reload()
 
     def search_customers(self, event=None):
+        """Schedule a search once the user pauses typing."""
+        # Restart the timer on every keystroke so a burst of typing runs one query
+        if self._search_timer:
+            self.root.after_cancel(self._search_timer)
+        self._search_timer = self.root.after(SEARCH_DELAY_MS, self._run_search)
+
+    def _run_search(self):
         """Filter the customer list based on the search entry."""
+        self._search_timer = None
         search_term = self.search_entry.get().strip()
-        self.load_customers(search_term)
+        if search_term != self._last_search_term:
+            self.load_customers(search_term)
 
     def sort_by_column(self, col, reverse):
-        """Sort treeview data when a column header is clicked."""
-        # Get data from all rows
-        data = [(self.tree.set(child, col), child) for child in self.tree.get_children('')]
-
+        """Sort the customer list when a column header is clicked."""
         # Determine sort order
         if col == self._last_sort_column:
             reverse = not self._last_sort_reverse
         else:
             reverse = False
 
-        # If the column is 'id', sort numerically, otherwise sort as strings (case-insensitive)
-        if col == 'id':
-            data.sort(key=lambda t: int(t[0]), reverse=reverse)
-        else:
-            data.sort(key=lambda t: t[0].lower(), reverse=reverse)
-
-        for index, (val, child) in enumerate(data):
-            self.tree.move(child, '', index)
+        # The database does the sorting; 'id' sorts numerically, the rest case-insensitively
+        self.customer_pager.set_sort(col, reverse)
+        self.customer_view.reload()
 
         # Update heading to show sort direction
         self.tree.heading(col, text=col.capitalize(), command=lambda: self.sort_by_column(col, not reverse))
@@ -362,30 +583,49 @@ class BookkeepingApp:
         self._last_sort_reverse = reverse
 
     def export_to_csv(self):
-        """Export the current customer list to a CSV file."""
+        """Open the export window for customers, invoices or invoice items."""
+        ExportWindow(self)
+
+    def import_from_csv(self, table):
+        """Bulk-import customers, invoices or invoice items from a CSV file."""
         from tkinter import filedialog
-        
-        # Open a "save as" dialog
-        file_path = filedialog.asksaveasfilename(
-            defaultextension=".csv",
+        import importer
+
+        label = table.replace("_", " ")
+        file_path = filedialog.askopenfilename(
             filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
-            title="Export Customers to CSV"
+            title=f"Import {label.title()} from CSV"
         )
 
         if not file_path:
             return # User cancelled the dialog
 
-        try:
-            self.cursor.execute("SELECT id, name, email, contact FROM customers ORDER BY name")
-            customers = self.cursor.fetchall()
-            
-            with open(file_path, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow(['ID', 'Name', 'Email', 'Contact']) # Write header
-                writer.writerows(customers) # Write data
-            self.show_status(f"Successfully exported {len(customers)} customers to {file_path}")
-        except (IOError, sqlite3.Error) as e:
-            messagebox.showerror("Export Error", f"Failed to export data: {e}")
+        def run_import(conn, job):
+            return importer.import_csv(conn, table, file_path, progress=job.progress, cancelled=lambda: job.cancelled)
+
+        def imported(result):
+            self.note_own_write()
+            self.show_status(str(result), duration=10000)
+            if result.rejected:
+                messagebox.showwarning("Import", f"{result.rejected} rows could not be imported.\n"
+                                                 f"They were written to {result.rejects_path}")
+            self.mark_stale("customers" if table == "customers" else "invoices")
+
+        def importing(done, total, message):
+            # Reported after each chunk commits; the list reloads once the import is done
+            self.note_own_write()
+            self.show_status(f"Importing {label}... {done} rows read")
+
+        def import_failed(error):
+            # The chunks written before the error stay
+            self.mark_stale("customers" if table == "customers" else "invoices")
+            messagebox.showerror("Import Error", f"Failed to import data: {error}")
+
+        self.executor.submit(
+            run_import, long=True,
+            on_done=imported,
+            on_error=import_failed,
+            on_progress=importing)
 
     def show_status(self, message, duration=4000):
         """Display a message in the status bar for a set duration."""
@@ -407,78 +647,90 @@ class BookkeepingApp:
             messagebox.showerror("Error", "Name is a required field!")
             return
 
-        self.cursor.execute("INSERT INTO customers (name, email, contact) VALUES (?, ?, ?)",
-                            (name, email, contact))
-        self.conn.commit()
+        try:
+            with write_transaction(self.conn):
+                self.cursor.execute("INSERT INTO customers (name, email, contact) VALUES (?, ?, ?)",
+                                    (name, email, contact))
+        except sqlite3.Error as e:
+            messagebox.showerror("Database Error", f"Failed to add customer: {e}")
+            return
         self.show_status(f"Customer '{name}' added successfully.")
         self.name_entry.delete(0, tk.END)
         self.email_entry.delete(0, tk.END)
         self.contact_entry.delete(0, tk.END)
 
-        # Refresh the customer list to show the new entry
-        self.load_customers()
+        # Show the new entry in its sorted place
+        self.customer_view.apply_change(self.cursor.lastrowid)
 
     def delete_customer(self):
-        """Delete the selected customer from the database."""
-        selected_item = self.tree.focus()
-        if not selected_item:
-            messagebox.showerror("Error", "Please select a customer to delete.")
+        """Delete the selected customers from the database in one transaction."""
+        customer_ids = self.customer_view.selected_ids()
+        if not customer_ids:
+            messagebox.showerror("Error", "Please select the customers to delete.")
+            return
+        # The rows as listed, to take them out of the view
+        customers = self.customer_pager.rows(self.conn, customer_ids)
+        if not customers:
             return
-
-        # Get the data of the selected row
-        customer_data = self.tree.item(selected_item, 'values')
-        customer_id = customer_data[0]
-        customer_name = customer_data[1]
 
         # Ask for confirmation
-        if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete {customer_name}?"):
-            # Store the customer data before deleting for the undo feature
-            self._last_deleted_customer = {
-                'id': customer_id,
-                'name': customer_name,
-                'email': customer_data[2],
-                'contact': customer_data[3]
-            }
-
-            try:
-                self.cursor.execute("DELETE FROM customers WHERE id = ?", (customer_id,))
-                self.conn.commit()
-                self.show_status(f"Customer '{customer_name}' deleted successfully.")
-                self.load_customers() # Refresh the list
-                self._add_undo_option()
-            except sqlite3.Error as e:
-                messagebox.showerror("Database Error", f"Failed to delete customer: {e}")
-
-    def _add_undo_option(self):
-        """Adds an 'Undo Delete' option to the File menu."""
+        if len(customers) == 1:
+            question = f"Are you sure you want to delete {customers[0][1]}?"
+        else:
+            question = f"Are you sure you want to delete {len(customers)} customers?"
+        if not messagebox.askyesno("Confirm Delete", question):
+            return
+        try:
+            deleted = ledger.delete_customers(self.conn, [row[0] for row in customers])
+        except sqlite3.Error as e:
+            messagebox.showerror("Database Error", f"Failed to delete customers: {e}")
+            return
+        if len(deleted) == 1:
+            self.show_status(f"Customer '{deleted[0][1]}' deleted successfully.")
+        else:
+            self.show_status(f"{len(deleted)} customers deleted successfully.")
+        self.customer_view.apply_changes([], old_rows=customers)  # Drop them from the list
+        self.mark_stale("invoices")
+
+        def restore():
+            ledger.restore_customers(self.conn, deleted)
+            self.customer_view.apply_changes([row[0] for row in deleted])
+            self.mark_stale("invoices")
+            if len(deleted) == 1:
+                return f"Restored customer '{deleted[0][1]}'."
+            return f"Restored {len(deleted)} customers."
+
+        self._set_undo("Undo Delete", restore)
+
+    def _set_undo(self, label, restore):
+        """Offer to undo the last change from the File menu; `restore()` reverses it and returns a status message."""
         file_menu = self.root.nametowidget(self.root.cget("menu")).winfo_children()[0]
-        file_menu.insert_command(self.undo_menu_item_index, label="Undo Delete", command=self.undo_delete)
+        if self._undo:
+            file_menu.delete(self._undo[0])
+        self._undo = (label, restore)
+        file_menu.insert_command(self.undo_menu_item_index, label=label, command=self.undo_delete)
 
     def open_edit_window(self, event=None):
         """Open a new window to edit the selected customer's details."""
-        selected_item = self.tree.focus()
-        if not selected_item:
+        customer_data = self.customer_view.focused_row()
+        if not customer_data:
             return  # No item selected
 
-        customer_data = self.tree.item(selected_item, 'values')
         EditWindow(self, customer_data)
 
     def undo_delete(self):
-        """Re-inserts the last deleted customer into the database."""
-        if self._last_deleted_customer:
-            customer = self._last_deleted_customer
+        """Reverses the last delete or status change, the whole batch at once."""
+        if self._undo:
+            label, restore = self._undo
             try:
-                self.cursor.execute("INSERT INTO customers (id, name, email, contact) VALUES (?, ?, ?, ?)",
-                                    (customer['id'], customer['name'], customer['email'], customer['contact']))
-                self.conn.commit()
-                self.show_status(f"Restored customer '{customer['name']}'.")
-                self.load_customers()
-                self._last_deleted_customer = None
-                # Remove the 'Undo' option from the menu
-                file_menu = self.root.nametowidget(self.root.cget("menu")).winfo_children()[0]
-                file_menu.delete("Undo Delete")
+                self.show_status(restore())
             except sqlite3.Error as e:
-                messagebox.showerror("Undo Error", f"Failed to restore customer: {e}")
+                messagebox.showerror("Undo Error", f"Failed to undo: {e}")
+                return
+            self._undo = None
+            # Remove the 'Undo' option from the menu
+            file_menu = self.root.nametowidget(self.root.cget("menu")).winfo_children()[0]
+            file_menu.delete(label)
 
     def show_context_menu(self, event):
         """Display a right-click context menu on the treeview."""
@@ -486,60 +738,216 @@ class BookkeepingApp:
         item_id = self.tree.identify_row(event.y)
 
         if item_id:
-            # Select the right-clicked item
-            self.tree.selection_set(item_id)
+            # Select the right-clicked item, unless it is part of the selection already
+            if item_id not in self.tree.selection():
+                self.customer_view.clear_selection()
+                self.tree.selection_set(item_id)
             self.tree.focus(item_id)
 
             # Create a context menu
             context_menu = tk.Menu(self.root, tearoff=0)
             context_menu.add_command(label="Edit Customer", command=self.open_edit_window)
-            context_menu.add_command(label="Delete Customer", command=self.delete_customer)
+            context_menu.add_command(label="Delete Selected Customers", command=self.delete_customer)
             
             # Display the menu at the cursor's position
             context_menu.tk_popup(event.x_root, event.y_root)
 
     def on_tab_selected(self, event):
-        selected_tab = self.notebook.index(self.notebook.select())
-        if selected_tab == 0: # Customer tab
-            self.load_customers()
-        elif selected_tab == 1: # Invoices tab
+        """Load the tab being shown if it has not been loaded yet or has gone stale."""
+        self._load_visible_tab()
+
+    def mark_stale(self, *tabs):
+        """Note that data shown on these tabs changed; a visible one reloads now, others when shown."""
+        self._stale_tabs.update(tabs)
+        self._load_visible_tab()
+
+    def _load_visible_tab(self):
+        tab = TABS[self.notebook.index(self.notebook.select())]
+        if tab not in self._stale_tabs:
+            return
+        self._stale_tabs.discard(tab)
+        if tab == "customers":
+            # Keeps the current search and sort
+            self.customer_view.reload(keep_position=True)
+        else:
             self.load_invoices()
 
     def open_preferences_window(self):
         """Opens the preferences window."""
         PreferencesWindow(self)
 
+    def open_reports_window(self):
+        """Opens the reports window."""
+        ReportsWindow(self)
+
+    def open_diagnostics_window(self):
+        """Opens the query diagnostics window."""
+        DiagnosticsWindow(self)
+
+    # --- Archive ---
+
+    def archive_invoices(self):
+        """Move paid invoices dated before a chosen day into the archive database."""
+        from tkinter import simpledialog
+
+        before = simpledialog.askstring(
+            "Archive Paid Invoices", "Archive paid invoices dated before (YYYY-MM-DD):",
+            initialvalue=date(date.today().year - 1, 1, 1).isoformat(), parent=self.root)
+        if not before:
+            return
+        try:
+            before = date.fromisoformat(before.strip()).isoformat()
+        except ValueError:
+            messagebox.showerror("Error", "Please enter the date as YYYY-MM-DD.")
+            return
+        if not messagebox.askyesno(
+                "Confirm Archive",
+                f"Move paid invoices dated before {before} to {archive.archive_path(DB_PATH)}?\n\n"
+                "They stay in the reports and can be listed with 'Include archived', "
+                "but can no longer be edited. Other instances wait while they are moved."):
+            return
+
+        def run_archive(conn, job):
+            return archive.move_invoices(conn, before, progress=lambda message: job.progress(0, None, message))
+
+        self.show_status("Archiving...")
+        self.executor.submit(
+            run_archive, channel="archive", long=True,
+            on_done=self._on_archived,
+            on_error=lambda e: messagebox.showerror("Archive Error", f"Failed to archive invoices: {e}"),
+            on_progress=lambda done, total, message: self.show_status(f"Archiving: {message}..."))
+
+    def _on_archived(self, moved):
+        self.note_own_write()
+        archive.attach(self.conn)
+        # The workers' connections predate the archive if this was the first move
+        self.executor.reconnect()
+        self.show_status(f"Archived {moved[0]} invoices.", duration=8000)
+        self.apply_invoice_filter()
+        self.mark_stale(*TABS)
+
+    # --- Backups ---
+
+    def _check_backup_schedule(self):
+        """Start a backup if the last scheduled one is older than the backup interval."""
+        import backup
+
+        interval = self.settings.get("backup_interval_hours", backup.BACKUP_INTERVAL_HOURS)
+        last = self.settings.get("last_backup_at", 0)
+        # The in-memory check is free; only claim the backup (a write) once it looks due
+        if interval > 0 and time.time() - last >= interval * 3600 and self._backup_job is None:
+            try:
+                if backup.claim_scheduled_backup(self.conn, interval):
+                    # Our own commits don't show up in data_version, so re-read the claim
+                    self.settings.reload()
+                    self.start_backup(scheduled=True)
+            except sqlite3.Error as e:
+                print(f"Warning: Could not schedule a backup: {e}")
+        self._backup_timer = self.root.after(BACKUP_CHECK_MS, self._check_backup_schedule)
+
+    def start_backup(self, scheduled=False):
+        """Back up the database on a worker connection, showing progress in the status bar."""
+        import backup
+
+        if self._backup_job is not None:
+            self.show_status("A backup is already running.")
+            return
+        directory = self.settings.get("backup_dir") or None
+        keep = self.settings.get("backup_keep", backup.KEEP_BACKUPS)
+        compress = bool(self.settings.get("backup_compress", 0))
+
+        def run_backup(conn, job):
+            return backup.backup_database(conn, directory, keep, compress, progress=job.progress,
+                                          cancelled=lambda: job.cancelled)
+
+        self.show_status("Backing up...")
+        self._backup_job = self.executor.submit(
+            run_backup, channel="backup", long=True,
+            on_done=self._on_backed_up,
+            on_error=lambda error: self._on_backup_failed(error, scheduled),
+            on_progress=self._on_backup_progress)
+
+    def _on_backup_progress(self, done, total, message):
+        self.show_status(f"Backup: {message} {done * 100 // total}%..." if total else f"Backup: {message}...")
+
+    def _on_backed_up(self, path):
+        self._backup_job = None
+        self.show_status(f"Backed up to {path}", duration=8000)
+
+    def _on_backup_failed(self, error, scheduled):
+        self._backup_job = None
+        self.show_status(f"Backup failed: {error}", duration=8000)
+        if not scheduled:
+            messagebox.showerror("Backup Failed", f"The database could not be backed up: {error}")
+
     def on_closing(self):
         """Handles the window closing event to save geometry and close the DB connection."""
         self._save_geometry()
+        self.root.after_cancel(self._change_timer)
+        if self._backup_timer:
+            self.root.after_cancel(self._backup_timer)
+        self.executor.shutdown()
         self.conn.close()
         self.root.destroy()
 
+    def _on_first_paint(self, event):
+        # Children's Expose events reach this binding too; only the first one counts
+        self.root.unbind("<Expose>")
+        if STARTUP_PROBE:
+            print(f"startup-probe first-paint {time.monotonic()}", flush=True)
+        # Idle callbacks run after the pending redraws, so the window is fully painted by then
+        self.root.after_idle(self.finish_startup)
+
+    def finish_startup(self):
+        """Apply the theme and window icon, which are slow to load, after the first paint."""
+        self.set_theme(self.theme)
+        try:
+            # Tk reads PNG itself; keep a reference or the image is garbage collected
+            self._icon_image = tk.PhotoImage(file="icon.png")
+            self.root.iconphoto(False, self._icon_image)
+        except tk.TclError:
+            print("Warning: icon.png not found. Skipping icon setup.")
+        if STARTUP_PROBE:
+            self.root.update_idletasks()
+            print(f"startup-probe themed {time.monotonic()}", flush=True)
+            self.root.after_idle(self.on_closing)
+            return
+        self._backup_timer = self.root.after(BACKUP_CHECK_MS, self._check_backup_schedule)
+
+    def set_theme(self, theme_name):
+        """Switch between the light and dark sv-ttk themes."""
+        import sv_ttk
+
+        sv_ttk.set_theme(theme_name)
+        self.theme = theme_name
+
     def _save_geometry(self):
         """Saves the current window size and position to a config file."""
         try:
             with open("config.json", "w") as f:
-                config = {"geometry": self.root.geometry(), "theme": sv_ttk.get_theme()}
+                config = {"geometry": self.root.geometry(), "theme": self.theme}
                 json.dump(config, f, indent=4)
         except IOError as e:
             print(f"Warning: Could not save window geometry: {e}")
 
     def _load_geometry(self):
-        """Loads the window size and position from a config file."""
+        """Loads the window size and position (and the theme to apply later) from a config file."""
+        self.theme = "dark"
         try:
             with open("config.json", "r") as f: 
                 config = json.load(f)
                 self.root.geometry(config["geometry"])
-                sv_ttk.set_theme(config.get("theme", "dark"))
+                self.theme = config.get("theme", "dark")
         except (IOError, json.JSONDecodeError, KeyError):
             # File doesn't exist, is corrupt, or key is missing. Use default size.
-            sv_ttk.set_theme("dark")
+            pass
 
 class EditWindow(tk.Toplevel):
     """A Toplevel window for editing a customer's details."""
     def __init__(self, parent_app, customer_data):
         super().__init__(parent_app.root)
         self.parent_app = parent_app
+        self.customer_data = customer_data
         self.customer_id, old_name, old_email, old_contact = customer_data
 
         self.title("Edit Customer")
@@ -582,13 +990,14 @@ class EditWindow(tk.Toplevel):
             return
 
         try:
-            cursor = self.parent_app.cursor
-            cursor.execute("UPDATE customers SET name = ?, email = ?, contact = ? WHERE id = ?",
-                                (new_name, new_email, new_contact, self.customer_id))
-            self.parent_app.conn.commit()
+            with write_transaction(self.parent_app.conn):
+                self.parent_app.cursor.execute("UPDATE customers SET name = ?, email = ?, contact = ? WHERE id = ?",
+                                               (new_name, new_email, new_contact, self.customer_id))
             self.destroy()
             self.parent_app.show_status(f"Customer '{new_name}' updated successfully.")
-            self.parent_app.load_customers()
+            self.parent_app.customer_view.apply_change(self.customer_id, old_row=self.customer_data)
+            # The invoice list shows customer names
+            self.parent_app.mark_stale("invoices")
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", f"Failed to update customer: {e}", parent=self)
 
@@ -615,38 +1024,464 @@ class PreferencesWindow(tk.Toplevel):
         self.tax_rate_entry.pack(fill=tk.X, pady=2)
         self.load_tax_rate()
 
+        # --- Backups ---
+        import backup
+
+        settings = parent_app.settings
+        ttk.Label(frame, text="Backup folder (empty for backups/ next to the database):").pack(pady=(10, 5))
+        folder_frame = ttk.Frame(frame)
+        folder_frame.pack(fill=tk.X, pady=2)
+        self.backup_dir_entry = ttk.Entry(folder_frame)
+        self.backup_dir_entry.insert(0, settings.get("backup_dir", ""))
+        self.backup_dir_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        ttk.Button(folder_frame, text="Browse...", command=self.choose_backup_dir).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Label(frame, text="Back up every (hours, 0 for never):").pack(pady=(10, 5))
+        self.backup_interval_entry = ttk.Entry(frame)
+        interval = settings.get("backup_interval_hours", backup.BACKUP_INTERVAL_HOURS)
+        self.backup_interval_entry.insert(0, f"{interval:g}")
+        self.backup_interval_entry.pack(fill=tk.X, pady=2)
+        ttk.Label(frame, text="Backups to keep:").pack(pady=(10, 5))
+        self.backup_keep_entry = ttk.Entry(frame)
+        self.backup_keep_entry.insert(0, str(settings.get("backup_keep", backup.KEEP_BACKUPS)))
+        self.backup_keep_entry.pack(fill=tk.X, pady=2)
+        self.backup_compress_var = tk.BooleanVar(value=bool(settings.get("backup_compress", 0)))
+        ttk.Checkbutton(frame, text="Compress backups (gzip)", variable=self.backup_compress_var).pack(
+            anchor=tk.W, pady=(10, 2))
+
         save_button = ttk.Button(frame, text="Save Preferences", command=self.save_preferences)
         save_button.pack(pady=10)
 
     def set_theme(self, theme_name):
-        sv_ttk.set_theme(theme_name)
+        self.parent_app.set_theme(theme_name)
         self.parent_app.show_status(f"Theme changed to {theme_name}. Restart app for full effect.")
 
+    def choose_backup_dir(self):
+        from tkinter import filedialog
+
+        directory = filedialog.askdirectory(parent=self, title="Backup Folder")
+        if directory:
+            self.backup_dir_entry.delete(0, tk.END)
+            self.backup_dir_entry.insert(0, directory)
+
     def load_tax_rate(self):
-        self.parent_app.cursor.execute("SELECT value FROM settings WHERE key = 'tax_rate'")
-        tax_rate = float(self.parent_app.cursor.fetchone()[0]) * 100
+        tax_rate = self.parent_app.settings['tax_rate'] * 100
         self.tax_rate_entry.insert(0, f"{tax_rate:.2f}")
 
     def save_preferences(self):
         try:
             tax_rate = float(self.tax_rate_entry.get()) / 100
-            self.parent_app.cursor.execute("UPDATE settings SET value = ? WHERE key = ?", (str(tax_rate), 'tax_rate'))
-            self.parent_app.conn.commit()
+            backup_interval = float(self.backup_interval_entry.get())
+            backup_keep = int(self.backup_keep_entry.get())
+            if backup_interval < 0 or backup_keep < 1:
+                raise ValueError
+            settings = self.parent_app.settings
+            settings.set('tax_rate', tax_rate)
+            settings.set('backup_dir', self.backup_dir_entry.get().strip())
+            settings.set('backup_interval_hours', backup_interval)
+            settings.set('backup_keep', backup_keep)
+            settings.set('backup_compress', int(self.backup_compress_var.get()))
             self.parent_app.show_status("Preferences saved successfully.")
             self.destroy()
         except ValueError:
-            messagebox.showerror("Error", "Invalid tax rate. Please enter a number.", parent=self)
+            messagebox.showerror("Error", "Invalid tax rate or backup settings. Please enter numbers "
+                                          "(at least one backup to keep).", parent=self)
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", f"Failed to save preferences: {e}", parent=self)
 
+class ExportWindow(tk.Toplevel):
+    """A Toplevel window for exporting a ledger to CSV in the background."""
+    LEDGERS = {"Customers": "customers", "Invoices": "invoices", "Invoice Items": "invoice_items"}
+
+    def __init__(self, parent_app):
+        super().__init__(parent_app.root)
+        self.parent_app = parent_app
+        self.job = None
+
+        self.title("Export to CSV")
+        self.transient(parent_app.root)
+        self.protocol("WM_DELETE_WINDOW", self.cancel)
+
+        frame = ttk.Frame(self, padding="20")
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        ttk.Label(frame, text="Export:").grid(row=0, column=0, sticky="w", pady=2)
+        self.ledger_var = tk.StringVar(value="Customers")
+        ledger_menu = ttk.Combobox(frame, textvariable=self.ledger_var, values=list(self.LEDGERS), state="readonly")
+        ledger_menu.grid(row=0, column=1, sticky="we", pady=2)
+        ledger_menu.bind("<<ComboboxSelected>>", self.update_filters)
+
+        ttk.Label(frame, text="Invoice Date From:").grid(row=1, column=0, sticky="w", pady=2)
+        self.date_from_entry = ttk.Entry(frame)
+        self.date_from_entry.grid(row=1, column=1, sticky="we", pady=2)
+        ttk.Label(frame, text="Invoice Date To:").grid(row=2, column=0, sticky="w", pady=2)
+        self.date_to_entry = ttk.Entry(frame)
+        self.date_to_entry.grid(row=2, column=1, sticky="we", pady=2)
+
+        ttk.Label(frame, text="Status:").grid(row=3, column=0, sticky="w", pady=2)
+        self.status_var = tk.StringVar()
+        # Walks the status index rather than the invoices themselves
+        statuses = [row[0] for row in parent_app.conn.execute("SELECT DISTINCT status FROM invoices ORDER BY status")]
+        self.status_menu = ttk.Combobox(frame, textvariable=self.status_var, values=["Any"] + statuses)
+        self.status_menu.set("Any")
+        self.status_menu.grid(row=3, column=1, sticky="we", pady=2)
+
+        self.progress = ttk.Progressbar(frame, mode="determinate")
+        self.progress.grid(row=4, column=0, columnspan=2, sticky="we", pady=(10, 2))
+        self.progress_label = ttk.Label(frame, text="")
+        self.progress_label.grid(row=5, column=0, columnspan=2, sticky="w")
+
+        button_frame = ttk.Frame(frame)
+        button_frame.grid(row=6, column=0, columnspan=2, pady=(10, 0))
+        self.export_button = ttk.Button(button_frame, text="Export...", command=self.start_export)
+        self.export_button.pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Cancel", command=self.cancel).pack(side=tk.LEFT, padx=5)
+
+        self.update_filters()
+
+    def update_filters(self, event=None):
+        """Enable the date and status filters only for the invoice ledgers."""
+        state = "disabled" if self.ledger_var.get() == "Customers" else "normal"
+        self.date_from_entry.config(state=state)
+        self.date_to_entry.config(state=state)
+        self.status_menu.config(state=state)
+
+    def start_export(self):
+        from tkinter import filedialog
+        import exporter
+
+        ledger = self.LEDGERS[self.ledger_var.get()]
+        date_from = self.date_from_entry.get().strip() or None
+        date_to = self.date_to_entry.get().strip() or None
+        status = self.status_var.get().strip()
+        status = None if status in ("", "Any") else status
+        try:
+            exporter.export_query(ledger, date_from, date_to, status)
+        except ValueError:
+            messagebox.showerror("Error", "Dates must be in YYYY-MM-DD format.", parent=self)
+            return
+
+        # Open a "save as" dialog
+        file_path = filedialog.asksaveasfilename(
+            parent=self,
+            defaultextension=".csv",
+            initialfile=f"{ledger}.csv",
+            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
+            title=f"Export {self.ledger_var.get()} to CSV"
+        )
+        if not file_path:
+            return # User cancelled the dialog
+
+        def export(conn, job):
+            return exporter.export_csv(conn, ledger, file_path, date_from, date_to, status,
+                                       progress=job.progress, cancelled=lambda: job.cancelled)
+
+        self.export_button.config(state="disabled")
+        self.progress_label.config(text="Counting rows...")
+        self.job = self.parent_app.executor.submit(
+            export, long=True,
+            on_done=lambda count: self._on_exported(count, file_path),
+            on_error=self._on_export_failed,
+            on_progress=self._on_progress)
+
+    def _on_progress(self, done, total, message):
+        self.progress.config(maximum=max(total or 0, 1), value=done)
+        self.progress_label.config(text=f"{done} of {total} rows written")
+
+    def _on_exported(self, count, file_path):
+        self.job = None
+        self.parent_app.show_status(f"Successfully exported {count} rows to {file_path}")
+        self.destroy()
+
+    def _on_export_failed(self, error):
+        self.job = None
+        self.export_button.config(state="normal")
+        self.progress_label.config(text="")
+        messagebox.showerror("Export Error", f"Failed to export data: {error}", parent=self)
+
+    def cancel(self):
+        """Stop a running export (its partial file is removed) and close the window."""
+        if self.job is not None:
+            self.job.cancel()
+            self.parent_app.show_status("Export cancelled.")
+        self.destroy()
+
+class ReportsWindow(tk.Toplevel):
+    """A Toplevel window with receivables aging, revenue by month and top customers."""
+    TOP_BY = {"Invoiced": "invoiced", "Outstanding": "outstanding"}
+
+    def __init__(self, parent_app):
+        super().__init__(parent_app.root)
+        self.parent_app = parent_app
+        self._channel = f"reports-{self}"
+
+        self.title("Reports")
+        self.geometry("700x450")
+
+        frame = ttk.Frame(self, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        # --- Controls ---
+        controls = ttk.Frame(frame)
+        controls.pack(fill=tk.X, pady=(0, 10))
+        today = date.today()
+        ttk.Label(controls, text="Revenue from (YYYY-MM):").pack(side=tk.LEFT)
+        self.month_from_entry = ttk.Entry(controls, width=8)
+        self.month_from_entry.insert(0, f"{today.year - 1}-{today.month:02d}")
+        self.month_from_entry.pack(side=tk.LEFT, padx=5)
+        ttk.Label(controls, text="to:").pack(side=tk.LEFT)
+        self.month_to_entry = ttk.Entry(controls, width=8)
+        self.month_to_entry.insert(0, f"{today.year}-{today.month:02d}")
+        self.month_to_entry.pack(side=tk.LEFT, padx=5)
+        ttk.Label(controls, text="Top customers by:").pack(side=tk.LEFT, padx=(20, 5))
+        self.top_by_var = tk.StringVar(value="Invoiced")
+        top_by_menu = ttk.Combobox(controls, textvariable=self.top_by_var, values=list(self.TOP_BY),
+                                   state="readonly", width=12)
+        top_by_menu.pack(side=tk.LEFT)
+        top_by_menu.bind("<<ComboboxSelected>>", self.refresh)
+        self.month_from_entry.bind("<Return>", self.refresh)
+        self.month_to_entry.bind("<Return>", self.refresh)
+        ttk.Button(controls, text="Refresh", command=self.refresh).pack(side=tk.RIGHT)
+
+        # --- Reports ---
+        notebook = ttk.Notebook(frame)
+        notebook.pack(fill=tk.BOTH, expand=True)
+        self.aging_tree = self._create_tree(notebook, {
+            "bucket": ("Overdue", 150), "count": ("Invoices", 80), "amount": ("Amount", 120)})
+        notebook.add(self.aging_tree.master, text="Receivables Aging")
+        self.revenue_tree = self._create_tree(notebook, {
+            "month": ("Month", 90), "count": ("Invoices", 80), "net": ("Net", 120), "tax": ("Tax", 100),
+            "total": ("Total", 120)})
+        notebook.add(self.revenue_tree.master, text="Revenue by Month")
+        self.top_tree = self._create_tree(notebook, {
+            "customer": ("Customer", 220), "count": ("Invoices", 80), "invoiced": ("Invoiced", 120),
+            "outstanding": ("Outstanding", 120)})
+        notebook.add(self.top_tree.master, text="Top Customers")
+
+        self.refresh()
+        # Keep up with invoices saved by other instances
+        parent_app.add_change_listener(self.refresh)
+
+    def _create_tree(self, parent, headings):
+        tree_frame = ttk.Frame(parent)
+        tree = ttk.Treeview(tree_frame, columns=list(headings), show="headings")
+        for index, (col, (text, width)) in enumerate(headings.items()):
+            tree.heading(col, text=text)
+            tree.column(col, width=width, anchor="w" if index == 0 else "e")
+        scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        tree.pack(fill=tk.BOTH, expand=True)
+        return tree
+
+    def refresh(self, event=None):
+        """Re-read all three reports; each reads only the small summary tables."""
+        month_from = self.month_from_entry.get().strip() or None
+        month_to = self.month_to_entry.get().strip() or None
+        top_by = self.TOP_BY[self.top_by_var.get()]
+
+        def read_reports(conn, job):
+            return (reports.aging(conn), reports.revenue_by_month(conn, month_from, month_to),
+                    reports.top_customers(conn, by=top_by))
+
+        self.parent_app.executor.submit(read_reports, channel=self._channel, on_done=self._show,
+                                        on_error=self._on_failed)
+
+    def _show(self, results):
+        if not self.winfo_exists():
+            return
+        aging, revenue, top = results
+        for tree in (self.aging_tree, self.revenue_tree, self.top_tree):
+            tree.delete(*tree.get_children())
+        for label, count, amount in aging:
+            self.aging_tree.insert("", tk.END, values=(label, count, f"{amount:,.2f}"))
+        for month, count, net, tax, total in revenue:
+            self.revenue_tree.insert("", tk.END, values=(month, count, f"{net:,.2f}", f"{tax:,.2f}", f"{total:,.2f}"))
+        for customer_id, name, count, invoiced, outstanding in top:
+            self.top_tree.insert("", tk.END, values=(name or f"(deleted customer {customer_id})", count,
+                                                     f"{invoiced:,.2f}", f"{outstanding:,.2f}"))
+
+    def _on_failed(self, error):
+        if self.winfo_exists():
+            messagebox.showerror("Database Error", f"Failed to load the reports: {error}", parent=self)
+
+    def destroy(self):
+        self.parent_app.remove_change_listener(self.refresh)
+        self.parent_app.executor.cancel(self._channel)
+        super().destroy()
+
+class DiagnosticsWindow(tk.Toplevel):
+    """A Toplevel window showing live per-statement timings and the slow-query log."""
+    REFRESH_MS = 1000
+
+    def __init__(self, parent_app):
+        super().__init__(parent_app.root)
+        self.parent_app = parent_app
+        self.stats = parent_app.query_stats
+        self._version = None
+        self._statements = {}
+        self._statement_ids = {}
+        self._slow_queries = {}
+
+        self.title("Query Diagnostics")
+        self.geometry("900x600")
+
+        frame = ttk.Frame(self, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        # --- Controls ---
+        controls = ttk.Frame(frame)
+        controls.pack(fill=tk.X, pady=(0, 10))
+        self.recording_var = tk.BooleanVar(value=self.stats.enabled)
+        ttk.Checkbutton(controls, text="Record queries", variable=self.recording_var,
+                        command=self.toggle_recording).pack(side=tk.LEFT)
+        ttk.Label(controls, text="Log queries slower than (ms):").pack(side=tk.LEFT, padx=(20, 5))
+        self.threshold_entry = ttk.Entry(controls, width=8)
+        self.threshold_entry.insert(0, f"{self.stats.slow_ms:g}")
+        self.threshold_entry.pack(side=tk.LEFT)
+        self.threshold_entry.bind("<Return>", self.save_threshold)
+        ttk.Button(controls, text="Set", command=self.save_threshold).pack(side=tk.LEFT, padx=5)
+        ttk.Button(controls, text="Reset", command=self.reset).pack(side=tk.RIGHT)
+
+        # --- Statements and Slow Queries ---
+        notebook = ttk.Notebook(frame)
+        notebook.pack(fill=tk.BOTH, expand=True)
+
+        columns = ("calls", "statements", "total", "mean", "p95", "max", "sql")
+        self.statement_tree = self._create_tree(notebook, columns, {
+            "calls": ("Calls", 60), "statements": ("SQLite Stmts", 90), "total": ("Total ms", 80),
+            "mean": ("Mean ms", 70), "p95": ("p95 ms \u2264", 70), "max": ("Max ms", 70), "sql": ("Statement", 400)})
+        notebook.add(self.statement_tree.master, text="Statements")
+
+        columns = ("when", "elapsed", "thread", "warnings", "sql")
+        self.slow_tree = self._create_tree(notebook, columns, {
+            "when": ("Time", 80), "elapsed": ("ms", 70), "thread": ("Thread", 90),
+            "warnings": ("Plan Warnings", 200), "sql": ("Statement", 400)})
+        notebook.add(self.slow_tree.master, text="Slow Queries")
+
+        # --- Details of the selected row ---
+        self.details = tk.Text(frame, height=10, wrap="word")
+        self.details.pack(fill=tk.X, pady=(10, 0))
+        self.details.config(state="disabled")
+
+        self._refresh()
+
+    def _create_tree(self, parent, columns, headings):
+        tree_frame = ttk.Frame(parent)
+        tree = ttk.Treeview(tree_frame, columns=columns, show="headings")
+        for col in columns:
+            text, width = headings[col]
+            tree.heading(col, text=text)
+            tree.column(col, width=width, stretch=col == "sql", anchor="w" if col in ("sql", "warnings", "thread") else "e")
+        scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        tree.pack(fill=tk.BOTH, expand=True)
+        tree.bind("<<TreeviewSelect>>", self.show_details)
+        return tree
+
+    def toggle_recording(self):
+        self.stats.enabled = self.recording_var.get()
+        self.parent_app.show_status("Recording queries." if self.stats.enabled else "Stopped recording queries.")
+
+    def save_threshold(self, event=None):
+        try:
+            slow_ms = float(self.threshold_entry.get())
+            if slow_ms < 0:
+                raise ValueError
+            self.parent_app.settings.set("slow_query_ms", slow_ms)
+            self.stats.slow_ms = slow_ms
+            self.parent_app.show_status(f"Logging queries slower than {slow_ms:g} ms.")
+        except ValueError:
+            messagebox.showerror("Error", "Invalid threshold. Please enter a number of milliseconds.", parent=self)
+        except sqlite3.Error as e:
+            messagebox.showerror("Database Error", f"Failed to save the threshold: {e}", parent=self)
+
+    def reset(self):
+        self.stats.reset()
+        self._statement_ids.clear()
+        self._set_details("")
+
+    def _refresh(self):
+        """Redraw both lists if anything was recorded since the last refresh."""
+        if self.stats.version != self._version:
+            self._version = self.stats.version
+            self._fill_statements()
+            self._fill_slow_queries()
+        self._refresh_timer = self.after(self.REFRESH_MS, self._refresh)
+
+    def _fill_statements(self):
+        selected = self.statement_tree.selection()
+        self.statement_tree.delete(*self.statement_tree.get_children())
+        self._statements = {}
+        for stats in self.stats.statements():
+            # The same statement keeps its row id, so it stays selected across refreshes
+            iid = self._statement_ids.setdefault(stats.sql, str(len(self._statement_ids)))
+            self._statements[iid] = stats
+            self.statement_tree.insert("", tk.END, iid=iid, values=(
+                stats.calls, stats.statements, f"{stats.total_ms:.1f}", f"{stats.mean_ms:.2f}",
+                f"{stats.percentile_ms(95):.2f}", f"{stats.max_ms:.2f}", stats.sql))
+        self.statement_tree.selection_set([iid for iid in selected if iid in self._statements])
+
+    def _fill_slow_queries(self):
+        selected = self.slow_tree.selection()
+        self.slow_tree.delete(*self.slow_tree.get_children())
+        self._slow_queries = {}
+        for query in list(self.stats.slow_queries):
+            iid = str(id(query))
+            self._slow_queries[iid] = query
+            self.slow_tree.insert("", tk.END, iid=iid, values=(
+                query.when.strftime("%H:%M:%S"), f"{query.elapsed_ms:.1f}", query.thread,
+                "; ".join(query.warnings), query.sql))
+        self.slow_tree.selection_set([iid for iid in selected if iid in self._slow_queries])
+
+    def show_details(self, event):
+        tree = event.widget
+        selection = tree.selection()
+        if not selection:
+            return
+        if tree is self.statement_tree:
+            stats = self._statements.get(selection[0])
+            if stats is None:
+                return
+            bounds = [f"\u2264 {bound} ms" for bound in HISTOGRAM_MS] + [f"> {HISTOGRAM_MS[-1]} ms"]
+            histogram = "\n".join(f"  {bound:>10}: {count}" for bound, count in zip(bounds, stats.histogram))
+            self._set_details(f"{stats.sql}\n\nLatency histogram ({stats.calls} calls, "
+                              f"{stats.statements} SQLite statements):\n{histogram}")
+        else:
+            query = self._slow_queries.get(selection[0])
+            if query is None:
+                return
+            plan = "\n".join(f"  {step}" for step in query.plan) or "  (none)"
+            self._set_details(f"{query.sql}\n\nTook {query.elapsed_ms:.1f} ms at {query.when:%Y-%m-%d %H:%M:%S} "
+                              f"on {query.thread} ({query.statements} SQLite statements)\n"
+                              f"Parameters: {query.parameters!r}\n"
+                              f"As run: {query.expanded}\n\nQuery plan:\n{plan}")
+
+    def _set_details(self, text):
+        self.details.config(state="normal")
+        self.details.delete("1.0", tk.END)
+        self.details.insert("1.0", text)
+        self.details.config(state="disabled")
+
+    def destroy(self):
+        self.after_cancel(self._refresh_timer)
+        super().destroy()
+
 class InvoiceWindow(tk.Toplevel):
     """A Toplevel window for creating and editing an invoice."""
-    def __init__(self, parent_app, invoice_id=None):
+    def __init__(self, parent_app, invoice_id=None, invoice_row=None):
         super().__init__(parent_app.root)
         self.parent_app = parent_app
         self.invoice_id = invoice_id
+        # The invoice as the list shows it, so the list can move it after saving
+        self.invoice_row = invoice_row
 
-        self.title("Create New Invoice" if not invoice_id else f"Edit Invoice #{invoice_id}")
+        # Archived invoices (see archive.py) are shown read-only
+        self.archived = bool(invoice_row and invoice_row[7])
+        if self.archived:
+            self.title(f"Invoice #{invoice_id} (archived)")
+        else:
+            self.title("Create New Invoice" if not invoice_id else f"Edit Invoice #{invoice_id}")
         self.transient(parent_app.root)
         self.grab_set()
 
@@ -660,10 +1495,10 @@ class InvoiceWindow(tk.Toplevel):
 
         # Customer
         ttk.Label(info_frame, text="Customer:").grid(row=0, column=0, sticky="w", pady=2)
-        self.customer_var = tk.StringVar()
-        self.customer_menu = ttk.Combobox(info_frame, textvariable=self.customer_var, state="readonly")
-        self.customer_menu.grid(row=0, column=1, sticky="we", pady=2)
-        self.customers = self.load_customer_list()
+        # Type a name, email or phone number (or an id) and pick from the matches
+        self.customer_picker = CustomerPicker(info_frame, parent_app.executor, parent_app.fts_enabled, width=40)
+        self.customer_picker.grid(row=0, column=1, sticky="we", pady=2)
+        self.customer_picker.focus_set()
 
         # Invoice Date
         ttk.Label(info_frame, text="Invoice Date:").grid(row=1, column=0, sticky="w", pady=2)
@@ -688,6 +1523,10 @@ class InvoiceWindow(tk.Toplevel):
         self.items_tree.heading('unit_price', text='Unit Price')
         self.items_tree.heading('total', text='Total')
         self.items_tree.pack(fill=tk.BOTH, expand=True)
+        # Treeview item -> (item id or None, description, quantity, unit_price)
+        self.lines = {}
+        # Item id -> (description, quantity, unit_price) as loaded, to save only the differences
+        self.loaded_items = {}
 
         # --- Totals Frame ---
         totals_frame = ttk.Frame(main_frame, padding="10")
@@ -708,36 +1547,59 @@ class InvoiceWindow(tk.Toplevel):
         # --- Action Buttons ---
         action_frame = ttk.Frame(main_frame, padding="10")
         action_frame.pack(fill=tk.X)
-        ttk.Button(action_frame, text="Add Item", command=self.add_item).pack(side=tk.LEFT, padx=5)
-        ttk.Button(action_frame, text="Remove Item", command=self.remove_item).pack(side=tk.LEFT, padx=5)
-        ttk.Button(action_frame, text="Save Invoice", command=self.save_invoice).pack(side=tk.RIGHT, padx=5)
+        add_button = ttk.Button(action_frame, text="Add Item", command=self.add_item)
+        add_button.pack(side=tk.LEFT, padx=5)
+        remove_button = ttk.Button(action_frame, text="Remove Item", command=self.remove_item)
+        remove_button.pack(side=tk.LEFT, padx=5)
+        self.save_button = ttk.Button(action_frame, text="Save Invoice", command=self.save_invoice)
+        self.save_button.pack(side=tk.RIGHT, padx=5)
+        if self.archived:
+            for button in (add_button, remove_button, self.save_button):
+                button.config(state=tk.DISABLED)
+
+        # Recalculate if the tax rate is changed while the invoice is open
+        self.parent_app.settings.subscribe(self.on_setting_changed)
 
         if self.invoice_id:
             self.load_invoice_data()
 
-    def load_customer_list(self):
-        self.parent_app.cursor.execute("SELECT id, name FROM customers ORDER BY name")
-        customers = self.parent_app.cursor.fetchall()
-        self.customer_menu['values'] = [f"{name} (ID: {cid})" for cid, name in customers]
-        return {cid: name for cid, name in customers}
+    def destroy(self):
+        self.parent_app.settings.unsubscribe(self.on_setting_changed)
+        super().destroy()
 
-    def load_invoice_data(self):
-        self.parent_app.cursor.execute("SELECT customer_id, invoice_date, due_date FROM invoices WHERE id = ?", (self.invoice_id,))
-        customer_id, invoice_date, due_date = self.parent_app.cursor.fetchone()
+    def on_setting_changed(self, key, value):
+        if key == 'tax_rate':
+            self.update_totals()
 
-        self.customer_var.set(f"{self.customers[customer_id]} (ID: {customer_id})")
+    def load_invoice_data(self):
+        schema_name = archive.SCHEMA if self.archived else "main"
+        self.parent_app.cursor.execute(
+            "SELECT i.customer_id, c.name, c.email, i.invoice_date, i.due_date "
+            f"FROM {schema_name}.invoices i LEFT JOIN customers c ON c.id = i.customer_id WHERE i.id = ?",
+            (self.invoice_id,))
+        customer_id, name, email, invoice_date, due_date = self.parent_app.cursor.fetchone()
+
+        self.customer_picker.set_customer(customer_id, name if name is not None else f"Customer #{customer_id}", email)
         self.invoice_date_entry.delete(0, tk.END)
         self.invoice_date_entry.insert(0, invoice_date)
         self.due_date_entry.delete(0, tk.END)
         self.due_date_entry.insert(0, due_date)
 
-        self.parent_app.cursor.execute("SELECT description, quantity, unit_price FROM invoice_items WHERE invoice_id = ?", (self.invoice_id,))
-        for item in self.parent_app.cursor.fetchall():
-            description, quantity, unit_price = item
-            total = quantity * unit_price
-            self.items_tree.insert('', tk.END, values=(description, quantity, unit_price, f"{total:.2f}"))
+        self.parent_app.cursor.execute(
+            f"SELECT id, description, quantity, unit_price FROM {schema_name}.invoice_items "
+            "WHERE invoice_id = ? ORDER BY id",
+            (self.invoice_id,))
+        for item_id, description, quantity, unit_price in self.parent_app.cursor.fetchall():
+            self.loaded_items[item_id] = (description, quantity, unit_price)
+            self.add_line(description, quantity, unit_price, item_id)
         self.update_totals()
 
+    def add_line(self, description, quantity, unit_price, item_id=None):
+        """Show an item line; `item_id` is set for lines loaded from the database."""
+        total = quantity * unit_price
+        line = self.items_tree.insert('', tk.END, values=(description, quantity, unit_price, f"{total:.2f}"))
+        self.lines[line] = (item_id, description, quantity, unit_price)
+
     def add_item(self):
         AddItemWindow(self)
 
@@ -747,81 +1609,54 @@ class InvoiceWindow(tk.Toplevel):
             messagebox.showerror("Error", "Please select an item to remove.", parent=self)
             return
         self.items_tree.delete(selected_item)
+        del self.lines[selected_item]
         self.update_totals()
 
     def update_totals(self):
-        subtotal = 0
-        for item_id in self.items_tree.get_children():
-            item = self.items_tree.item(item_id, 'values')
-            subtotal += float(item[3])
-
-        self.parent_app.cursor.execute("SELECT value FROM settings WHERE key = 'tax_rate'")
-        tax_rate = float(self.parent_app.cursor.fetchone()[0])
-        
-        tax = subtotal * tax_rate
-        total = subtotal + tax
+        tax_rate = self.parent_app.settings['tax_rate']
+        subtotal, tax, total = ledger.calculate_totals(self.lines.values(), tax_rate)
 
         self.subtotal_label.config(text=f"{subtotal:.2f}")
         self.tax_label.config(text=f"{tax:.2f}")
         self.total_label.config(text=f"{total:.2f}")
 
     def save_invoice(self):
-        customer_str = self.customer_var.get()
-        if not customer_str:
-            messagebox.showerror("Error", "Please select a customer.", parent=self)
+        customer_id = self.customer_picker.customer_id
+        if customer_id is None:
+            messagebox.showerror("Error", "Please choose a customer from the list of matches.", parent=self)
             return
-        
-        customer_id = int(customer_str.split("(ID: ")[1][:-1])
+
         invoice_date = self.invoice_date_entry.get()
         due_date = self.due_date_entry.get()
         
-        items = []
-        for item_id in self.items_tree.get_children():
-            items.append(self.items_tree.item(item_id, 'values'))
+        items = [self.lines[line] for line in self.items_tree.get_children()]
 
         if not items:
             messagebox.showerror("Error", "Please add at least one item to the invoice.", parent=self)
             return
 
-        subtotal = sum(float(item[3]) for item in items)
-        
-        self.parent_app.cursor.execute("SELECT value FROM settings WHERE key = 'tax_rate'")
-        tax_rate = float(self.parent_app.cursor.fetchone()[0])
-        tax_amount = subtotal * tax_rate
-        total_amount = subtotal + tax_amount
-
-        try:
-            if self.invoice_id:
-                # Update existing invoice
-                self.parent_app.cursor.execute("""
-                    UPDATE invoices 
-                    SET customer_id = ?, invoice_date = ?, due_date = ?, total_amount = ?, tax_amount = ?, status = ?
-                    WHERE id = ?
-                """, (customer_id, invoice_date, due_date, total_amount, tax_amount, "Draft", self.invoice_id))
-                self.parent_app.cursor.execute("DELETE FROM invoice_items WHERE invoice_id = ?", (self.invoice_id,))
-                invoice_id = self.invoice_id
-            else:
-                # Insert new invoice
-                self.parent_app.cursor.execute("""
-                    INSERT INTO invoices (customer_id, invoice_date, due_date, total_amount, tax_amount, status)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (customer_id, invoice_date, due_date, total_amount, tax_amount, "Draft"))
-                invoice_id = self.parent_app.cursor.lastrowid
-
-            # Insert invoice items
-            for item in items:
-                description, quantity, unit_price, _ = item
-                self.parent_app.cursor.execute("""
-                    INSERT INTO invoice_items (invoice_id, description, quantity, unit_price)
-                    VALUES (?, ?, ?, ?)
-                """, (invoice_id, description, quantity, unit_price))
-
-            self.parent_app.conn.commit()
-            self.parent_app.load_invoices()
-            self.parent_app.show_status("Invoice saved successfully.")
+        # Write on a worker thread; the button stays disabled until it finishes
+        self.save_button.config(state=tk.DISABLED)
+        # Save with the rate the totals were shown with
+        tax_rate = self.parent_app.settings['tax_rate']
+        def save(conn, job):
+            # Only lines added, changed or removed since loading are written
+            return ledger.save_invoice(conn, self.invoice_id, customer_id, invoice_date, due_date, items,
+                                       tax_rate=tax_rate, loaded_items=self.loaded_items)
+
+        self.parent_app.executor.submit(save, on_done=self._on_saved, on_error=self._on_save_failed)
+
+    def _on_saved(self, invoice_id):
+        self.parent_app.note_own_write()
+        self.parent_app.invoice_view.apply_change(invoice_id, old_row=self.invoice_row)
+        self.parent_app.show_status("Invoice saved successfully.")
+        if self.winfo_exists():
             self.destroy()
-        except sqlite3.Error as e:
-            messagebox.showerror("Database Error", f"Failed to save invoice: {e}", parent=self)
+
+    def _on_save_failed(self, error):
+        if self.winfo_exists():
+            self.save_button.config(state=tk.NORMAL)
+        messagebox.showerror("Database Error", f"Failed to save invoice: {error}", parent=self if self.winfo_exists() else None)
 
 class AddItemWindow(tk.Toplevel):
     """A Toplevel window for adding a new item to an invoice."""
@@ -871,8 +1706,7 @@ class AddItemWindow(tk.Toplevel):
             messagebox.showerror("Error", "Quantity and Unit Price must be numbers!", parent=self)
             return
 
-        total = quantity * unit_price
-        self.parent_window.items_tree.insert('', tk.END, values=(description, quantity, unit_price, f"{total:.2f}"))
+        self.parent_window.add_line(description, quantity, unit_price)
         self.parent_window.update_totals()
         self.destroy()
 
@@ -883,14 +1717,7 @@ if __name__ == "__main__":
 
     app = BookkeepingApp(root)
 
-    # Set the application icon (ensure icon.png is in the project directory)
-    try:
-        icon_image = Image.open("icon.png")
-        photo_image = ImageTk.PhotoImage(icon_image)
-        root.iconphoto(False, photo_image)
-    except FileNotFoundError:
-        print("Warning: icon.png not found. Skipping icon setup.")
-
-    # Make the window visible now that it's fully configured
+    # Make the window visible now that it's fully configured; the icon
+    # (icon.png in the working directory) and theme follow its first paint
     root.deiconify()
     root.mainloop()
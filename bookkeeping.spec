@@ -1,16 +1,27 @@
 # -*- mode: python ; coding: utf-8 -*-
+# Builds a one-folder app: a one-file build unpacks the whole bundle to a
+# temporary directory on every launch, which dominated its startup time.
+from PyInstaller.utils.hooks import collect_data_files
 
+# Modules the app never imports, pulled in by build tooling or other packages' optional imports
+EXCLUDES = [
+    'setuptools', 'pkg_resources', '_distutils_hack', 'packaging',
+    'unittest', 'pydoc', 'pydoc_data', 'xmlrpc', 'email', 'http', 'xml', 'html', 'tomllib',
+    'asyncio', 'multiprocessing', 'concurrent',
+    'PIL',  # The icon is loaded by Tk itself
+]
 
 a = Analysis(
     ['bookkeeping.py'],
     pathex=[],
     binaries=[],
-    datas=[],
+    # sv-ttk's theme is Tcl and images loaded at run time
+    datas=collect_data_files('sv_ttk'),
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=EXCLUDES,
     noarchive=False,
     optimize=0,
 )
@@ -19,16 +30,14 @@ pyz = PYZ(a.pure)
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.datas,
     [],
+    exclude_binaries=True,
     name='bookkeeping',
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
+    # Decompressing UPX-packed libraries costs more at startup than it saves on disk
+    upx=False,
     console=True,
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -36,3 +45,12 @@ exe = EXE(
     codesign_identity=None,
     entitlements_file=None,
 )
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='bookkeeping',
+)
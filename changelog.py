@@ -0,0 +1,189 @@
+"""Change log of customers, invoices and invoice items, for incremental exports.
+
+Triggers on the three tables append an entry to `change_log` for every
+row inserted, updated or deleted:
+
+    seq         increasing sequence number, never reused
+    table_name  customers, invoices or invoice_items
+    row_id      the row's id
+    op          insert, update or delete
+
+A consumer such as the nightly warehouse sync keeps a named checkpoint
+per ledger in `change_checkpoints`: the last seq it has exported.
+exporter.export_changes writes only the rows changed after it, read by
+seq range and then by primary key, so a sync costs as much as the day's
+changes rather than the whole ledger. A checkpoint without a completed
+export yet gets a full export first; it is recorded before that export
+starts, so compaction can't remove entries the export will need.
+
+`compact` removes the entries every checkpoint has passed and all but
+the newest entry per row, since an export only needs to know that a row
+changed. Moving invoices to the archive is not logged: they still exist.
+
+    python changelog.py status
+    python changelog.py compact
+    python changelog.py forget --checkpoint warehouse
+"""
+import argparse
+
+import schema
+from transactions import write_transaction
+
+TABLES = ("customers", "invoices", "invoice_items")
+OPERATIONS = (("insert", "INSERT", "new"), ("update", "UPDATE", "new"), ("delete", "DELETE", "old"))
+
+
+def create_tables(conn):
+    # AUTOINCREMENT: a seq is never handed out twice, even after compaction empties the log
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            op TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS change_checkpoints (
+            name TEXT NOT NULL,
+            ledger TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            complete INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (name, ledger)
+        )
+    """)
+
+
+def _trigger_name(table, op):
+    return f"{table}_change_{op}"
+
+
+def create_triggers(conn, tables=TABLES):
+    """Create the triggers that log changes to `tables`."""
+    for table in tables:
+        for op, event, row in OPERATIONS:
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {_trigger_name(table, op)} AFTER {event} ON {table} BEGIN
+                    INSERT INTO change_log (table_name, row_id, op) VALUES ('{table}', {row}.id, '{op}');
+                END
+            """)
+
+
+def drop_triggers(conn, tables=TABLES):
+    for table in tables:
+        for op, _, _ in OPERATIONS:
+            conn.execute(f"DROP TRIGGER IF EXISTS {_trigger_name(table, op)}")
+
+
+def has_change_log(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'change_log'").fetchone() is not None
+
+
+def log_inserted(conn, table, after_id, extra_ids=()):
+    """Log rows inserted while the triggers were suspended: every id above `after_id` and any listed ids."""
+    conn.execute(f"INSERT INTO change_log (table_name, row_id, op) SELECT ?, id, 'insert' FROM {table} "
+                 f"WHERE id > ? ORDER BY id", (table, after_id))
+    conn.executemany("INSERT INTO change_log (table_name, row_id, op) VALUES (?, ?, 'insert')",
+                     [(table, row_id) for row_id in sorted(extra_ids)])
+
+
+# The last seq handed out; unlike MAX(seq) it survives compaction emptying the log
+_LAST_SEQ = "SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'change_log'), 0)"
+
+
+def last_seq(conn):
+    return conn.execute(_LAST_SEQ).fetchone()[0]
+
+
+def checkpoint(conn, name, ledger):
+    """The seq a consumer has exported a ledger up to, or None if it has no completed export."""
+    row = conn.execute("SELECT seq FROM change_checkpoints WHERE name = ? AND ledger = ? AND complete",
+                       (name, ledger)).fetchone()
+    return row[0] if row else None
+
+
+def hold_checkpoint(conn, name, ledger):
+    """Before a full export: keep the log from now on until `set_checkpoint` records where it got to."""
+    with write_transaction(conn):
+        conn.execute(f"""
+            INSERT INTO change_checkpoints (name, ledger, seq, complete, updated_at)
+            VALUES (?, ?, ({_LAST_SEQ}), 0, datetime('now'))
+            ON CONFLICT (name, ledger) DO UPDATE
+            SET seq = excluded.seq, complete = 0, updated_at = excluded.updated_at
+        """, (name, ledger))
+
+
+def set_checkpoint(conn, name, ledger, seq):
+    """Record that a consumer has exported a ledger's changes up to `seq`."""
+    with write_transaction(conn):
+        conn.execute("""
+            INSERT INTO change_checkpoints (name, ledger, seq, complete, updated_at)
+            VALUES (?, ?, ?, 1, datetime('now'))
+            ON CONFLICT (name, ledger) DO UPDATE
+            SET seq = excluded.seq, complete = 1, updated_at = excluded.updated_at
+        """, (name, ledger, seq))
+
+
+def remove_checkpoint(conn, name, ledger=None):
+    """Forget a consumer (or one of its ledgers), letting compaction drop the entries it held."""
+    with write_transaction(conn):
+        if ledger is None:
+            conn.execute("DELETE FROM change_checkpoints WHERE name = ?", (name,))
+        else:
+            conn.execute("DELETE FROM change_checkpoints WHERE name = ? AND ledger = ?", (name, ledger))
+
+
+def compact(conn):
+    """Shrink the log without losing anything a checkpoint still needs; returns the entries removed.
+
+    Per table, entries up to the oldest checkpoint go (all of them if no
+    checkpoint follows the table), and of the rest only the newest entry
+    per row is kept.
+    """
+    removed = 0
+    with write_transaction(conn):
+        for table in TABLES:
+            oldest = conn.execute("SELECT MIN(seq) FROM change_checkpoints WHERE ledger = ?", (table,)).fetchone()[0]
+            if oldest is None:
+                removed += conn.execute("DELETE FROM change_log WHERE table_name = ?", (table,)).rowcount
+                continue
+            removed += conn.execute("DELETE FROM change_log WHERE seq <= ? AND table_name = ?",
+                                    (oldest, table)).rowcount
+            removed += conn.execute("""
+                DELETE FROM change_log WHERE seq > ? AND table_name = ? AND seq NOT IN (
+                    SELECT MAX(seq) FROM change_log WHERE seq > ? AND table_name = ? GROUP BY row_id)
+            """, (oldest, table, oldest, table)).rowcount
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or compact the change log used by incremental exports.")
+    parser.add_argument("command", choices=("status", "compact", "forget"))
+    parser.add_argument("--db", default="mybookkeeping.db")
+    parser.add_argument("--checkpoint", help="the consumer to forget")
+    args = parser.parse_args()
+
+    conn = schema.connect(args.db)
+    schema.migrate(conn)
+    if args.command == "compact":
+        print(f"Removed {compact(conn)} change log entries.")
+    elif args.command == "forget":
+        if not args.checkpoint:
+            parser.error("forget needs --checkpoint")
+        remove_checkpoint(conn, args.checkpoint)
+        print(f"Removed checkpoint {args.checkpoint}.")
+    else:
+        for table, count in conn.execute("SELECT table_name, COUNT(*) FROM change_log GROUP BY table_name"):
+            print(f"{table:<14} {count:>10} entries")
+        print(f"Last seq: {last_seq(conn)}")
+        for name, ledger, seq, complete, updated_at in conn.execute(
+                "SELECT name, ledger, seq, complete, updated_at FROM change_checkpoints ORDER BY name, ledger"):
+            state = "" if complete else " (full export not finished)"
+            print(f"Checkpoint {name} {ledger}: seq {seq} at {updated_at}{state}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""A type-ahead customer picker for Tk windows.
+
+Nothing is loaded up front. As the user types, the best few matches (see
+search.find_customers) are read on a QueryExecutor and listed under the
+entry; picking one sets `customer_id`. Opening a window with a picker
+therefore takes the same time however many customers there are.
+"""
+import tkinter as tk
+from tkinter import ttk
+
+from search import MATCH_LIMIT, find_customers
+
+# Wait this long after the last keystroke before looking up matches
+TYPE_DELAY_MS = 150
+VISIBLE_MATCHES = 8
+
+
+def customer_label(name, email):
+    """How a chosen customer is shown in the entry."""
+    return f"{name} <{email}>" if email else name
+
+
+class CustomerPicker(ttk.Entry):
+    """An Entry that lists matching customers below itself as the user types.
+
+    `customer_id` is the chosen customer's id, or None while the text
+    doesn't name a chosen customer. A `<<CustomerSelected>>` event is
+    generated when one is picked.
+    """
+
+    def __init__(self, master, executor, fts_enabled=True, **kwargs):
+        self.text_var = tk.StringVar()
+        super().__init__(master, textvariable=self.text_var, **kwargs)
+        self.executor = executor
+        self.fts_enabled = fts_enabled
+        self.customer_id = None
+        self._chosen_label = None
+        self._matches = []
+        self._timer = None
+        self._focus_check = None
+        self._channel = f"customer-picker-{self}"
+
+        # The list floats over the rest of the window, just under the entry
+        self.listbox = tk.Listbox(self.winfo_toplevel(), height=VISIBLE_MATCHES, exportselection=False)
+        self.listbox.bind("<ButtonRelease-1>", self._choose_clicked)
+        self.listbox.bind("<Return>", lambda e: self._choose(self.listbox.index(tk.ACTIVE)))
+        self.listbox.bind("<Up>", self._on_list_up)
+        self.listbox.bind("<Escape>", self._on_escape)
+        self.listbox.bind("<FocusOut>", self._on_focus_out)
+
+        self.text_var.trace_add("write", self._on_text_changed)
+        self.bind("<Down>", self._focus_list)
+        self.bind("<Return>", lambda e: self._choose(0) if self._matches else None)
+        self.bind("<Escape>", self._on_escape)
+        self.bind("<FocusOut>", self._on_focus_out)
+
+    def set_customer(self, customer_id, name, email=None):
+        """Show an already chosen customer, e.g. when editing an invoice."""
+        self.customer_id = customer_id
+        self._chosen_label = customer_label(name, email)
+        self.text_var.set(self._chosen_label)
+
+    def destroy(self):
+        for timer in (self._timer, self._focus_check):
+            if timer:
+                self.after_cancel(timer)
+        self.executor.cancel(self._channel)
+        self.listbox.destroy()
+        super().destroy()
+
+    # --- Looking up matches ---
+
+    def _on_text_changed(self, *args):
+        if self.text_var.get() == self._chosen_label:
+            return  # Set by choosing a customer, not typed
+        self.customer_id = None
+        self._chosen_label = None
+        # Restart the timer on every keystroke so a burst of typing runs one query
+        if self._timer:
+            self.after_cancel(self._timer)
+        self._timer = self.after(TYPE_DELAY_MS, self._look_up)
+
+    def _look_up(self):
+        self._timer = None
+        term = self.text_var.get().strip()
+        if not term:
+            self._hide()
+            return
+        fts_enabled = self.fts_enabled
+        # A newer lookup on the channel supersedes one still running
+        self.executor.submit(lambda conn, job: find_customers(conn, term, MATCH_LIMIT, fts_enabled),
+                             channel=self._channel,
+                             on_done=lambda rows: self._show(term, rows))
+
+    def _show(self, term, rows):
+        if not self.winfo_exists() or self.text_var.get().strip() != term:
+            return  # Closed, or the text has changed since
+        self._matches = rows
+        self.listbox.delete(0, tk.END)
+        if not rows:
+            self._hide()
+            return
+        for customer_id, name, email in rows:
+            self.listbox.insert(tk.END, f"{name}  ({email})" if email else name)
+        self.listbox.config(height=min(len(rows), VISIBLE_MATCHES))
+        self.listbox.place(in_=self, x=0, rely=1.0, relwidth=1.0)
+        self.listbox.lift()
+
+    def _hide(self, event=None):
+        self.listbox.place_forget()
+        self._matches = []
+
+    # --- Choosing ---
+
+    def _choose(self, index):
+        if not 0 <= index < len(self._matches):
+            return
+        customer_id, name, email = self._matches[index]
+        self.set_customer(customer_id, name, email)
+        self._hide()
+        self.focus_set()
+        self.icursor(tk.END)
+        self.event_generate("<<CustomerSelected>>")
+
+    def _choose_clicked(self, event):
+        self._choose(self.listbox.nearest(event.y))
+
+    def _focus_list(self, event):
+        if self._matches:
+            self.listbox.focus_set()
+            self.listbox.selection_clear(0, tk.END)
+            self.listbox.selection_set(0)
+            self.listbox.activate(0)
+        return "break"
+
+    def _on_list_up(self, event):
+        if self.listbox.index(tk.ACTIVE) == 0:
+            self.focus_set()
+            return "break"
+
+    def _on_escape(self, event):
+        self._hide()
+        self.focus_set()
+
+    def _on_focus_out(self, event):
+        # Clicking the list moves the focus to it first, so look once the click has landed
+        if self._focus_check is None:
+            self._focus_check = self.after_idle(self._hide_unless_focused)
+
+    def _hide_unless_focused(self):
+        self._focus_check = None
+        try:
+            focused = self.focus_get()
+        except KeyError:
+            focused = None
+        if focused not in (self, self.listbox):
+            self._hide()
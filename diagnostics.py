@@ -0,0 +1,306 @@
+"""Per-statement query timing for finding slow SQL.
+
+Connections opened with `factory=TracedConnection` report each statement
+to the `QueryStats` in their `stats` attribute while it is enabled: how
+often it ran, how long it took from `execute` until its last row was
+read, and a latency histogram. Statements slower than `slow_ms` go to a
+slow-query log with their parameters and `EXPLAIN QUERY PLAN`.
+
+SQLite's trace callback is installed only while recording. It counts the
+statements SQLite actually ran for each call (one per row for
+`executemany`, more when triggers fire) and provides the statement with
+its parameter values filled in. While recording is off, `execute` costs
+one extra Python call and nothing is traced.
+
+Instrumented connections can live on any thread; `QueryStats` is shared
+between them.
+"""
+import itertools
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# Upper bounds (ms) of the latency histogram buckets; a last bucket holds the rest
+HISTOGRAM_MS = (1, 5, 10, 50, 100, 500, 1000)
+SLOW_QUERY_MS = 100.0
+SLOW_LOG_SIZE = 200
+# Only these can be explained; EXPLAIN QUERY PLAN of anything else is empty
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+class StatementStats:
+    """Running totals for one SQL statement."""
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.calls = 0
+        self.statements = 0   # As SQLite counts them (executemany rows, triggers)
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_MS) + 1)
+
+    @property
+    def mean_ms(self):
+        return self.total_ms / self.calls if self.calls else 0.0
+
+    def percentile_ms(self, pct):
+        """Upper bound of the histogram bucket holding the `pct` percentile."""
+        rank = self.calls * pct / 100
+        seen = 0
+        for bound, count in zip(HISTOGRAM_MS, self.histogram):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def copy(self):
+        copy = StatementStats(self.sql)
+        copy.__dict__.update(self.__dict__, histogram=list(self.histogram))
+        return copy
+
+
+class SlowQuery:
+    """A slow-query log entry."""
+
+    def __init__(self, sql, parameters, elapsed_ms, statements, expanded, plan, thread):
+        self.when = datetime.now()
+        self.sql = sql
+        self.parameters = parameters
+        self.elapsed_ms = elapsed_ms
+        self.statements = statements
+        self.expanded = expanded
+        self.plan = plan
+        self.thread = thread
+
+    @property
+    def warnings(self):
+        """Plan steps worth a look: full table scans and sorts without an index."""
+        found = []
+        for detail in (step.strip() for step in self.plan):
+            if detail.startswith("SCAN ") and " USING " not in detail and detail not in found:
+                found.append(detail)
+            elif detail.startswith("USE TEMP B-TREE") and detail not in found:
+                found.append(detail)
+        return found
+
+
+class QueryStats:
+    """Statement statistics and the slow-query log, shared by instrumented connections."""
+
+    def __init__(self, slow_ms=SLOW_QUERY_MS, log_size=SLOW_LOG_SIZE):
+        self.enabled = False
+        self.slow_ms = slow_ms
+        self.slow_queries = deque(maxlen=log_size)
+        # Bumped on every change, so a window can tell when to redraw
+        self.version = 0
+        self._statements = {}
+        self._lock = threading.Lock()
+
+    def record(self, conn, sql, parameters, seconds, statements, expanded):
+        """Add one timed call; `conn` is used to explain it if it was slow."""
+        elapsed_ms = seconds * 1000
+        key = " ".join(sql.split())
+        slow = elapsed_ms >= self.slow_ms
+        plan = conn.explain(sql, parameters) if slow else []
+        with self._lock:
+            stats = self._statements.get(key)
+            if stats is None:
+                stats = self._statements[key] = StatementStats(key)
+            stats.calls += 1
+            stats.statements += statements
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            bucket = 0
+            while bucket < len(HISTOGRAM_MS) and elapsed_ms > HISTOGRAM_MS[bucket]:
+                bucket += 1
+            stats.histogram[bucket] += 1
+            if slow:
+                self.slow_queries.appendleft(SlowQuery(key, parameters, elapsed_ms, statements, expanded, plan,
+                                                       threading.current_thread().name))
+            self.version += 1
+
+    def statements(self):
+        """Copies of the per-statement totals, most total time first."""
+        with self._lock:
+            copies = [stats.copy() for stats in self._statements.values()]
+        return sorted(copies, key=lambda stats: stats.total_ms, reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self.slow_queries.clear()
+            self.version += 1
+
+
+class TracedConnection(sqlite3.Connection):
+    """A connection that times its statements into `self.stats` while it is enabled."""
+
+    stats = None
+    _traced = False
+    _trace_count = 0
+    _trace_first = None
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or TimedCursor)
+
+    def execute(self, sql, parameters=()):
+        if not self._recording():
+            return super().execute(sql, parameters)
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        if not self._recording():
+            return super().executemany(sql, parameters)
+        return self.cursor().executemany(sql, parameters)
+
+    def executescript(self, script):
+        if not self._recording():
+            return super().executescript(script)
+        return self.cursor().executescript(script)
+
+    def commit(self):
+        if not self._recording() or not self.in_transaction:
+            return super().commit()
+        self._start_call()
+        start = time.perf_counter()
+        super().commit()
+        self.stats.record(self, "COMMIT", (), time.perf_counter() - start, *self._end_call())
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # `with conn:` commits in C, bypassing `commit` above
+        if exc_type is not None or not self.in_transaction or not self._recording():
+            return super().__exit__(exc_type, exc_value, traceback)
+        try:
+            self.commit()
+        except BaseException:
+            self.rollback()
+            raise
+        return False
+
+    def explain(self, sql, parameters):
+        """The query plan of `sql` as a list of plan steps (empty if it has none)."""
+        if not sql.lstrip().upper().startswith(EXPLAINABLE):
+            return []
+        try:
+            rows = sqlite3.Connection.execute(self, "EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+        except (sqlite3.Error, ValueError) as e:
+            return [f"(could not explain: {e})"]
+        # Indent by depth, using each step's parent id
+        depth = {0: -1}
+        plan = []
+        for step_id, parent_id, _, detail in rows:
+            depth[step_id] = depth.get(parent_id, -1) + 1
+            plan.append("  " * depth[step_id] + detail)
+        return plan
+
+    def _recording(self):
+        """Whether to time statements, (un)installing the trace callback to match."""
+        recording = self.stats is not None and self.stats.enabled
+        if recording != self._traced:
+            self.set_trace_callback(self._on_trace if recording else None)
+            self._traced = recording
+        return recording
+
+    def _on_trace(self, statement):
+        self._trace_count += 1
+        if self._trace_first is None:
+            self._trace_first = statement
+
+    def _start_call(self):
+        self._trace_count = 0
+        self._trace_first = None
+
+    def _end_call(self):
+        """The number of statements SQLite ran since `_start_call`, and the first with its values."""
+        return self._trace_count, self._trace_first
+
+
+class TimedCursor(sqlite3.Cursor):
+    """A cursor that times each statement from `execute` until its last row is read."""
+
+    _pending = None   # [sql, parameters, seconds, statements, expanded] until the rows run out
+
+    def execute(self, sql, parameters=()):
+        return self._timed(super().execute, sql, parameters, parameters)
+
+    def executemany(self, sql, parameters):
+        # Log the first row, without reading a generator into memory
+        rows = iter(parameters)
+        first = next(rows, None)
+        if first is None:
+            return self._timed(super().executemany, sql, [], ())
+        return self._timed(super().executemany, sql, itertools.chain([first], rows), first)
+
+    def executescript(self, script):
+        return self._timed(lambda sql, parameters: super(TimedCursor, self).executescript(sql), script, (), ())
+
+    def fetchone(self):
+        if self._pending is None:
+            return super().fetchone()
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._pending[2] += time.perf_counter() - start
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        if self._pending is None:
+            return super().fetchmany(size)
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._pending[2] += time.perf_counter() - start
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        if self._pending is None:
+            return super().fetchall()
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._pending[2] += time.perf_counter() - start
+        self._finish()
+        return rows
+
+    def __next__(self):
+        if self._pending is None:
+            return super().__next__()
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._finish()
+            raise
+        self._pending[2] += time.perf_counter() - start
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # A cursor dropped before its last row (e.g. after one fetchone) still counts
+        self._finish()
+
+    def _timed(self, run, sql, parameters, logged_parameters):
+        self._finish()
+        conn = self.connection
+        if not isinstance(conn, TracedConnection) or not conn._recording():
+            return run(sql, parameters)
+        conn._start_call()
+        start = time.perf_counter()
+        run(sql, parameters)
+        self._pending = [sql, logged_parameters, time.perf_counter() - start, *conn._end_call()]
+        if self.description is None:
+            # Nothing to read, so the statement has finished
+            self._finish()
+        return self
+
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        if pending is not None and self.connection.stats is not None:
+            self.connection.stats.record(self.connection, *pending)
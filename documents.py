@@ -0,0 +1,415 @@
+"""Customer-facing invoice documents, as HTML or PDF, rendered in bulk.
+
+A template is HTML with `$field` placeholders and one repeated block for
+the invoice lines, between `<!-- line -->` and `<!-- /line -->`. It is
+compiled once per process into a list of literal text and field names,
+so rendering an invoice is a single join, and compiled templates are
+cached by file and modification time. The built-in template is used
+unless another is given.
+
+Batch rendering, such as every invoice of a billing month, splits the
+invoice ids into chunks and hands them to a process pool. Each worker
+opens its own connection once, reads a whole chunk's invoices, customers
+and lines with one query each, and writes the files itself, so only ids
+and counts cross between processes. Throughput and each worker's peak
+memory are reported at the end.
+
+PDF output draws the same fields with fpdf2, a pure-Python library that
+is only needed for `--pdf` (`pip install fpdf2`).
+
+    python documents.py --month 2024-03 --output invoices/
+    python documents.py --ids 1017 1018 --output . --pdf
+"""
+import argparse
+import html
+import importlib.util
+import multiprocessing
+import os
+import re
+import sqlite3
+import sys
+import time
+from datetime import date
+
+import archive
+import schema
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak memory is then not reported
+    resource = None
+
+# Invoices per task handed to a worker
+CHUNK_INVOICES = 200
+
+DEFAULT_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+  <meta charset="UTF-8" />
+  <title>Invoice $invoice_id</title>
+  <style>
+    body { font-family: 'Segoe UI', sans-serif; margin: 40px; color: #1f2024; }
+    header { display: flex; justify-content: space-between; border-bottom: 2px solid #1f2024; }
+    table { width: 100%; border-collapse: collapse; margin-top: 24px; }
+    th, td { padding: 6px 8px; border-bottom: 1px solid #ddd; text-align: left; }
+    td.number, th.number { text-align: right; }
+    .totals { margin-top: 16px; margin-left: auto; width: 40%; }
+  </style>
+</head>
+<body>
+  <header>
+    <h1>$company</h1>
+    <h2>Invoice #$invoice_id</h2>
+  </header>
+  <p>
+    <strong>$customer_name</strong><br />
+    $customer_email<br />
+    $customer_contact
+  </p>
+  <p>Invoice date: $invoice_date<br />Due date: $due_date<br />Status: $status</p>
+  <table>
+    <tr><th>Description</th><th class="number">Quantity</th><th class="number">Unit price</th>
+        <th class="number">Amount</th></tr>
+    <!-- line -->
+    <tr><td>$description</td><td class="number">$quantity</td><td class="number">$unit_price</td>
+        <td class="number">$line_total</td></tr>
+    <!-- /line -->
+  </table>
+  <table class="totals">
+    <tr><td>Subtotal</td><td class="number">$subtotal</td></tr>
+    <tr><td>Tax</td><td class="number">$tax</td></tr>
+    <tr><th>Total</th><th class="number">$total</th></tr>
+  </table>
+</body>
+</html>
+"""
+
+INVOICE_FIELDS = {"company", "invoice_id", "invoice_date", "due_date", "status", "customer_name", "customer_email",
+                  "customer_contact", "subtotal", "tax", "total", "lines"}
+LINE_FIELDS = {"description", "quantity", "unit_price", "line_total"}
+
+_FIELD = re.compile(r"\$(?:(\w+)|\{(\w+)\}|(\$))")
+_LINE_BLOCK = re.compile(r"<!--\s*line\s*-->(.*?)<!--\s*/line\s*-->", re.S)
+
+
+class CompiledTemplate:
+    """Template text split once into literals and field names; `render` is then one join."""
+
+    def __init__(self, text, fields):
+        # Literals at even positions, field names at odd ones
+        self.parts = []
+        literal = []
+        position = 0
+        for match in _FIELD.finditer(text):
+            literal.append(text[position:match.start()])
+            position = match.end()
+            if match.group(3):
+                literal.append("$")
+                continue
+            name = match.group(1) or match.group(2)
+            if name not in fields:
+                raise ValueError(f"Unknown template field ${name}")
+            self.parts += ["".join(literal), name]
+            literal = []
+        literal.append(text[position:])
+        self.parts.append("".join(literal))
+
+    def render(self, values):
+        """Fill in the fields; `values` must already be escaped for HTML."""
+        parts = self.parts[:]
+        for index in range(1, len(parts), 2):
+            parts[index] = values[parts[index]]
+        return "".join(parts)
+
+
+def compile_template(text):
+    """Compile an invoice template into its (invoice, line) parts."""
+    match = _LINE_BLOCK.search(text)
+    if not match:
+        raise ValueError("The template has no <!-- line --> ... <!-- /line --> block for the invoice lines")
+    invoice = text[:match.start()] + "${lines}" + text[match.end():]
+    return CompiledTemplate(invoice, INVOICE_FIELDS), CompiledTemplate(match.group(1), LINE_FIELDS)
+
+
+# (path, modification time) -> compiled template, per process
+_templates = {}
+
+
+def load_template(path=None):
+    """The compiled template at `path` (None for the built-in one), compiled at most once per version of the file."""
+    key = (path, os.stat(path).st_mtime_ns if path else None)
+    if key not in _templates:
+        if path:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+        else:
+            text = DEFAULT_TEMPLATE
+        _templates[key] = compile_template(text)
+    return _templates[key]
+
+
+# --- Reading ---
+
+def _money(value):
+    return f"{value:,.2f}"
+
+
+def _quantity(value):
+    return f"{value:g}"
+
+
+def read_invoices(conn, invoice_ids):
+    """Invoices with their customer and lines for a batch of ids, in id order, with one query per table.
+
+    Returns (invoice row, [(description, quantity, unit_price)]) pairs;
+    the archive is read too when it is attached.
+    """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS render_ids (id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.render_ids")
+    conn.executemany("INSERT OR IGNORE INTO temp.render_ids (id) VALUES (?)", ((row_id,) for row_id in invoice_ids))
+    schemas = ["main"] + ([archive.SCHEMA] if archive.is_attached(conn) else [])
+    invoices = {}
+    lines = {}
+    for name in schemas:
+        for row in conn.execute(f"""
+                SELECT i.id, i.invoice_date, i.due_date, i.total_amount, i.tax_amount, i.status,
+                       i.customer_id, c.name, c.email, c.contact
+                FROM {name}.invoices i LEFT JOIN customers c ON c.id = i.customer_id
+                WHERE i.id IN (SELECT id FROM temp.render_ids)"""):
+            invoices[row[0]] = row
+        for invoice_id, description, quantity, unit_price in conn.execute(f"""
+                SELECT invoice_id, description, quantity, unit_price FROM {name}.invoice_items
+                WHERE invoice_id IN (SELECT id FROM temp.render_ids) ORDER BY invoice_id, id"""):
+            lines.setdefault(invoice_id, []).append((description, quantity, unit_price))
+    conn.commit()
+    return [(invoices[invoice_id], lines.get(invoice_id, [])) for invoice_id in sorted(invoices)]
+
+
+def company_name(conn):
+    row = conn.execute("SELECT value FROM settings WHERE key = 'company_name'").fetchone()
+    return row[0] if row else ""
+
+
+# --- Rendering ---
+
+def render_html(invoice, lines, company="", template=None):
+    """An invoice's HTML document; `invoice` and `lines` are as read_invoices returns them."""
+    invoice_template, line_template = template or load_template()
+    invoice_id, invoice_date, due_date, total, tax, status, customer_id, name, email, contact = invoice
+    escape = html.escape
+    rendered_lines = "".join(line_template.render({
+        "description": escape(description),
+        "quantity": _quantity(quantity),
+        "unit_price": _money(unit_price),
+        "line_total": _money(round(quantity * unit_price, 2)),
+    }) for description, quantity, unit_price in lines)
+    return invoice_template.render({
+        "company": escape(company),
+        "invoice_id": str(invoice_id),
+        "invoice_date": escape(invoice_date),
+        "due_date": escape(due_date),
+        "status": escape(status),
+        "customer_name": escape(name if name is not None else f"Customer #{customer_id}"),
+        "customer_email": escape(email or ""),
+        "customer_contact": escape(contact or ""),
+        "subtotal": _money(total - tax),
+        "tax": _money(tax),
+        "total": _money(total),
+        "lines": rendered_lines,
+    })
+
+
+def _latin1(text):
+    # The PDF core fonts only cover Latin-1
+    return str(text).encode("latin-1", "replace").decode("latin-1")
+
+
+def render_pdf(invoice, lines, path, company=""):
+    """Write an invoice as a PDF to `path` (needs fpdf2)."""
+    from fpdf import FPDF
+
+    invoice_id, invoice_date, due_date, total, tax, status, customer_id, name, email, contact = invoice
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Helvetica", "B", 16)
+    pdf.cell(120, 10, _latin1(company))
+    pdf.cell(0, 10, f"Invoice #{invoice_id}", align="R", new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font("Helvetica", "", 10)
+    for text in (name if name is not None else f"Customer #{customer_id}", email or "", contact or "", "",
+                 f"Invoice date: {invoice_date}", f"Due date: {due_date}", f"Status: {status}", ""):
+        pdf.cell(0, 5, _latin1(text), new_x="LMARGIN", new_y="NEXT")
+    widths = (100, 25, 30, 35)
+    pdf.set_font("Helvetica", "B", 10)
+    for width, heading, align in zip(widths, ("Description", "Quantity", "Unit price", "Amount"), "LRRR"):
+        pdf.cell(width, 7, heading, border="B", align=align)
+    pdf.ln()
+    pdf.set_font("Helvetica", "", 10)
+    for description, quantity, unit_price in lines:
+        values = (_latin1(description), _quantity(quantity), _money(unit_price),
+                  _money(round(quantity * unit_price, 2)))
+        for width, value, align in zip(widths, values, "LRRR"):
+            pdf.cell(width, 6, value, align=align)
+        pdf.ln()
+    pdf.ln(4)
+    for label, value, style in (("Subtotal", total - tax, ""), ("Tax", tax, ""), ("Total", total, "B")):
+        pdf.set_font("Helvetica", style, 10)
+        pdf.cell(sum(widths[:3]), 6, label, align="R")
+        pdf.cell(widths[3], 6, _money(value), align="R", new_x="LMARGIN", new_y="NEXT")
+    pdf.output(path)
+
+
+# --- Batch rendering ---
+
+# Per worker process: its connection, output settings and company name
+_worker = {}
+
+
+def _init_worker(db_path, output_dir, pdf, template_path):
+    conn = schema.connect(db_path)
+    _worker.update(conn=conn, output_dir=output_dir, pdf=pdf, template_path=template_path,
+                   company=company_name(conn))
+
+
+def _render_chunk(invoice_ids):
+    """Render and write one chunk in a worker; returns (pid, invoices, bytes written, peak RSS in KiB)."""
+    conn = _worker["conn"]
+    template = load_template(_worker["template_path"])
+    written = 0
+    invoices = read_invoices(conn, invoice_ids)
+    for invoice, lines in invoices:
+        if _worker["pdf"]:
+            path = os.path.join(_worker["output_dir"], f"invoice-{invoice[0]}.pdf")
+            render_pdf(invoice, lines, path, _worker["company"])
+            written += os.path.getsize(path)
+        else:
+            document = render_html(invoice, lines, _worker["company"], template).encode("utf-8")
+            with open(os.path.join(_worker["output_dir"], f"invoice-{invoice[0]}.html"), "wb") as f:
+                f.write(document)
+            written += len(document)
+    return os.getpid(), len(invoices), written, _peak_rss_kib()
+
+
+def _peak_rss_kib():
+    """This process's peak resident memory in KiB, or None where it can't be read."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def select_invoices(conn, date_from=None, date_to=None, status=None):
+    """Ids of the invoices dated within a range (ISO dates, inclusive) and with a status, in id order."""
+    conditions = []
+    params = []
+    if date_from:
+        conditions.append("invoice_date >= ?")
+        params.append(date.fromisoformat(date_from).isoformat())
+    if date_to:
+        conditions.append("invoice_date <= ?")
+        params.append(date.fromisoformat(date_to).isoformat())
+    if status:
+        conditions.append("status = ?")
+        params.append(status)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    schemas = ["main"]
+    if archive.reaches(conn, date_from, [status] if status else None):
+        schemas.append(archive.SCHEMA)
+    ids = []
+    for name in schemas:
+        ids += [row[0] for row in conn.execute(f"SELECT id FROM {name}.invoices{where}", params)]
+    return sorted(ids)
+
+
+class RenderResult:
+    """Counts, timing and per-worker figures for one batch render."""
+
+    def __init__(self, invoices, written, seconds, workers):
+        self.invoices = invoices
+        self.written = written
+        self.seconds = seconds
+        # pid -> (invoices rendered, peak RSS in KiB or None)
+        self.workers = workers
+
+    @property
+    def invoices_per_second(self):
+        return self.invoices / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        lines = [f"Rendered {self.invoices} invoices ({self.written / 1024 ** 2:,.1f} MiB) in {self.seconds:.2f} s "
+                 f"({self.invoices_per_second:,.0f} invoices/s) with {len(self.workers)} workers"]
+        for pid, (count, peak_kib) in sorted(self.workers.items()):
+            memory = f", peak RSS {peak_kib / 1024:,.1f} MiB" if peak_kib is not None else ""
+            lines.append(f"  worker {pid}: {count} invoices{memory}")
+        return "\n".join(lines)
+
+
+def render_batch(db_path, invoice_ids, output_dir, pdf=False, template_path=None, workers=None,
+                 chunk_invoices=CHUNK_INVOICES, progress=None):
+    """Render invoices into `output_dir` on a pool of worker processes; returns a RenderResult.
+
+    `progress(done, total)` is called as chunks finish.
+    """
+    if template_path:
+        load_template(template_path)  # Fail here, not in every worker, if the template is broken
+    if pdf and importlib.util.find_spec("fpdf") is None:
+        raise ImportError("PDF output needs fpdf2 (pip install fpdf2)")
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    chunks = [invoice_ids[offset:offset + chunk_invoices] for offset in range(0, len(invoice_ids), chunk_invoices)]
+    start = time.perf_counter()
+    done = written = 0
+    per_worker = {}
+    with multiprocessing.Pool(min(workers, max(len(chunks), 1)), _init_worker,
+                              (db_path, output_dir, pdf, template_path)) as pool:
+        for pid, count, size, peak_kib in pool.imap_unordered(_render_chunk, chunks):
+            done += count
+            written += size
+            previous = per_worker.get(pid, (0, None))
+            per_worker[pid] = (previous[0] + count, peak_kib)
+            if progress:
+                progress(done, len(invoice_ids))
+    return RenderResult(done, written, time.perf_counter() - start, per_worker)
+
+
+def _month_range(month):
+    year, number = (int(part) for part in month.split("-"))
+    first = date(year, number, 1)
+    following = date(year + number // 12, number % 12 + 1, 1)
+    return first.isoformat(), date.fromordinal(following.toordinal() - 1).isoformat()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render invoices as HTML or PDF documents.")
+    parser.add_argument("--db", default="mybookkeeping.db")
+    parser.add_argument("--output", required=True, help="directory to write the documents to")
+    parser.add_argument("--ids", type=int, nargs="+", help="the invoices to render")
+    parser.add_argument("--month", help="render the invoices dated in this month (YYYY-MM)")
+    parser.add_argument("--from", dest="date_from", help="first invoice date (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", help="last invoice date (YYYY-MM-DD)")
+    parser.add_argument("--status", help="only invoices with this status")
+    parser.add_argument("--pdf", action="store_true", help="write PDF instead of HTML (needs fpdf2)")
+    parser.add_argument("--template", help="an HTML template to use instead of the built-in one")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    if args.ids:
+        invoice_ids = sorted(set(args.ids))
+    else:
+        date_from, date_to = _month_range(args.month) if args.month else (args.date_from, args.date_to)
+        conn = schema.connect(args.db)
+        try:
+            invoice_ids = select_invoices(conn, date_from, date_to, args.status)
+        finally:
+            conn.close()
+    try:
+        result = render_batch(args.db, invoice_ids, args.output, args.pdf, args.template, args.workers,
+                              progress=lambda done, total: print(f"  {done}/{total} invoices rendered...", end="\r"))
+    except (ValueError, ImportError, sqlite3.Error) as e:
+        parser.exit(1, f"Could not render invoices: {e}\n")
+    print()
+    print(result)
+
+
+if __name__ == "__main__":
+    main()
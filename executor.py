@@ -0,0 +1,188 @@
+"""Background execution of database work for the Tk user interface.
+
+Tk is not thread-safe, so worker threads never touch widgets. Each worker
+owns its own SQLite connection and puts finished jobs on a queue, which the
+main thread drains from a `root.after` callback and dispatches to the
+job's callbacks. Long jobs (imports, exports, backups, archiving) get a
+thread and connection of their own, so the shared workers stay free for the
+page fetches and searches the user is waiting on.
+"""
+import queue
+import sqlite3
+import threading
+
+POLL_INTERVAL_MS = 15
+DEFAULT_WORKERS = 2
+
+
+class Job:
+    """A unit of database work submitted to a QueryExecutor.
+
+    The job function is called as `func(conn, job, *args)` on a worker
+    thread. Long-running functions should call `job.progress()` as they go
+    and stop early when `job.cancelled` becomes true.
+    """
+
+    def __init__(self, executor, func, args, channel, on_done, on_error, on_progress):
+        self.executor = executor
+        self.func = func
+        self.args = args
+        self.channel = channel
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.cancelled = False
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """Stop the job, interrupting its current statement if it is running."""
+        self.cancelled = True
+        # The lock keeps the worker from moving on to its next job mid-interrupt
+        with self._lock:
+            if self._conn is not None:
+                self._conn.interrupt()
+
+    def progress(self, done, total=None, message=""):
+        """Report progress back to the main thread (called from the worker)."""
+        if self.on_progress and not self.cancelled:
+            self.executor._results.put(("progress", self, (done, total, message)))
+
+
+class QueryExecutor:
+    """Runs jobs on worker threads and delivers their results through `root.after`."""
+
+    def __init__(self, root, db_path, workers=DEFAULT_WORKERS, connect=sqlite3.connect):
+        self.root = root
+        self.db_path = db_path
+        self._connect = connect
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._latest = {}   # channel -> the job that superseded all earlier ones
+        self._outstanding = 0
+        self._poll_timer = None
+        # Bumped by reconnect(); a worker whose connection is older reopens it
+        self._generation = 0
+        self._threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self._work, name=f"db-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, func, *args, channel=None, long=False, on_done=None, on_error=None, on_progress=None):
+        """Queue `func(conn, job, *args)` to run on a worker and return its Job.
+
+        Submitting to a channel cancels any earlier job on the same channel,
+        so only the most recent request (e.g. the latest search) reports back.
+        A `long` job runs on a thread of its own instead of a shared worker.
+        """
+        job = Job(self, func, args, channel, on_done, on_error, on_progress)
+        if channel is not None:
+            self.cancel(channel)
+            self._latest[channel] = job
+        self._outstanding += 1
+        if long:
+            threading.Thread(target=self._work_long, args=(job,), name="db-long-job", daemon=True).start()
+        else:
+            self._jobs.put(job)
+        if self._poll_timer is None:
+            self._poll_timer = self.root.after(POLL_INTERVAL_MS, self._poll)
+        return job
+
+    def cancel(self, channel):
+        """Cancel the outstanding job on a channel, if any."""
+        job = self._latest.pop(channel, None)
+        if job is not None:
+            job.cancel()
+
+    def reconnect(self):
+        """Have every worker open a fresh connection before its next job (e.g. to see a newly attached database)."""
+        self._generation += 1
+
+    def shutdown(self):
+        """Cancel outstanding work and stop the worker threads."""
+        for channel in list(self._latest):
+            self.cancel(channel)
+        for _ in self._threads:
+            self._jobs.put(None)
+        if self._poll_timer is not None:
+            self.root.after_cancel(self._poll_timer)
+            self._poll_timer = None
+
+    def _work(self):
+        generation = self._generation
+        conn = self._connect(self.db_path)
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            if job.cancelled:
+                self._results.put(("cancelled", job, None))
+                continue
+            if generation != self._generation:
+                generation = self._generation
+                conn.close()
+                conn = self._connect(self.db_path)
+            self._run(conn, job)
+        conn.close()
+
+    def _work_long(self, job):
+        if job.cancelled:
+            self._results.put(("cancelled", job, None))
+            return
+        try:
+            conn = self._connect(self.db_path)
+        except Exception as e:
+            self._results.put(("error", job, e))
+            return
+        try:
+            self._run(conn, job)
+        finally:
+            conn.close()
+
+    def _run(self, conn, job):
+        job._conn = conn
+        try:
+            result = job.func(conn, job, *job.args)
+        except Exception as e:
+            # Leave no transaction open behind a failed or interrupted job
+            if conn.in_transaction:
+                conn.rollback()
+            self._results.put(("error", job, e))
+        else:
+            self._results.put(("done", job, result))
+        finally:
+            with job._lock:
+                job._conn = None
+
+    def _poll(self):
+        """Deliver finished jobs to their callbacks on the main thread."""
+        self._poll_timer = None
+        try:
+            while True:
+                try:
+                    kind, job, payload = self._results.get_nowait()
+                except queue.Empty:
+                    break
+                self._dispatch(kind, job, payload)
+        finally:
+            # Keep polling even if a callback raised
+            if self._outstanding > 0:
+                self._poll_timer = self.root.after(POLL_INTERVAL_MS, self._poll)
+
+    def _dispatch(self, kind, job, payload):
+        if kind != "progress":
+            self._outstanding -= 1
+            if job.channel is not None and self._latest.get(job.channel) is job:
+                del self._latest[job.channel]
+        if job.cancelled or kind == "cancelled":
+            return
+        if kind == "done" and job.on_done:
+            job.on_done(payload)
+        elif kind == "error":
+            if job.on_error:
+                job.on_error(payload)
+            else:
+                print(f"Warning: Background database job failed: {payload}")
+        elif kind == "progress":
+            job.on_progress(*payload)
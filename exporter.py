@@ -0,0 +1,266 @@
+"""Streaming CSV export of the customer, invoice and invoice item ledgers.
+
+Rows are read from the cursor in fixed-size batches and written straight
+to the file, so memory use does not depend on how many rows are exported.
+Every export is ordered by a primary key, which SQLite reads in index
+order; an ORDER BY that needed a sort would buffer the whole result.
+
+The file is written under a temporary name and only renamed into place
+once the export completes, so a cancelled or failed export never leaves
+a truncated CSV behind. Headers match what importer.py reads.
+
+Invoices and items moved to the archive (see archive.py) are exported
+too when the filters reach them. Each file is read in id order and the
+two merged, so the rows still come out in one id order without a sort.
+
+`export_changes` writes only the rows changed since a named checkpoint
+(see changelog.py), each marked "upsert" with its current values or
+"delete" with just its id, for syncing another system incrementally.
+
+    python exporter.py invoices invoices.csv --from 2024-01-01 --status Paid
+    python exporter.py invoices delta.csv --changes warehouse
+"""
+import argparse
+import csv
+import os
+from datetime import date
+
+import archive
+import changelog
+import schema
+
+# Rows fetched from the cursor at a time
+BATCH_ROWS = 1000
+# Page cache used while exporting, in KiB. A one-pass scan gains nothing from
+# caching, and the app's large cache and memory map would otherwise end up
+# holding most of the file in resident memory.
+EXPORT_CACHE_KIB = 2048
+
+# Ledger -> (header, SELECT ... FROM ..., invoice date column, status column, ORDER BY).
+# Date and status filters only apply to ledgers that have those columns, and
+# ledgers whose SELECT names a {schema} are read from the archive as well.
+LEDGERS = {
+    "customers": (
+        ["ID", "Name", "Email", "Contact"],
+        "SELECT id, name, email, contact FROM customers",
+        None, None, "id",
+    ),
+    "invoices": (
+        ["ID", "Customer ID", "Customer", "Invoice Date", "Due Date", "Total Amount", "Tax Amount", "Status"],
+        """SELECT i.id, i.customer_id, c.name, i.invoice_date, i.due_date, i.total_amount, i.tax_amount, i.status
+           FROM {schema}.invoices i LEFT JOIN customers c ON c.id = i.customer_id""",
+        "i.invoice_date", "i.status", "i.id",
+    ),
+    "invoice_items": (
+        ["ID", "Invoice ID", "Invoice Date", "Customer", "Description", "Quantity", "Unit Price", "Line Total"],
+        """SELECT it.id, it.invoice_id, i.invoice_date, c.name, it.description, it.quantity, it.unit_price,
+                  ROUND(it.quantity * it.unit_price, 2)
+           FROM {schema}.invoice_items it
+           JOIN {schema}.invoices i ON i.id = it.invoice_id
+           LEFT JOIN customers c ON c.id = i.customer_id""",
+        "i.invoice_date", "i.status", "it.id",
+    ),
+}
+
+
+class ExportCancelled(Exception):
+    """Raised when an export is cancelled before it finishes."""
+
+
+def export_query(ledger, date_from=None, date_to=None, status=None, archived=False):
+    """Return the (query, params) that selects a ledger's rows for export, from the archive too if `archived`."""
+    if ledger not in LEDGERS:
+        raise ValueError(f"Cannot export ledger: {ledger}")
+    _, select, date_column, status_column, order_by = LEDGERS[ledger]
+    conditions = []
+    params = []
+    if date_column:
+        if date_from:
+            conditions.append(f"{date_column} >= ?")
+            params.append(date.fromisoformat(date_from).isoformat())
+        if date_to:
+            conditions.append(f"{date_column} <= ?")
+            params.append(date.fromisoformat(date_to).isoformat())
+    if status_column and status:
+        # Unary + keeps the planner off the status index: walking it would
+        # return rows out of id order and force a sort of the whole result
+        conditions.append(f"+{status_column} = ?")
+        params.append(status)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    if not archived or "{schema}" not in select:
+        return select.format(schema="main") + where + f" ORDER BY {order_by}", tuple(params)
+    # Ordered by the id in the first column, which both files' arms already are
+    arms = [select.format(schema=name) + where for name in ("main", archive.SCHEMA)]
+    return " UNION ALL ".join(arms) + " ORDER BY 1", tuple(params) * len(arms)
+
+
+def reaches_archive(conn, ledger, date_from=None, status=None):
+    """Whether an export with these filters has rows in the archive to include."""
+    return "{schema}" in LEDGERS[ledger][1] and archive.reaches(conn, date_from, [status] if status else None)
+
+
+def count_rows(conn, ledger, date_from=None, date_to=None, status=None):
+    """Return how many rows an export with these filters will write."""
+    query, params = export_query(ledger, date_from, date_to, status,
+                                 reaches_archive(conn, ledger, date_from, status))
+    return conn.execute(f"SELECT COUNT(*) FROM ({query})", params).fetchone()[0]
+
+
+def export_csv(conn, ledger, path, date_from=None, date_to=None, status=None,
+               progress=None, cancelled=None, batch_rows=BATCH_ROWS):
+    """Write a ledger to `path` as CSV and return the number of rows written.
+
+    `progress(done, total)` is called after every batch, with the total
+    counted up front. If `cancelled()` returns True the partial file is
+    removed and ExportCancelled is raised.
+    """
+    query, params = export_query(ledger, date_from, date_to, status,
+                                 reaches_archive(conn, ledger, date_from, status))
+    header = LEDGERS[ledger][0]
+
+    temp_path = path + ".part"
+    count = 0
+    cache_size = conn.execute("PRAGMA cache_size").fetchone()[0]
+    mmap_size = conn.execute("PRAGMA mmap_size").fetchone()[0]
+    conn.execute(f"PRAGMA cache_size = -{EXPORT_CACHE_KIB}")
+    conn.execute("PRAGMA mmap_size = 0")
+    try:
+        total = count_rows(conn, ledger, date_from, date_to, status) if progress else None
+        with open(temp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            cursor = conn.execute(query, params)
+            while True:
+                if cancelled and cancelled():
+                    raise ExportCancelled(f"Export of {ledger} cancelled after {count} rows")
+                rows = cursor.fetchmany(batch_rows)
+                if not rows:
+                    break
+                writer.writerows(rows)
+                count += len(rows)
+                if progress:
+                    progress(count, total)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        # The connection may be shared with other jobs; put its settings back
+        conn.execute(f"PRAGMA cache_size = {cache_size}")
+        conn.execute(f"PRAGMA mmap_size = {mmap_size}")
+    return count
+
+
+def _changes_queries(conn, ledger):
+    """(upserts, deletes) queries for the rows of `ledger` changed in a seq range; params (since, until)."""
+    _, select, _, _, id_column = LEDGERS[ledger]
+    schemas = ["main"]
+    if "{schema}" in select and archive.is_attached(conn):
+        # Rows changed and then archived are upserts too
+        schemas.append(archive.SCHEMA)
+    changed = f"""WITH changed (id) AS (
+        SELECT DISTINCT row_id FROM change_log WHERE seq > ? AND seq <= ? AND table_name = '{ledger}')"""
+    arms = [select.format(schema=name) + f" WHERE {id_column} IN (SELECT id FROM changed)" for name in schemas]
+    upserts = f"{changed} " + " UNION ALL ".join(arms) + " ORDER BY 1"
+    gone = " AND ".join(f"NOT EXISTS (SELECT 1 FROM {name}.{ledger} t WHERE t.id = changed.id)" for name in schemas)
+    deletes = f"{changed} SELECT id FROM changed WHERE {gone} ORDER BY id"
+    return upserts, deletes
+
+
+def export_changes(conn, ledger, path, checkpoint, progress=None, cancelled=None, batch_rows=BATCH_ROWS):
+    """Write the rows of `ledger` changed since `checkpoint` to `path`; returns the number written.
+
+    Each row is prefixed with "upsert" (the row as it is now) or "delete"
+    (only the id follows). Without a completed export for this checkpoint
+    every row is written as an upsert. The checkpoint moves on only once
+    the file is in place, so a failed or cancelled export is simply run
+    again. `progress(done, total)` is called after every batch.
+    """
+    if ledger not in LEDGERS:
+        raise ValueError(f"Cannot export ledger: {ledger}")
+    since = changelog.checkpoint(conn, checkpoint, ledger)
+    if since is None:
+        changelog.hold_checkpoint(conn, checkpoint, ledger)
+    header = ["Change"] + LEDGERS[ledger][0]
+    width = len(LEDGERS[ledger][0])
+
+    temp_path = path + ".part"
+    count = 0
+    if conn.in_transaction:
+        conn.commit()
+    # One read transaction, so the rows and the seq they are current as of agree
+    conn.execute("BEGIN")
+    try:
+        until = changelog.last_seq(conn)
+        if since is None:
+            queries = [(export_query(ledger, archived=reaches_archive(conn, ledger)), "upsert")]
+        else:
+            upserts, deletes = _changes_queries(conn, ledger)
+            queries = [((upserts, (since, until)), "upsert"), ((deletes, (since, until)), "delete")]
+        total = None
+        if progress:
+            total = sum(conn.execute(f"SELECT COUNT(*) FROM ({query})", params).fetchone()[0]
+                        for (query, params), _ in queries)
+        with open(temp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for (query, params), change in queries:
+                cursor = conn.execute(query, params)
+                while True:
+                    if cancelled and cancelled():
+                        raise ExportCancelled(f"Export of {ledger} changes cancelled after {count} rows")
+                    rows = cursor.fetchmany(batch_rows)
+                    if not rows:
+                        break
+                    if change == "upsert":
+                        writer.writerows((change,) + row for row in rows)
+                    else:
+                        writer.writerows((change,) + row + ("",) * (width - 1) for row in rows)
+                    count += len(rows)
+                    if progress:
+                        progress(count, total)
+        conn.rollback()
+        os.replace(temp_path, path)
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    changelog.set_checkpoint(conn, checkpoint, ledger, until)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a ledger from the bookkeeping database to CSV.")
+    parser.add_argument("ledger", choices=sorted(LEDGERS))
+    parser.add_argument("csv_path")
+    parser.add_argument("--db", default="mybookkeeping.db")
+    parser.add_argument("--from", dest="date_from", help="first invoice date to include (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", help="last invoice date to include (YYYY-MM-DD)")
+    parser.add_argument("--status", help="only include invoices with this status")
+    parser.add_argument("--changes", metavar="CHECKPOINT",
+                        help="only the rows changed since this checkpoint's last export (see changelog.py)")
+    args = parser.parse_args()
+
+    conn = schema.connect(args.db)
+    if args.changes:
+        if args.date_from or args.date_to or args.status:
+            parser.error("--changes exports every changed row; it can't be combined with filters")
+        schema.migrate(conn)
+        count = export_changes(conn, args.ledger, args.csv_path, args.changes,
+                               progress=lambda done, total: print(f"  {done}/{total} rows written...", end="\r"))
+        print()
+        print(f"Exported {count} changed {args.ledger} rows to {args.csv_path}")
+        conn.close()
+        return
+    count = export_csv(conn, args.ledger, args.csv_path, args.date_from, args.date_to, args.status,
+                       progress=lambda done, total: print(f"  {done}/{total} rows written...", end="\r"))
+    print()
+    print(f"Exported {count} {args.ledger} rows to {args.csv_path}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
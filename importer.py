@@ -0,0 +1,414 @@
+"""Bulk CSV import for customers, invoices and invoice items.
+
+The CSV is streamed, each row is validated and coerced to the column
+types, and valid rows are written with `executemany` in large chunks, one
+transaction per chunk. An invoice must name an existing customer and a
+known status, and an item an existing invoice. Rows that fail validation,
+or that the database rejects, go to a side file together with the reason.
+
+Index and full-text maintenance is deferred for large imports. Secondary
+indexes on the target table are dropped and rebuilt once at the end; a
+marker in the settings table lists them, so `resume` rebuilds them if the
+import never got that far. Each chunk's transaction also drops the search,
+summary and change log triggers, inserts, adds the chunk's rows to the
+search index, the report summaries and the change log with one statement
+each, and recreates the triggers before it commits. Other connections
+never see the triggers missing, and a crash rolls the whole chunk back.
+
+    python importer.py customers clients.csv
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import time
+from datetime import date
+
+import changelog
+import ledger
+import reports
+import schema
+import search
+from transactions import write_transaction
+
+CHUNK_ROWS = 50000
+# Defer index maintenance when the file likely holds at least this share of the table
+DEFER_INDEX_RATIO = 0.25
+# Settings key listing the (name, sql) of indexes an import dropped and has not rebuilt yet
+PENDING_KEY = "import_pending_indexes"
+
+
+def _text(value):
+    return value.strip()
+
+
+def _integer(value):
+    return int(value)
+
+
+def _real(value):
+    return float(value)
+
+
+def _date(value):
+    # Normalises and validates YYYY-MM-DD
+    return date.fromisoformat(value.strip()).isoformat()
+
+
+def _status(value):
+    for status in ledger.INVOICE_STATUSES:
+        if value.strip().lower() == status.lower():
+            return status
+    raise ValueError(f"status must be one of {', '.join(ledger.INVOICE_STATUSES)}")
+
+
+# Column name -> (coerce, required, default) per table, in INSERT order.
+# Header names are matched case-insensitively with spaces read as underscores,
+# so the files written by "Export to CSV" import unchanged.
+TABLES = {
+    "customers": {
+        "id": (_integer, False, None),
+        "name": (_text, True, None),
+        "email": (_text, False, ""),
+        "contact": (_text, False, ""),
+    },
+    "invoices": {
+        "id": (_integer, False, None),
+        "customer_id": (_integer, True, None),
+        "invoice_date": (_date, True, None),
+        "due_date": (_date, True, None),
+        "total_amount": (_real, True, None),
+        "tax_amount": (_real, False, 0.0),
+        "status": (_status, False, "Draft"),
+    },
+    "invoice_items": {
+        "id": (_integer, False, None),
+        "invoice_id": (_integer, True, None),
+        "description": (_text, True, None),
+        "quantity": (_real, True, None),
+        "unit_price": (_real, True, None),
+    },
+}
+
+# Column -> table whose row it must name. Foreign keys are not enforced,
+# so rows naming a missing customer or invoice are rejected here.
+REFERENCES = {
+    "invoices": ("customer_id", "customers"),
+    "invoice_items": ("invoice_id", "invoices"),
+}
+
+
+class ImportResult:
+    """Counts and timing for one import run."""
+
+    def __init__(self, table, accepted, rejected, seconds, rejects_path):
+        self.table = table
+        self.accepted = accepted
+        self.rejected = rejected
+        self.seconds = seconds
+        self.rejects_path = rejects_path
+
+    @property
+    def rows_per_second(self):
+        return (self.accepted + self.rejected) / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        text = (f"Imported {self.accepted} {self.table} rows in {self.seconds:.2f} s "
+                f"({self.rows_per_second:,.0f} rows/s)")
+        if self.rejected:
+            text += f"; {self.rejected} rejected rows written to {self.rejects_path}"
+        return text
+
+
+def _normalise(header):
+    return header.strip().lower().replace(" ", "_")
+
+
+class _Rejects:
+    """Writes rejected rows to a side file, creating it on the first reject."""
+
+    def __init__(self, path, header):
+        self.path = path
+        self.header = header
+        self.count = 0
+        self._file = None
+        self._writer = None
+
+    def add(self, row, reason):
+        if self._writer is None:
+            self._file = open(self.path, "w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(self.header + ["error"])
+        self._writer.writerow(row + [reason])
+        self.count += 1
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+def _should_defer_indexes(conn, table, path):
+    """Guess whether rebuilding the indexes once beats maintaining them per row."""
+    # MAX(rowid) is an O(1) stand-in for COUNT(*)
+    existing = conn.execute(f"SELECT MAX(rowid) FROM {table}").fetchone()[0] or 0
+    if existing == 0:
+        return True
+    with open(path, "rb") as f:
+        sample = f.read(1 << 16)
+    estimated_rows = os.path.getsize(path) * max(1, sample.count(b"\n")) // max(1, len(sample))
+    return estimated_rows >= existing * DEFER_INDEX_RATIO
+
+
+def _drop_indexes(conn, table):
+    """Drop the table's secondary indexes, noting them for `resume`; returns their (name, sql)."""
+    with write_transaction(conn):
+        indexes = conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+            (table,)).fetchall()
+        row = conn.execute("SELECT value FROM settings WHERE key = ?", (PENDING_KEY,)).fetchone()
+        pending = json.loads(row[0]) if row else []
+        conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                     (PENDING_KEY, json.dumps(pending + [list(index) for index in indexes])))
+        for name, _ in indexes:
+            conn.execute(f'DROP INDEX "{name}"')
+    return indexes
+
+
+def resume(conn):
+    """Rebuild the indexes an import dropped and has not rebuilt (it may have been interrupted).
+
+    Returns whether there were any.
+    """
+    if conn.execute("SELECT 1 FROM settings WHERE key = ?", (PENDING_KEY,)).fetchone() is None:
+        return False
+    tables = set()
+    with write_transaction(conn):
+        row = conn.execute("SELECT value FROM settings WHERE key = ?", (PENDING_KEY,)).fetchone()
+        for name, sql in json.loads(row[0]) if row else []:
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is None:
+                conn.execute(sql)
+                tables.add(conn.execute("SELECT tbl_name FROM sqlite_master WHERE name = ?", (name,)).fetchone()[0])
+        conn.execute("DELETE FROM settings WHERE key = ?", (PENDING_KEY,))
+    for table in sorted(tables):
+        conn.execute(f"ANALYZE {table}")
+    return True
+
+
+def import_csv(conn, table, path, rejects_path=None, chunk_rows=CHUNK_ROWS, progress=None,
+               defer_indexes=None, cancelled=None):
+    """Import a CSV file into `customers`, `invoices` or `invoice_items`.
+
+    `progress(rows_read)` is called after every chunk and `cancelled()`, if
+    given, is checked between chunks. Chunks already written stay committed.
+    Returns an ImportResult.
+    """
+    if table not in TABLES:
+        raise ValueError(f"Cannot import into table: {table}")
+    columns = TABLES[table]
+    rejects_path = rejects_path or os.path.splitext(path)[0] + ".rejects.csv"
+    start = time.perf_counter()
+
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            raise ValueError(f"{path} is empty")
+        positions = {_normalise(name): index for index, name in enumerate(header)}
+        missing = [name for name, (_, required, _) in columns.items() if required and name not in positions]
+        if missing:
+            raise ValueError(f"{path} is missing required columns: {', '.join(missing)}")
+
+        # Columns present in the file are coerced; the rest take their default
+        fields = []
+        for name, (coerce, required, default) in columns.items():
+            if name in positions:
+                fields.append((name, positions[name], coerce, required, default))
+            elif default is not None:
+                fields.append((name, None, None, required, default))
+        names = [field[0] for field in fields]
+        insert = f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+        reference = None
+        if table in REFERENCES:
+            column, target = REFERENCES[table]
+            reference = (names.index(column), column, target)
+
+        rejects = _Rejects(rejects_path, header)
+        accepted = 0
+        suspended = _Suspended(conn, table, has_ids="id" in positions)
+        dropped_indexes = False
+
+        try:
+            chunk, chunk_source = _read_chunk(reader, fields, rejects, chunk_rows)
+            if defer_indexes is None:
+                defer_indexes = _should_defer_indexes(conn, table, path)
+            if defer_indexes:
+                dropped_indexes = bool(_drop_indexes(conn, table))
+
+            while chunk:
+                accepted += _write_chunk(conn, insert, chunk, chunk_source, rejects, suspended, reference)
+                if progress:
+                    progress(accepted + rejects.count)
+                if cancelled and cancelled():
+                    break
+                chunk, chunk_source = _read_chunk(reader, fields, rejects, chunk_rows)
+        finally:
+            rejects.close()
+            # Rebuild the indexes even if the import stopped early
+            if dropped_indexes:
+                resume(conn)
+
+    return ImportResult(table, accepted, rejects.count, time.perf_counter() - start,
+                        rejects_path if rejects.count else None)
+
+
+def _read_chunk(reader, fields, rejects, chunk_rows):
+    """Read and coerce up to `chunk_rows` rows; returns (values, source rows)."""
+    values = []
+    sources = []
+    for row in reader:
+        if not any(row):
+            continue  # Skip blank lines
+        try:
+            record = []
+            for name, position, coerce, required, default in fields:
+                raw = row[position] if position is not None and position < len(row) else ""
+                if raw.strip():
+                    record.append(coerce(raw))
+                elif required:
+                    raise ValueError(f"{name} is required")
+                else:
+                    record.append(default)
+        except ValueError as e:
+            rejects.add(row, str(e))
+            continue
+        values.append(tuple(record))
+        sources.append(row)
+        if len(values) >= chunk_rows:
+            break
+    return values, sources
+
+
+class _Suspended:
+    """The per-row triggers a chunk replaces with one catch-up statement each, for one table."""
+
+    def __init__(self, conn, table, has_ids):
+        self.table = table
+        self.search = table == "customers" and search.has_customer_index(conn)
+        self.summaries = table == "invoices" and reports.has_summary_tables(conn)
+        self.changes = changelog.has_change_log(conn)
+        # Whether the first value of a row is its (optional) explicit id
+        self.has_ids = has_ids
+
+    def drop(self, conn):
+        """Drop the triggers and return the highest id so far; call inside the chunk's transaction."""
+        if self.search:
+            conn.execute("DROP TRIGGER IF EXISTS customers_fts_insert")
+        if self.summaries:
+            reports.drop_summary_triggers(conn)
+        if self.changes:
+            changelog.drop_triggers(conn, [self.table])
+        return conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {self.table}").fetchone()[0]
+
+    def restore(self, conn, after_id, low_ids):
+        """Catch up on the rows above `after_id` and the `low_ids` inserted below it, then recreate the triggers."""
+        if self.search:
+            search.index_new_customers(conn, after_id, low_ids)
+            search.create_customer_triggers(conn)
+        if self.summaries:
+            reports.add_invoices(conn, after_id, low_ids)
+            reports.create_summary_triggers(conn)
+        if self.changes:
+            changelog.log_inserted(conn, self.table, after_id, low_ids)
+            changelog.create_triggers(conn, [self.table])
+
+    def low_ids(self, rows, after_id):
+        """Explicit ids at or below `after_id` among inserted rows, which `id > after_id` doesn't cover."""
+        if not self.has_ids:
+            return set()
+        return {row[0] for row in rows if row[0] is not None and row[0] <= after_id}
+
+
+def _split_references(conn, reference, chunk, sources):
+    """Separate the rows naming a missing row; returns (values, sources, [(source, reason)]).
+
+    `reference` is (position, column, table) or None. Call inside the chunk's
+    transaction, so the rows named can't be deleted before the insert.
+    """
+    if reference is None:
+        return chunk, sources, []
+    position, column, table = reference
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS import_references (id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.import_references")
+    conn.executemany("INSERT OR IGNORE INTO temp.import_references (id) VALUES (?)",
+                     ((values[position],) for values in chunk))
+    missing = {row[0] for row in conn.execute(
+        f"SELECT id FROM temp.import_references WHERE id NOT IN (SELECT id FROM main.{table})")}
+    if not missing:
+        return chunk, sources, []
+    kept_values, kept_sources, orphans = [], [], []
+    for values, source in zip(chunk, sources):
+        if values[position] in missing:
+            orphans.append((source, f"{column} {values[position]} is not in {table}"))
+        else:
+            kept_values.append(values)
+            kept_sources.append(source)
+    return kept_values, kept_sources, orphans
+
+
+def _write_chunk(conn, insert, chunk, sources, rejects, suspended, reference=None):
+    """Insert a chunk, with its trigger catch-up, in one transaction; returns the number of rows written."""
+    if not chunk:
+        return 0
+    try:
+        with write_transaction(conn):
+            values, _, orphans = _split_references(conn, reference, chunk, sources)
+            after_id = suspended.drop(conn)
+            conn.executemany(insert, values)
+            suspended.restore(conn, after_id, suspended.low_ids(values, after_id))
+    except sqlite3.IntegrityError:
+        pass
+    else:
+        # Only once committed, as the row-by-row retry would reject them again
+        for source, reason in orphans:
+            rejects.add(source, reason)
+        return len(values)
+    # Something in the chunk broke a constraint (e.g. a duplicate id): redo it
+    # row by row so only the offending rows are rejected
+    written = []
+    with write_transaction(conn):
+        values, sources, orphans = _split_references(conn, reference, chunk, sources)
+        after_id = suspended.drop(conn)
+        for row, source in zip(values, sources):
+            try:
+                conn.execute(insert, row)
+                written.append(row)
+            except sqlite3.IntegrityError as e:
+                rejects.add(source, str(e))
+        suspended.restore(conn, after_id, suspended.low_ids(written, after_id))
+    for source, reason in orphans:
+        rejects.add(source, reason)
+    return len(written)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-import a CSV file into the bookkeeping database.")
+    parser.add_argument("table", choices=sorted(TABLES))
+    parser.add_argument("csv_path")
+    parser.add_argument("--db", default="mybookkeeping.db")
+    parser.add_argument("--rejects", help="where to write rejected rows (default: <csv>.rejects.csv)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    conn = schema.connect(args.db)
+    schema.migrate(conn)
+    resume(conn)
+    result = import_csv(conn, args.table, args.csv_path, args.rejects, args.chunk_rows,
+                        progress=lambda rows: print(f"  {rows} rows read...", end="\r"))
+    print()
+    print(result)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""Bookkeeping queries and invoice logic that do not depend on Tk.
+
+These functions take an open SQLite connection so they can run on a
+background worker as well as from scripts.
+"""
+from datetime import date
+
+from paging import KeysetPager
+from transactions import write_transaction
+
+# Statuses an invoice moves through; open invoices become overdue after their due date
+INVOICE_STATUSES = ("Draft", "Sent", "Paid")
+OPEN_STATUSES = ("Draft", "Sent")
+
+# Date ranges offered by the invoice filter
+PERIODS = ("This month", "Last month", "This quarter", "This year", "Last year")
+
+
+def customer_pager():
+    """Return a KeysetPager over the customer list, as the Customers tab shows it.
+
+    A missing email or contact (NULL) is listed and sorted as empty text,
+    following the expression indexes of schema version 9.
+    """
+    return KeysetPager(
+        "id, name, COALESCE(email, ''), COALESCE(contact, '')", "customers",
+        {
+            'id': (0, 'id'),
+            'name': (1, 'name COLLATE NOCASE'),
+            'email': (2, "COALESCE(email, '') COLLATE NOCASE"),
+            'contact': (3, "COALESCE(contact, '') COLLATE NOCASE"),
+        })
+
+
+# The invoice list's columns; the hidden last three are the customer id,
+# whether the invoice is archived and the customer's name to sort by, which
+# is NULL once the customer has been deleted
+INVOICE_LIST_COLUMNS = ("i.id, COALESCE(c.name, 'Customer #' || i.customer_id), i.invoice_date, i.due_date, "
+                        "i.total_amount, i.status, i.customer_id, {archived}, c.name")
+# Deleting a customer leaves their invoices behind (and undo brings the
+# customer back), so the join keeps invoices without a customer
+INVOICE_LIST_FROM = "{schema}.invoices i LEFT JOIN customers c ON i.customer_id = c.id"
+
+
+def invoice_pager():
+    """Return a KeysetPager over the invoice list, as the Invoices tab shows it.
+
+    Sorting by customer orders by (name, customer id, invoice date) so it
+    can walk idx_customers_name and then idx_invoices_customer_date, with
+    the invoices of deleted customers first. Filters from invoice_filter
+    only use invoice columns, so counts and most pages skip the customer
+    join.
+    """
+    return KeysetPager(
+        INVOICE_LIST_COLUMNS.format(archived=0),
+        INVOICE_LIST_FROM.format(schema="main"),
+        {
+            'id': (0, 'i.id'),
+            'customer': (8, 'c.name COLLATE NOCASE', ['customer_id', 'invoice_date']),
+            'invoice_date': (2, 'i.invoice_date'),
+            'due_date': (3, 'i.due_date'),
+            'total_amount': (4, 'i.total_amount'),
+            # Follows idx_invoices_status_due_date
+            'status': (5, 'i.status', ['due_date']),
+            'customer_id': (6, 'i.customer_id'),
+        },
+        base_from="invoices i", joined_columns=('customer',), nullable_columns=('customer',))
+
+
+def set_invoice_sources(pager, archived):
+    """List only the working invoices, or with `archived` the archive's too (see archive.py).
+
+    The archive's own indexes serve its half of every page, so listing both
+    costs about as much as listing one.
+    """
+    schemas = ["main", "archive"] if archived else ["main"]
+    pager.set_sources([(INVOICE_LIST_COLUMNS.format(archived=int(schema == "archive")),
+                        INVOICE_LIST_FROM.format(schema=schema),
+                        f"{schema}.invoices i") for schema in schemas])
+
+
+def get_tax_rate(conn):
+    """Return the configured tax rate as a fraction (0.2 for 20%)."""
+    return float(conn.execute("SELECT value FROM settings WHERE key = 'tax_rate'").fetchone()[0])
+
+
+def calculate_totals(items, tax_rate):
+    """Return (subtotal, tax_amount, total_amount) for items ending in (..., quantity, unit_price)."""
+    # Line totals are rounded to cents, as they are shown on the invoice
+    subtotal = sum(round(float(quantity) * float(unit_price), 2) for *_, quantity, unit_price in items)
+    tax_amount = subtotal * tax_rate
+    return subtotal, tax_amount, subtotal + tax_amount
+
+
+def save_invoice(conn, invoice_id, customer_id, invoice_date, due_date, items, status="Draft", tax_rate=None,
+                 loaded_items=None):
+    """Insert or update an invoice and its items in one transaction; returns the invoice id.
+
+    `items` are (description, quantity, unit_price) tuples. When editing,
+    they may instead be (item_id, description, quantity, unit_price), with
+    None as the id of new lines, and `loaded_items` maps each item id that
+    was loaded into the editor to its (description, quantity, unit_price).
+    Only the lines that were added, changed or removed are then written.
+    Without `loaded_items` an existing invoice's items are all replaced.
+
+    Pass the `tax_rate` the totals were shown with; it is read from the
+    database only when omitted.
+    """
+    if tax_rate is None:
+        tax_rate = get_tax_rate(conn)
+    _, tax_amount, total_amount = calculate_totals(items, tax_rate)
+    with write_transaction(conn):
+        if invoice_id:
+            # Update existing invoice
+            conn.execute("""
+                UPDATE invoices
+                SET customer_id = ?, invoice_date = ?, due_date = ?, total_amount = ?, tax_amount = ?, status = ?
+                WHERE id = ?
+            """, (customer_id, invoice_date, due_date, total_amount, tax_amount, status, invoice_id))
+            if loaded_items is None:
+                conn.execute("DELETE FROM invoice_items WHERE invoice_id = ?", (invoice_id,))
+        else:
+            # Insert new invoice
+            cursor = conn.execute("""
+                INSERT INTO invoices (customer_id, invoice_date, due_date, total_amount, tax_amount, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (customer_id, invoice_date, due_date, total_amount, tax_amount, status))
+            invoice_id = cursor.lastrowid
+
+        inserts, updates, deletes = diff_items(items, loaded_items or {})
+        if deletes:
+            conn.executemany("DELETE FROM invoice_items WHERE id = ? AND invoice_id = ?",
+                             ((item_id, invoice_id) for item_id in deletes))
+        if updates:
+            conn.executemany("""
+                UPDATE invoice_items SET description = ?, quantity = ?, unit_price = ?
+                WHERE id = ? AND invoice_id = ?
+            """, ((description, quantity, unit_price, item_id, invoice_id)
+                  for item_id, description, quantity, unit_price in updates))
+        if inserts:
+            conn.executemany("""
+                INSERT INTO invoice_items (invoice_id, description, quantity, unit_price)
+                VALUES (?, ?, ?, ?)
+            """, ((invoice_id, description, quantity, unit_price) for description, quantity, unit_price in inserts))
+    return invoice_id
+
+
+def diff_items(items, loaded_items):
+    """Split edited items into (inserts, updates, deletes) against the loaded ones.
+
+    Inserts are (description, quantity, unit_price), updates are
+    (item_id, description, quantity, unit_price) and deletes are item ids.
+    """
+    inserts = []
+    updates = []
+    kept = set()
+    for item in items:
+        item_id = item[0] if len(item) == 4 else None
+        values = tuple(item[-3:])
+        if item_id is None or item_id not in loaded_items:
+            inserts.append(values)
+            continue
+        kept.add(item_id)
+        # Unchanged lines compare equal as they are; no need to convert them
+        if loaded_items[item_id] != values:
+            updates.append((item_id,) + values)
+    deletes = [item_id for item_id in loaded_items if item_id not in kept]
+    return inserts, updates, deletes
+
+
+def _mark_ids(conn, row_ids):
+    """Put ids into temp.bulk_ids, so one statement can act on all of them."""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS bulk_ids (id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.bulk_ids")
+    conn.executemany("INSERT OR IGNORE INTO temp.bulk_ids (id) VALUES (?)", ((row_id,) for row_id in row_ids))
+
+
+def delete_customers(conn, customer_ids):
+    """Delete customers in one transaction; returns their (id, name, email, contact) rows for restore_customers."""
+    with write_transaction(conn):
+        _mark_ids(conn, customer_ids)
+        rows = conn.execute("SELECT id, name, email, contact FROM customers "
+                            "WHERE id IN (SELECT id FROM temp.bulk_ids)").fetchall()
+        conn.execute("DELETE FROM customers WHERE id IN (SELECT id FROM temp.bulk_ids)")
+    return rows
+
+
+def restore_customers(conn, rows):
+    """Put deleted customers back under their old ids."""
+    with write_transaction(conn):
+        conn.executemany("INSERT INTO customers (id, name, email, contact) VALUES (?, ?, ?, ?)", rows)
+
+
+# Every column of the invoice tables, as delete_invoices returns and restore_invoices takes them
+_INVOICE_COLUMNS = "id, customer_id, invoice_date, due_date, total_amount, tax_amount, status"
+_ITEM_COLUMNS = "id, invoice_id, description, quantity, unit_price"
+
+
+def delete_invoices(conn, invoice_ids):
+    """Delete invoices and their items in one transaction; returns (invoices, items) for restore_invoices."""
+    with write_transaction(conn):
+        _mark_ids(conn, invoice_ids)
+        invoices = conn.execute(f"SELECT {_INVOICE_COLUMNS} FROM invoices "
+                                f"WHERE id IN (SELECT id FROM temp.bulk_ids)").fetchall()
+        items = conn.execute(f"SELECT {_ITEM_COLUMNS} FROM invoice_items "
+                             f"WHERE invoice_id IN (SELECT id FROM temp.bulk_ids)").fetchall()
+        conn.execute("DELETE FROM invoice_items WHERE invoice_id IN (SELECT id FROM temp.bulk_ids)")
+        conn.execute("DELETE FROM invoices WHERE id IN (SELECT id FROM temp.bulk_ids)")
+    return invoices, items
+
+
+def restore_invoices(conn, invoices, items):
+    """Put deleted invoices and their items back under their old ids."""
+    with write_transaction(conn):
+        conn.executemany(f"INSERT INTO invoices ({_INVOICE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", invoices)
+        conn.executemany(f"INSERT INTO invoice_items ({_ITEM_COLUMNS}) VALUES (?, ?, ?, ?, ?)", items)
+
+
+def set_invoice_status(conn, invoice_ids, status):
+    """Give invoices a status in one statement; returns the (id, old status) of those that changed."""
+    if status not in INVOICE_STATUSES:
+        raise ValueError(f"Unknown invoice status: {status}")
+    with write_transaction(conn):
+        _mark_ids(conn, invoice_ids)
+        changed = conn.execute("SELECT id, status FROM invoices "
+                               "WHERE id IN (SELECT id FROM temp.bulk_ids) AND status <> ?", (status,)).fetchall()
+        conn.execute("UPDATE invoices SET status = ? WHERE id IN (SELECT id FROM temp.bulk_ids) AND status <> ?",
+                     (status, status))
+    return changed
+
+
+def restore_invoice_statuses(conn, previous):
+    """Undo set_invoice_status with what it returned: one statement per old status."""
+    by_status = {}
+    for invoice_id, status in previous:
+        by_status.setdefault(status, []).append(invoice_id)
+    with write_transaction(conn):
+        for status, invoice_ids in by_status.items():
+            _mark_ids(conn, invoice_ids)
+            conn.execute("UPDATE invoices SET status = ? WHERE id IN (SELECT id FROM temp.bulk_ids)", (status,))
+
+
+def invoice_filter(status=None, overdue=False, date_from=None, date_to=None, customer=None,
+                   min_amount=None, max_amount=None, today=None):
+    """Return a (where, params) pair restricting `invoices i` to the given criteria.
+
+    Dates are ISO strings and bound the invoice date. `customer` is a
+    (where, params) pair over the customers table, as returned by
+    search.customer_filter. An overdue invoice is an open one past its due
+    date, so that filter is a range of idx_invoices_status_due_date for each
+    open status. Raises ValueError for dates that are not YYYY-MM-DD.
+    """
+    conditions = []
+    params = []
+    if status:
+        conditions.append("i.status = ?")
+        params.append(status)
+    if overdue:
+        statuses = (status,) if status else OPEN_STATUSES
+        conditions.append(f"i.status IN ({', '.join('?' * len(statuses))}) AND i.due_date < ?")
+        params.extend(statuses)
+        params.append((today or date.today()).isoformat())
+    if date_from:
+        conditions.append("i.invoice_date >= ?")
+        params.append(date.fromisoformat(date_from).isoformat())
+    if date_to:
+        conditions.append("i.invoice_date <= ?")
+        params.append(date.fromisoformat(date_to).isoformat())
+    if customer:
+        customer_where, customer_params = customer
+        if customer_where:
+            conditions.append(f"i.customer_id IN (SELECT id FROM customers WHERE {customer_where})")
+            params.extend(customer_params)
+    if min_amount is not None:
+        conditions.append("i.total_amount >= ?")
+        params.append(float(min_amount))
+    if max_amount is not None:
+        conditions.append("i.total_amount <= ?")
+        params.append(float(max_amount))
+    return " AND ".join(conditions), tuple(params)
+
+
+def period_dates(period, today=None):
+    """Return the (first, last) ISO dates of one of PERIODS."""
+    today = today or date.today()
+    if period == "This month":
+        first, months = today.replace(day=1), 1
+    elif period == "Last month":
+        first, months = _add_months(today.replace(day=1), -1), 1
+    elif period == "This quarter":
+        first, months = date(today.year, 3 * ((today.month - 1) // 3) + 1, 1), 3
+    elif period == "This year":
+        first, months = date(today.year, 1, 1), 12
+    elif period == "Last year":
+        first, months = date(today.year - 1, 1, 1), 12
+    else:
+        raise ValueError(f"Unknown period: {period}")
+    last = date.fromordinal(_add_months(first, months).toordinal() - 1)
+    return first.isoformat(), last.isoformat()
+
+
+def _add_months(first_of_month, months):
+    month = first_of_month.month - 1 + months
+    return date(first_of_month.year + month // 12, month % 12 + 1, 1)
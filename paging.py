@@ -0,0 +1,258 @@
+"""Keyset pagination over the bookkeeping tables.
+
+The list views never load a whole table. They ask a pager for a window of
+rows next to the rows they already have, so the cost of a page depends on
+the page size and not on how many rows the table holds.
+"""
+import re
+
+# SQLite's NOCASE collation only folds ASCII letters
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+_COLLATE_RE = re.compile(r"\s+COLLATE\s+\w+$", re.IGNORECASE)
+# Ids per query when reading rows by id; each is bound once per source, twice for deferred joins
+ROWS_CHUNK = 200
+
+
+class KeysetPager:
+    """Builds windowed SELECTs ordered by a sort column with the row id as tie-breaker.
+
+    `columns` is the SELECT list; its first column must be the row id.
+    `sort_columns` maps each sortable view column to its position in the
+    SELECT list and the SQL expression to order by (add a COLLATE clause
+    for case-insensitive ordering). An optional third item names further
+    sort columns that break ties before the row id, so the ORDER BY can
+    follow an existing index. Sort key values must not be NULL, except in
+    the sort columns listed in `nullable_columns`, where NULLs come first
+    as SQLite orders them.
+
+    `base_from` names the driving table of a join on its own (such as
+    "invoices i"). Give it when the joins never drop or repeat its rows
+    (LEFT JOINs on a unique key) and filters only use its columns. Counting then skips the joins, and when
+    the sort key is also made of its columns (every sort column not listed
+    in `joined_columns`), a page's ids are picked from the driving table's
+    indexes first and only those rows are joined.
+
+    `set_sources` makes the pager list the rows of several tables as one,
+    such as the same table in the working and the archive database.
+    """
+
+    def __init__(self, columns, from_clause, sort_columns, id_column="id", base_from=None, joined_columns=(),
+                 nullable_columns=()):
+        # (columns, from_clause, base_from) of each table whose rows are listed
+        self.sources = [(columns, from_clause, base_from)]
+        self.joined_columns = set(joined_columns)
+        self.nullable_columns = set(nullable_columns)
+        self.sort_columns = sort_columns
+        self.id_column = id_column
+        self.sort_column = id_column
+        self.descending = False
+        self.where = ""
+        self.params = ()
+
+    def set_sort(self, column, descending=False):
+        """Order the rows by a view column."""
+        if column not in self.sort_columns:
+            raise ValueError(f"Cannot sort by column: {column}")
+        self.sort_column = column
+        self.descending = descending
+
+    def set_sources(self, sources):
+        """List the rows of several (columns, from_clause, base_from) sources together.
+
+        Every source must offer the same columns under the same aliases, so
+        one filter and sort apply to all of them. With more than one, each
+        query becomes a UNION ALL ordered by result column, which SQLite
+        answers by merging the sources' rows in index order instead of
+        sorting them.
+        """
+        self.sources = list(sources)
+
+    def set_filter(self, where="", params=()):
+        """Restrict the rows with a WHERE expression (without the WHERE keyword)."""
+        self.where = where
+        self.params = tuple(params)
+
+    def _key_columns(self):
+        """Names of the columns that make up the keyset, ending with the row id."""
+        if self.sort_column == self.id_column:
+            return [self.id_column]
+        tie_breakers = self.sort_columns[self.sort_column][2:]
+        return [self.sort_column] + list(tie_breakers[0] if tie_breakers else ()) + [self.id_column]
+
+    def key(self, row):
+        """Return the keyset position of a row fetched by this pager."""
+        return tuple(row[self.sort_columns[name][0]] for name in self._key_columns())
+
+    def sort_key(self, row):
+        """Return a Python value that orders rows the way this pager's ORDER BY does.
+
+        Descending order is not applied; compare with the operands swapped.
+        """
+        key = []
+        for name in self._key_columns():
+            index, expr = self.sort_columns[name][:2]
+            value = row[index]
+            if isinstance(value, str) and "NOCASE" in expr.upper():
+                value = value.translate(_ASCII_LOWER)
+            if name in self.nullable_columns:
+                # NULL first, without ever comparing None with a value
+                key.append(value is not None)
+            key.append(value)
+        return tuple(key)
+
+    def comes_before(self, row, other):
+        """Return True if `row` is listed before `other` in view order."""
+        if self.descending:
+            return self.sort_key(other) < self.sort_key(row)
+        return self.sort_key(row) < self.sort_key(other)
+
+    def _key_sql(self):
+        return [self.sort_columns[name][1] for name in self._key_columns()]
+
+    def _order_by(self, reverse=False, positions=None):
+        """The ORDER BY terms: the key expressions, or the given result column numbers of a compound SELECT."""
+        descending = self.descending != reverse
+        direction = " DESC" if descending else ""
+        if positions is None:
+            return ", ".join(expr + direction for expr in self._key_sql())
+        # Result columns keep the collation their expression names
+        collations = [_COLLATE_RE.search(expr) for expr in self._key_sql()]
+        return ", ".join(f"{position}{match.group(0) if match else ''}{direction}"
+                         for position, match in zip(positions, collations))
+
+    def _select(self, conditions, params, reverse, limit, offset=0):
+        clauses = [c for c in (self.where,) + tuple(conditions) if c]
+        where = " WHERE " + " AND ".join(f"({c})" for c in clauses) if clauses else ""
+        params = self.params + tuple(params)
+        id_expr = self.sort_columns[self.id_column][1]
+        # Deferred join: sorting and skipping happen on the driving table's
+        # (often covering) indexes, and only the page's rows are joined
+        deferred = (all(base_from for _, _, base_from in self.sources)
+                    and not self.joined_columns.intersection(self._key_columns()))
+        if len(self.sources) == 1:
+            columns, from_clause, base_from = self.sources[0]
+            order_by = self._order_by(reverse)
+            if deferred:
+                page_ids = f"SELECT {id_expr} FROM {base_from}{where} ORDER BY {order_by} LIMIT ? OFFSET ?"
+                query = f"SELECT {columns} FROM {from_clause} WHERE {id_expr} IN ({page_ids}) ORDER BY {order_by}"
+                return query, params + (limit, offset)
+            query = f"SELECT {columns} FROM {from_clause}{where} ORDER BY {order_by} LIMIT ? OFFSET ?"
+            return query, params + (limit, offset)
+
+        row_order = self._order_by(reverse, [self.sort_columns[name][0] + 1 for name in self._key_columns()])
+        if not deferred:
+            query = " UNION ALL ".join(f"SELECT {columns} FROM {from_clause}{where}"
+                                       for columns, from_clause, _ in self.sources)
+            return f"{query} ORDER BY {row_order} LIMIT ? OFFSET ?", params * len(self.sources) + (limit, offset)
+        # The page's keys from every source's indexes, merged; the id is the last key
+        keys = self._key_sql()
+        key_list = ", ".join(f"{expr} AS k{index}" for index, expr in enumerate(keys))
+        page_keys = " UNION ALL ".join(f"SELECT {key_list} FROM {base_from}{where}" for _, _, base_from in self.sources)
+        page_keys += f" ORDER BY {self._order_by(reverse, range(1, len(keys) + 1))} LIMIT ? OFFSET ?"
+        page_ids = f"SELECT k{len(keys) - 1} FROM ({page_keys})"
+        query = " UNION ALL ".join(f"SELECT {columns} FROM {from_clause} WHERE {id_expr} IN ({page_ids})"
+                                   for columns, from_clause, _ in self.sources)
+        page_params = params * len(self.sources) + (limit, offset)
+        return f"{query} ORDER BY {row_order}", page_params * len(self.sources)
+
+    def _after_condition(self, key, reverse=False):
+        """Condition selecting the rows that come after `key` in view order."""
+        descending = self.descending != reverse
+        operator = "<" if descending else ">"
+        names = self._key_columns()
+        exprs = self._key_sql()
+        # Spelled out rather than as a row value so SQLite can seek the (sort, id)
+        # index: a >= ? AND (a > ? OR (b >= ? AND (b > ? OR ...)))
+        condition = f"{exprs[-1]} {operator} ?"
+        params = (key[-1],)
+        for name, expr, value in zip(reversed(names[:-1]), reversed(exprs[:-1]), reversed(key[:-1])):
+            if value is None:
+                # The later NULLs, then in ascending order every value
+                condition = f"{expr} IS NULL AND ({condition})"
+                if not descending:
+                    condition = f"{expr} IS NOT NULL OR ({condition})"
+                continue
+            condition = f"{expr} {operator}= ? AND ({expr} {operator} ? OR {condition})"
+            params = (value, value) + params
+            if descending and name in self.nullable_columns:
+                condition = f"{expr} IS NULL OR ({condition})"
+        return condition, params
+
+    def count(self, conn):
+        """Return the number of rows matching the current filter."""
+        where = f" WHERE {self.where}" if self.where else ""
+        tables = [base_from or from_clause for _, from_clause, base_from in self.sources]
+        if len(tables) == 1:
+            return conn.execute(f"SELECT COUNT(*) FROM {tables[0]}{where}", self.params).fetchone()[0]
+        counts = " UNION ALL ".join(f"SELECT COUNT(*) AS n FROM {table}{where}" for table in tables)
+        return conn.execute(f"SELECT SUM(n) FROM ({counts})", self.params * len(tables)).fetchone()[0]
+
+    def first(self, conn, limit):
+        """Return the first `limit` rows in view order."""
+        query, params = self._select((), (), False, limit)
+        return conn.execute(query, params).fetchall()
+
+    def last(self, conn, limit):
+        """Return the last `limit` rows in view order."""
+        query, params = self._select((), (), True, limit)
+        rows = conn.execute(query, params).fetchall()
+        rows.reverse()
+        return rows
+
+    def page_after(self, conn, key, limit):
+        """Return up to `limit` rows that follow the row with keyset position `key`."""
+        condition, params = self._after_condition(key)
+        query, params = self._select((condition,), params, False, limit)
+        return conn.execute(query, params).fetchall()
+
+    def page_before(self, conn, key, limit):
+        """Return up to `limit` rows that precede the row with keyset position `key`."""
+        condition, params = self._after_condition(key, reverse=True)
+        query, params = self._select((condition,), params, True, limit)
+        rows = conn.execute(query, params).fetchall()
+        rows.reverse()
+        return rows
+
+    def page_at(self, conn, offset, limit, total):
+        """Return the rows starting at an absolute position.
+
+        Used only when the user jumps (scrollbar drag, Home/End); the index is
+        walked from whichever end of the list is closer to `offset`.
+        """
+        if offset <= 0:
+            return self.first(conn, limit)
+        if offset + limit >= total:
+            return self.last(conn, min(limit, total - offset))
+        if offset < total // 2:
+            query, params = self._select((), (), False, limit, offset)
+            return conn.execute(query, params).fetchall()
+        from_end = total - offset - limit
+        query, params = self._select((), (), True, limit, from_end)
+        rows = conn.execute(query, params).fetchall()
+        rows.reverse()
+        return rows
+
+    def row(self, conn, row_id):
+        """Return a single row by id, or None if it is missing or filtered out."""
+        id_expr = self.sort_columns[self.id_column][1]
+        query, params = self._select((f"{id_expr} = ?",), (row_id,), False, 1)
+        return conn.execute(query, params).fetchone()
+
+    def rows(self, conn, row_ids):
+        """Return the rows with these ids that match the filter, in no particular order."""
+        id_expr = self.sort_columns[self.id_column][1]
+        row_ids = list(row_ids)
+        rows = []
+        for offset in range(0, len(row_ids), ROWS_CHUNK):
+            chunk = row_ids[offset:offset + ROWS_CHUNK]
+            query, params = self._select((f"{id_expr} IN ({', '.join('?' * len(chunk))})",), chunk, False, len(chunk))
+            rows += conn.execute(query, params).fetchall()
+        return rows
+
+    def ids(self, conn):
+        """Return the ids of every row matching the filter, such as for selecting them all."""
+        where = f" WHERE {self.where}" if self.where else ""
+        id_expr = self.sort_columns[self.id_column][1]
+        tables = [base_from or from_clause for _, from_clause, base_from in self.sources]
+        query = " UNION ALL ".join(f"SELECT {id_expr} FROM {table}{where}" for table in tables)
+        return [row[0] for row in conn.execute(query, self.params * len(tables))]
@@ -0,0 +1,363 @@
+"""Accounts-receivable aging, revenue by month and top customers.
+
+The reports read small summary tables rather than `invoices`:
+
+    monthly_totals    count, total and tax per (invoice month, status)
+    open_due_totals   count and total of open invoices per (due date, status)
+    customer_totals   count and per-status totals per customer
+
+Triggers on `invoices` add each inserted row to the summaries and take
+each deleted row out again (an update does both), so the tables are always
+current and a report touches at most a few thousand rows however long the
+ledger is. Amounts are kept in integer cents so that adding and removing
+an invoice cancels exactly. Invoices moved to the archive (see
+archive.py) stay counted, so the reports cover the whole history.
+`rebuild` recomputes everything from `invoices` and the archive, and
+`verify` compares the two.
+
+    python reports.py aging
+    python reports.py revenue --from 2024-01 --to 2024-12
+    python reports.py top --limit 20
+    python reports.py verify
+"""
+import argparse
+import sys
+from datetime import date, timedelta
+
+import archive
+import schema
+from ledger import OPEN_STATUSES
+from transactions import begin_immediate, write_transaction
+
+SUMMARY_TABLES = ("monthly_totals", "open_due_totals", "customer_totals")
+SUMMARY_TRIGGERS = ("invoices_summary_insert", "invoices_summary_delete", "invoices_summary_update")
+
+# Unpaid invoices count towards receivables once they have been sent
+RECEIVABLE_STATUSES = ("Sent",)
+# Invoices that count as revenue: drafts haven't been issued yet
+REVENUE_STATUSES = ("Sent", "Paid")
+# (label, days overdue up to and including); None is open-ended
+AGING_BUCKETS = (
+    ("Current", 0),
+    ("1-30 days", 30),
+    ("31-60 days", 60),
+    ("61-90 days", 90),
+    ("Over 90 days", None),
+)
+TOP_CUSTOMERS = 10
+REBUILD_THREADS = 4
+
+
+def _cents(expression):
+    return f"CAST(round(COALESCE({expression}, 0) * 100) AS INTEGER)"
+
+
+def _in(values):
+    """An SQL list literal of trusted constants, for trigger bodies that can't take parameters."""
+    return "(" + ", ".join("'" + value.replace("'", "''") + "'" for value in values) + ")"
+
+
+def _status_cents(row, status, total):
+    return f"CASE {row}.status WHEN '{status}' THEN {total} ELSE 0 END"
+
+
+def create_summary_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_totals (
+            month TEXT NOT NULL,
+            status TEXT NOT NULL,
+            invoice_count INTEGER NOT NULL,
+            total_cents INTEGER NOT NULL,
+            tax_cents INTEGER NOT NULL,
+            PRIMARY KEY (month, status)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS open_due_totals (
+            due_date TEXT NOT NULL,
+            status TEXT NOT NULL,
+            invoice_count INTEGER NOT NULL,
+            total_cents INTEGER NOT NULL,
+            PRIMARY KEY (due_date, status)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS customer_totals (
+            customer_id INTEGER PRIMARY KEY,
+            invoice_count INTEGER NOT NULL,
+            draft_cents INTEGER NOT NULL,
+            sent_cents INTEGER NOT NULL,
+            paid_cents INTEGER NOT NULL
+        )
+    ''')
+    # Top customers walk one of these instead of sorting every customer
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_customer_totals_invoiced "
+                 "ON customer_totals (sent_cents + paid_cents)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_customer_totals_outstanding ON customer_totals (sent_cents)")
+
+
+def _summary_statements(row, sign):
+    """SQL adding invoice `row` ('new' or 'old') to the summaries, or removing it if `sign` is -1."""
+    total = f"{sign} * {_cents(row + '.total_amount')}"
+    tax = f"{sign} * {_cents(row + '.tax_amount')}"
+    statements = [
+        f"""INSERT INTO monthly_totals (month, status, invoice_count, total_cents, tax_cents)
+            VALUES (substr({row}.invoice_date, 1, 7), {row}.status, {sign}, {total}, {tax})
+            ON CONFLICT (month, status) DO UPDATE SET
+                invoice_count = invoice_count + excluded.invoice_count,
+                total_cents = total_cents + excluded.total_cents,
+                tax_cents = tax_cents + excluded.tax_cents""",
+        # An upsert from a SELECT needs a WHERE clause, which here also skips closed invoices
+        f"""INSERT INTO open_due_totals (due_date, status, invoice_count, total_cents)
+            SELECT {row}.due_date, {row}.status, {sign}, {total}
+            WHERE {row}.status IN {_in(OPEN_STATUSES)}
+            ON CONFLICT (due_date, status) DO UPDATE SET
+                invoice_count = invoice_count + excluded.invoice_count,
+                total_cents = total_cents + excluded.total_cents""",
+        f"""INSERT INTO customer_totals (customer_id, invoice_count, draft_cents, sent_cents, paid_cents)
+            VALUES ({row}.customer_id, {sign}, {_status_cents(row, 'Draft', total)},
+                    {_status_cents(row, 'Sent', total)}, {_status_cents(row, 'Paid', total)})
+            ON CONFLICT (customer_id) DO UPDATE SET
+                invoice_count = invoice_count + excluded.invoice_count,
+                draft_cents = draft_cents + excluded.draft_cents,
+                sent_cents = sent_cents + excluded.sent_cents,
+                paid_cents = paid_cents + excluded.paid_cents""",
+    ]
+    if sign < 0:
+        # Don't leave empty rows behind for reports to skip over
+        statements += [
+            f"""DELETE FROM monthly_totals WHERE month = substr({row}.invoice_date, 1, 7)
+                AND status = {row}.status AND invoice_count = 0""",
+            f"""DELETE FROM open_due_totals WHERE due_date = {row}.due_date
+                AND status = {row}.status AND invoice_count = 0""",
+            f"DELETE FROM customer_totals WHERE customer_id = {row}.customer_id AND invoice_count = 0",
+        ]
+    return ";\n".join(statements) + ";"
+
+
+def create_summary_triggers(conn):
+    """Create the triggers that keep the summary tables in step with `invoices`."""
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS invoices_summary_insert AFTER INSERT ON invoices BEGIN
+            {_summary_statements('new', 1)}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS invoices_summary_delete AFTER DELETE ON invoices BEGIN
+            {_summary_statements('old', -1)}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS invoices_summary_update
+        AFTER UPDATE OF customer_id, invoice_date, due_date, total_amount, tax_amount, status ON invoices BEGIN
+            {_summary_statements('old', -1)}
+            {_summary_statements('new', 1)}
+        END
+    """)
+
+
+def drop_summary_triggers(conn):
+    for name in SUMMARY_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def has_summary_tables(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'customer_totals'").fetchone() is not None
+
+
+def _aggregate_statements(where, table="invoices"):
+    """SQL adding the invoices in `table` matching `where` to the summaries in one pass per table.
+
+    Reading the whole table and sorting beats following idx_invoices_customer_date
+    to each row, hence NOT INDEXED; id ranges still use the primary key.
+    """
+    total = _cents("total_amount")
+    tax = _cents("tax_amount")
+
+    def status_sum(status):
+        return f"SUM(CASE status WHEN '{status}' THEN {total} ELSE 0 END)"
+
+    return [
+        f"""INSERT INTO monthly_totals (month, status, invoice_count, total_cents, tax_cents)
+            SELECT substr(invoice_date, 1, 7), status, COUNT(*), SUM({total}), SUM({tax})
+            FROM {table} WHERE {where} GROUP BY 1, 2
+            ON CONFLICT (month, status) DO UPDATE SET
+                invoice_count = invoice_count + excluded.invoice_count,
+                total_cents = total_cents + excluded.total_cents,
+                tax_cents = tax_cents + excluded.tax_cents""",
+        f"""INSERT INTO open_due_totals (due_date, status, invoice_count, total_cents)
+            SELECT due_date, status, COUNT(*), SUM({total})
+            FROM {table} WHERE ({where}) AND status IN {_in(OPEN_STATUSES)} GROUP BY 1, 2
+            ON CONFLICT (due_date, status) DO UPDATE SET
+                invoice_count = invoice_count + excluded.invoice_count,
+                total_cents = total_cents + excluded.total_cents""",
+        f"""INSERT INTO customer_totals (customer_id, invoice_count, draft_cents, sent_cents, paid_cents)
+            SELECT customer_id, COUNT(*), {status_sum('Draft')}, {status_sum('Sent')}, {status_sum('Paid')}
+            FROM {table} NOT INDEXED WHERE {where} GROUP BY 1
+            ON CONFLICT (customer_id) DO UPDATE SET
+                invoice_count = invoice_count + excluded.invoice_count,
+                draft_cents = draft_cents + excluded.draft_cents,
+                sent_cents = sent_cents + excluded.sent_cents,
+                paid_cents = paid_cents + excluded.paid_cents""",
+    ]
+
+
+def _rebuild(conn):
+    for table in SUMMARY_TABLES:
+        conn.execute(f"DELETE FROM {table}")
+    # The GROUP BY sorts dominate on a large ledger; let SQLite spread them over helper threads
+    threads = conn.execute("PRAGMA threads").fetchone()[0]
+    conn.execute(f"PRAGMA threads = {REBUILD_THREADS}")
+    try:
+        for sql in _aggregate_statements("1"):
+            conn.execute(sql)
+        if archive.is_attached(conn):
+            for sql in _aggregate_statements("1", f"{archive.SCHEMA}.invoices"):
+                conn.execute(sql)
+    finally:
+        conn.execute(f"PRAGMA threads = {threads}")
+
+
+def rebuild(conn):
+    """Recompute every summary table from `invoices` and the archive in one transaction."""
+    with write_transaction(conn):
+        _rebuild(conn)
+
+
+def add_invoices(conn, after_id, extra_ids=()):
+    """Add invoices inserted while the summary triggers were suspended.
+
+    Covers every id above `after_id` plus any explicitly listed ids, with
+    one grouped INSERT ... SELECT per table instead of a trigger per row.
+    """
+    for sql in _aggregate_statements("id > ?"):
+        conn.execute(sql, (after_id,))
+    for invoice_id in extra_ids:
+        for sql in _aggregate_statements("id = ?"):
+            conn.execute(sql, (invoice_id,))
+
+
+def verify(conn):
+    """Compare the summaries with a fresh aggregation; returns a list of differences (empty if they match)."""
+    differences = []
+    # The rebuild is rolled back, but it still needs the write lock from the start
+    started = not conn.in_transaction
+    if started:
+        begin_immediate(conn)
+    conn.execute("SAVEPOINT verify_summaries")
+    try:
+        maintained = {table: set(conn.execute(f"SELECT * FROM {table}")) for table in SUMMARY_TABLES}
+        _rebuild(conn)
+        for table in SUMMARY_TABLES:
+            expected = set(conn.execute(f"SELECT * FROM {table}"))
+            for row in sorted(maintained[table] - expected, key=str):
+                differences.append(f"{table}: unexpected {row}")
+            for row in sorted(expected - maintained[table], key=str):
+                differences.append(f"{table}: missing {row}")
+    finally:
+        conn.execute("ROLLBACK TO verify_summaries")
+        conn.execute("RELEASE verify_summaries")
+        if started:
+            conn.rollback()
+    return differences
+
+
+# --- Reports ---
+
+def aging(conn, today=None, statuses=RECEIVABLE_STATUSES):
+    """Open invoices by how long they are overdue: [(label, invoice count, amount)] per AGING_BUCKETS."""
+    today = today or date.today()
+    cases = []
+    params = []
+    for index, (_, days) in enumerate(AGING_BUCKETS):
+        if days is None:
+            cases.append(f"ELSE {index}")
+        else:
+            cases.append(f"WHEN due_date >= ? THEN {index}")
+            params.append((today - timedelta(days=days)).isoformat())
+    totals = {index: (0, 0) for index in range(len(AGING_BUCKETS))}
+    rows = conn.execute(f"""
+        SELECT CASE {' '.join(cases)} END AS bucket, SUM(invoice_count), SUM(total_cents)
+        FROM open_due_totals WHERE status IN ({', '.join('?' * len(statuses))})
+        GROUP BY bucket
+    """, params + list(statuses))
+    for bucket, count, cents in rows:
+        totals[bucket] = (count, cents)
+    return [(label, totals[index][0], totals[index][1] / 100) for index, (label, _) in enumerate(AGING_BUCKETS)]
+
+
+def revenue_by_month(conn, month_from=None, month_to=None, statuses=REVENUE_STATUSES):
+    """[(month, invoice count, net, tax, total)] for YYYY-MM months in the range, oldest first."""
+    where = [f"status IN ({', '.join('?' * len(statuses))})"]
+    params = list(statuses)
+    if month_from:
+        where.append("month >= ?")
+        params.append(month_from)
+    if month_to:
+        where.append("month <= ?")
+        params.append(month_to)
+    rows = conn.execute(f"""
+        SELECT month, SUM(invoice_count), SUM(total_cents) - SUM(tax_cents), SUM(tax_cents), SUM(total_cents)
+        FROM monthly_totals WHERE {' AND '.join(where)}
+        GROUP BY month ORDER BY month
+    """, params)
+    return [(month, count, net / 100, tax / 100, total / 100) for month, count, net, tax, total in rows]
+
+
+def top_customers(conn, limit=TOP_CUSTOMERS, by="invoiced"):
+    """[(customer id, name, invoice count, invoiced, outstanding)] for the biggest customers.
+
+    `by` is "invoiced" (sent and paid) or "outstanding" (sent, not yet paid).
+    """
+    # These match the indexes on customer_totals exactly, so no sort is needed
+    order = {"invoiced": "t.sent_cents + t.paid_cents", "outstanding": "t.sent_cents"}[by]
+    rows = conn.execute(f"""
+        SELECT t.customer_id, c.name, t.invoice_count, t.sent_cents + t.paid_cents, t.sent_cents
+        FROM customer_totals t LEFT JOIN customers c ON c.id = t.customer_id
+        ORDER BY {order} DESC LIMIT ?
+    """, (limit,))
+    return [(customer_id, name, count, invoiced / 100, outstanding / 100)
+            for customer_id, name, count, invoiced, outstanding in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print a report, or rebuild or verify the summary tables.")
+    parser.add_argument("command", choices=("aging", "revenue", "top", "rebuild", "verify"))
+    parser.add_argument("--db", default="mybookkeeping.db")
+    parser.add_argument("--from", dest="month_from", help="first month of the revenue report (YYYY-MM)")
+    parser.add_argument("--to", dest="month_to", help="last month of the revenue report (YYYY-MM)")
+    parser.add_argument("--limit", type=int, default=TOP_CUSTOMERS, help="number of top customers")
+    parser.add_argument("--by", choices=("invoiced", "outstanding"), default="invoiced")
+    args = parser.parse_args()
+
+    conn = schema.connect(args.db)
+    schema.migrate(conn)
+    if args.command == "aging":
+        for label, count, amount in aging(conn):
+            print(f"{label:<14} {count:>8} {amount:>16,.2f}")
+    elif args.command == "revenue":
+        print(f"{'Month':<8} {'Invoices':>8} {'Net':>16} {'Tax':>14} {'Total':>16}")
+        for month, count, net, tax, total in revenue_by_month(conn, args.month_from, args.month_to):
+            print(f"{month:<8} {count:>8} {net:>16,.2f} {tax:>14,.2f} {total:>16,.2f}")
+    elif args.command == "top":
+        for customer_id, name, count, invoiced, outstanding in top_customers(conn, args.limit, args.by):
+            print(f"{customer_id:>8} {name or '(deleted)':<30} {count:>6} {invoiced:>16,.2f} {outstanding:>14,.2f}")
+    elif args.command == "rebuild":
+        rebuild(conn)
+        print("Summary tables rebuilt.")
+    else:
+        differences = verify(conn)
+        for line in differences[:50]:
+            print(line)
+        if len(differences) > 50:
+            print(f"... and {len(differences) - 50} more")
+        print("Summary tables match the invoices." if not differences
+              else f"{len(differences)} differences; run 'rebuild' to fix them.")
+        conn.close()
+        sys.exit(1 if differences else 0)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
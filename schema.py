@@ -0,0 +1,206 @@
+"""Database connections and versioned schema migrations.
+
+Every connection the app opens goes through `connect`, which applies the
+per-connection performance pragmas and attaches the invoice archive. `migrate` brings a database up to the
+latest schema version by applying, in order, each migration it has not
+seen yet. Each migration runs in its own transaction and is recorded in
+the `schema_version` table.
+"""
+import sqlite3
+from datetime import datetime
+
+import archive
+import billing
+import changelog
+import reports
+from search import ensure_customer_index
+from transactions import BUSY_TIMEOUT_S, begin_immediate
+
+# Page cache per connection, in KiB (negative values are KiB for PRAGMA cache_size)
+CACHE_SIZE_KIB = 64 * 1024
+# Let SQLite memory-map this much of the database file
+MMAP_SIZE = 256 * 1024 * 1024
+
+
+def database_path(conn):
+    """The file behind a connection's main database."""
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == "main":
+            return path
+
+
+def connect(path, **kwargs):
+    """Open a connection with the app's pragmas applied."""
+    # Wait this long for another instance's lock rather than failing at once
+    kwargs.setdefault("timeout", BUSY_TIMEOUT_S)
+    conn = sqlite3.connect(path, **kwargs)
+    # WAL lets readers and a writer work at the same time; it is stored in the file
+    conn.execute("PRAGMA journal_mode = WAL")
+    # In WAL mode NORMAL is still safe against corruption and avoids an fsync per commit
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    # Archived invoices, if any have been moved out of this ledger (see archive.py)
+    archive.attach(conn)
+    return conn
+
+
+def _create_base_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS customers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT,
+            contact TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS invoices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id INTEGER NOT NULL,
+            invoice_date TEXT NOT NULL,
+            due_date TEXT NOT NULL,
+            total_amount REAL NOT NULL,
+            tax_amount REAL NOT NULL,
+            status TEXT NOT NULL,
+            FOREIGN KEY (customer_id) REFERENCES customers (id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS invoice_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            invoice_id INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            quantity REAL NOT NULL,
+            unit_price REAL NOT NULL,
+            FOREIGN KEY (invoice_id) REFERENCES invoices (id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+    # Add default tax rate if not present
+    conn.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('tax_rate', '0.2')")
+
+
+def _create_customer_search(conn):
+    # Without FTS5 the migration is still recorded and searches fall back to LIKE
+    ensure_customer_index(conn)
+
+
+def _create_invoice_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_customer_id ON invoices (customer_id)")
+    # Status leads so "overdue" (status = ? AND due_date < ?) is a single index range
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_status_due_date ON invoices (status, due_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_due_date ON invoices (due_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoice_items_invoice_id ON invoice_items (invoice_id)")
+    conn.execute("ANALYZE")
+
+
+def _create_sort_indexes(conn):
+    # The list views sort in SQL with the row id as tie-breaker, which every
+    # index already ends with. Text columns sort case-insensitively.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_customers_name ON customers (name COLLATE NOCASE)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_customers_email ON customers (email COLLATE NOCASE)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_customers_contact ON customers (contact COLLATE NOCASE)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_invoice_date ON invoices (invoice_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_total_amount ON invoices (total_amount)")
+    # Due date and status sorts use the indexes from version 3, and sorting by
+    # customer walks idx_customers_name and then the invoices' customer index
+    conn.execute("ANALYZE")
+
+
+def _create_invoice_filter_indexes(conn):
+    # One customer's invoices in date order, which also serves every lookup the
+    # single-column customer_id index did
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_customer_date ON invoices (customer_id, invoice_date)")
+    conn.execute("DROP INDEX IF EXISTS idx_invoices_customer_id")
+    conn.execute("ANALYZE")
+
+
+def _create_report_summaries(conn):
+    reports.create_summary_tables(conn)
+    reports.create_summary_triggers(conn)
+    # Joins the migration's transaction (see write_transaction)
+    reports.rebuild(conn)
+
+
+def _create_change_log(conn):
+    # Rows that exist already are not logged; a consumer's first export is a full one
+    changelog.create_tables(conn)
+    changelog.create_triggers(conn)
+
+
+def _create_recurring_invoices(conn):
+    billing.create_tables(conn)
+
+
+def _index_missing_contacts_as_empty(conn):
+    # Email and contact may be NULL in older or hand-edited databases. The
+    # customer list sorts them as empty text, which the keyset needs (NULL
+    # never compares greater or less), so the indexes hold that expression.
+    conn.execute("DROP INDEX IF EXISTS idx_customers_email")
+    conn.execute("DROP INDEX IF EXISTS idx_customers_contact")
+    conn.execute("CREATE INDEX idx_customers_email ON customers (COALESCE(email, '') COLLATE NOCASE)")
+    conn.execute("CREATE INDEX idx_customers_contact ON customers (COALESCE(contact, '') COLLATE NOCASE)")
+    conn.execute("ANALYZE customers")
+
+
+# (version, description, function) in the order they must be applied. Never
+# edit a migration that has shipped; add a new one instead.
+MIGRATIONS = [
+    (1, "Base tables and default settings", _create_base_tables),
+    (2, "Customer full-text search index", _create_customer_search),
+    (3, "Indexes for invoice and invoice item lookups", _create_invoice_indexes),
+    (4, "Indexes for sorting the customer and invoice lists", _create_sort_indexes),
+    (5, "Customer and invoice date index for invoice filters", _create_invoice_filter_indexes),
+    (6, "Summary tables for the reports", _create_report_summaries),
+    (7, "Change log for incremental exports", _create_change_log),
+    (8, "Recurring invoice templates and billing runs", _create_recurring_invoices),
+    (9, "Customer email and contact sort indexes that read NULL as empty", _index_missing_contacts_as_empty),
+]
+
+
+def schema_version(conn):
+    """Return the highest migration version applied to the database (0 if none)."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    ''')
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(conn, target=None):
+    """Apply every pending migration up to `target` (default: all); returns the versions applied."""
+    if conn.in_transaction:
+        conn.commit()
+    applied = []
+    for version, description, apply in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        if version <= schema_version(conn):
+            continue
+        # IMMEDIATE takes the write lock up front, so two instances starting
+        # together can't both apply the same migration
+        begin_immediate(conn)
+        try:
+            if version <= schema_version(conn):
+                conn.rollback()
+                continue
+            apply(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.now().isoformat(timespec="seconds")))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
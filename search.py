@@ -0,0 +1,161 @@
+"""Full-text customer search backed by an SQLite FTS5 index.
+
+`customers_fts` is an external-content FTS5 table over the name, email and
+contact columns of `customers`. Triggers keep it in step with every insert,
+update and delete, so searches never have to scan the customers table.
+"""
+import re
+import sqlite3
+
+FTS_TABLE = "customers_fts"
+# Customers offered by a picker at a time
+MATCH_LIMIT = 20
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def ensure_customer_index(conn):
+    """Create the customer FTS index and its triggers, backfilling existing rows.
+
+    Returns False if this SQLite build has no FTS5 support, in which case
+    searches fall back to LIKE.
+    """
+    exists = has_customer_index(conn)
+    try:
+        conn.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+                name, email, contact,
+                content='customers', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3'
+            )
+        """)
+    except sqlite3.OperationalError:
+        return False
+
+    create_customer_triggers(conn)
+
+    if not exists:
+        # Index the customers that were added before the index existed
+        conn.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
+    return True
+
+
+def create_customer_triggers(conn):
+    """Create the triggers that keep the FTS index in step with `customers`."""
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS customers_fts_insert AFTER INSERT ON customers BEGIN
+            INSERT INTO {FTS_TABLE} (rowid, name, email, contact)
+            VALUES (new.id, new.name, new.email, new.contact);
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS customers_fts_delete AFTER DELETE ON customers BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, name, email, contact)
+            VALUES ('delete', old.id, old.name, old.email, old.contact);
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS customers_fts_update AFTER UPDATE ON customers BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, name, email, contact)
+            VALUES ('delete', old.id, old.name, old.email, old.contact);
+            INSERT INTO {FTS_TABLE} (rowid, name, email, contact)
+            VALUES (new.id, new.name, new.email, new.contact);
+        END
+    """)
+
+
+def index_new_customers(conn, after_id, extra_ids=()):
+    """Index customers added while the insert trigger was suspended.
+
+    Covers every id above `after_id` plus any explicitly listed ids; one
+    INSERT ... SELECT is far cheaper than a trigger firing per row.
+    """
+    conn.execute(f"""
+        INSERT INTO {FTS_TABLE} (rowid, name, email, contact)
+        SELECT id, name, email, contact FROM customers WHERE id > ?
+    """, (after_id,))
+    conn.executemany(f"""
+        INSERT INTO {FTS_TABLE} (rowid, name, email, contact)
+        SELECT id, name, email, contact FROM customers WHERE id = ?
+    """, ((row_id,) for row_id in extra_ids))
+
+
+def has_customer_index(conn):
+    """Return True if the database has the customer FTS index."""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+    ).fetchone() is not None
+
+
+def match_expression(search_term):
+    """Turn what the user typed into an FTS5 query.
+
+    Every word must match the start of a word in the name, email or contact,
+    so "jo smi" finds "John Smith" and "smith.jo@example.com".
+    """
+    tokens = _TOKEN_RE.findall(search_term)
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+def customer_filter(search_term, fts_enabled=True):
+    """Return a (where, params) pair restricting `customers` to the search term."""
+    if fts_enabled:
+        expression = match_expression(search_term)
+        if not expression:
+            return "", ()
+        return f"id IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ?)", (expression,)
+
+    pattern = '%' + search_term + '%'
+    return "name LIKE ? OR email LIKE ? OR contact LIKE ?", (pattern, pattern, pattern)
+
+
+def find_customers(conn, search_term, limit=MATCH_LIMIT, fts_enabled=True):
+    """Return up to `limit` (id, name, email) rows for a customer picker.
+
+    Customers whose name starts with the term come first, in name order,
+    straight from the name index. The rest are customers with a word that
+    starts with each typed word, from the FTS index, also in name order.
+    An all-digit term also finds the customer with that id. No query reads
+    more than `limit` rows, so the time taken doesn't grow with the number
+    of customers.
+    """
+    term = search_term.strip()
+    if not term:
+        return []
+    rows = []
+    if term.isdigit():
+        rows += conn.execute("SELECT id, name, email FROM customers WHERE id = ?", (int(term),)).fetchall()
+    # A range on the NOCASE name index; U+10FFFF sorts after anything that can follow the prefix
+    rows += conn.execute("""
+        SELECT id, name, email FROM customers
+        WHERE name >= ? COLLATE NOCASE AND name < ? COLLATE NOCASE
+        ORDER BY name COLLATE NOCASE LIMIT ?
+    """, (term, term + "\U0010ffff", limit)).fetchall()
+    if len(rows) < limit:
+        rows += sorted(_word_matches(conn, term, limit, fts_enabled), key=lambda row: row[1].casefold())
+
+    seen = set()
+    matches = []
+    for row in rows:
+        if row[0] not in seen:
+            seen.add(row[0])
+            matches.append(row)
+    return matches[:limit]
+
+
+def _word_matches(conn, term, limit, fts_enabled):
+    if not fts_enabled:
+        pattern = '%' + term + '%'
+        return conn.execute("SELECT id, name, email FROM customers WHERE name LIKE ? OR email LIKE ? "
+                            "OR contact LIKE ? LIMIT ?", (pattern, pattern, pattern, limit)).fetchall()
+    expression = match_expression(term)
+    # Single letters aren't in the prefix index and would match most customers
+    if not expression or all(len(token) < 2 for token in _TOKEN_RE.findall(term)):
+        return []
+    # The LIMIT stays inside the FTS query so only `limit` matches are ever read
+    return conn.execute(f"""
+        SELECT c.id, c.name, c.email
+        FROM (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ? LIMIT ?) AS m
+        JOIN customers c ON c.id = m.rowid
+    """, (expression, limit)).fetchall()
@@ -0,0 +1,96 @@
+"""In-memory, typed view of the `settings` table.
+
+The table is read once and reads are served from memory. Writes go
+straight through to the database. Other connections, such as another
+instance of the app or one of our own background workers, are noticed
+through `PRAGMA data_version`. That pragma only reads a counter in the
+connection's shared state, so `refresh` can be called often at almost
+no cost, and the table itself is re-read only after someone else has
+committed a change.
+"""
+from transactions import write_transaction
+
+# Known settings and how their stored text is converted; others stay text
+TYPES = {
+    "tax_rate": float,
+    "slow_query_ms": float,
+    "backup_interval_hours": float,
+    "backup_keep": int,
+    "backup_compress": int,
+    "last_backup_at": float,
+}
+
+
+class Settings:
+    """Cached application settings with change notification.
+
+    Listeners registered with `subscribe` are called as
+    `listener(key, value)` whenever a value changes, whether through `set`
+    or in another process.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._values = {}
+        self._listeners = []
+        self._data_version = None
+        self.reload()
+
+    def get(self, key, default=None):
+        """Return a setting from memory, converted to its type."""
+        return self._values.get(key, default)
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def set(self, key, value):
+        """Store a setting in the database and notify listeners if it changed."""
+        with write_transaction(self.conn):
+            self.conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, str(value)))
+        self._update({key: _convert(key, str(value))})
+
+    def subscribe(self, listener):
+        """Call `listener(key, value)` after each setting change."""
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def refresh(self):
+        """Re-read the settings if another connection has committed since the last read.
+
+        Returns True if anything was re-read.
+        """
+        if self._current_data_version() == self._data_version:
+            return False
+        self.reload()
+        return True
+
+    def reload(self):
+        """Re-read every setting, notifying listeners of the ones that changed."""
+        # Taken before the read, so a commit in between is picked up next time
+        self._data_version = self._current_data_version()
+        values = {}
+        for key, value in self.conn.execute("SELECT key, value FROM settings"):
+            try:
+                values[key] = _convert(key, value)
+            except ValueError:
+                # Keep the last good value rather than hand out the wrong type
+                print(f"Warning: Ignoring invalid value for setting '{key}': {value!r}")
+        self._update(values)
+
+    def _current_data_version(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _update(self, values):
+        changed = [(key, value) for key, value in values.items() if self._values.get(key) != value]
+        self._values.update(values)
+        for key, value in changed:
+            for listener in list(self._listeners):
+                listener(key, value)
+
+
+def _convert(key, value):
+    convert = TYPES.get(key)
+    return value if convert is None else convert(value)
@@ -0,0 +1,64 @@
+"""Write transactions that hold up when several instances share one database.
+
+Every connection from schema.connect waits up to BUSY_TIMEOUT_S for
+another writer's lock. Waiting alone is not enough: a transaction that
+reads before it writes (SQLite starts them deferred) is refused at once
+with "database is locked" if another connection committed since its
+read began, because in WAL mode waiting cannot bring its snapshot up to
+date. So every write starts with BEGIN IMMEDIATE, which takes the write
+lock before anything is read. After that the transaction cannot be
+refused, and only the BEGIN itself needs to wait. A BEGIN that is still
+locked out after the busy timeout is retried a few times with randomised
+backoff before the error reaches the user.
+
+    with write_transaction(conn):
+        conn.execute("UPDATE ...")
+"""
+import random
+import sqlite3
+import time
+from contextlib import contextmanager
+
+# How long a statement waits for another connection's lock
+BUSY_TIMEOUT_S = 2.0
+# Tries at BEGIN IMMEDIATE (each waiting up to the busy timeout) before giving up
+BEGIN_ATTEMPTS = 3
+# First backoff between tries; doubled each time and randomised so waiting writers spread out
+BACKOFF_S = 0.05
+
+
+def is_locked(error):
+    """Whether an error means another connection held a lock for too long."""
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
+
+def begin_immediate(conn, attempts=BEGIN_ATTEMPTS):
+    """Start a transaction holding the write lock, retrying while other writers keep it."""
+    for attempt in range(attempts):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            return
+        except sqlite3.OperationalError as e:
+            if not is_locked(e) or attempt == attempts - 1:
+                raise
+            time.sleep(BACKOFF_S * 2 ** attempt * (0.5 + random.random()))
+
+
+@contextmanager
+def write_transaction(conn, attempts=BEGIN_ATTEMPTS):
+    """Run the block in an IMMEDIATE transaction, committed on success and rolled back on error.
+
+    Inside a transaction that is already open (e.g. a migration), the block
+    simply joins it and the outer transaction commits.
+    """
+    if conn.in_transaction:
+        yield conn
+        return
+    begin_immediate(conn, attempts)
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
@@ -0,0 +1,432 @@
+"""A virtual-scrolling controller for database-backed Treeviews.
+
+The Treeview only ever holds the rows that fit on screen. The scrollbar is
+driven by the total row count, and rows are read through a KeysetPager as
+the user scrolls, with a small prefetch buffer on either side. All reads
+run on a QueryExecutor, so scrolling never waits on the database.
+"""
+import copy
+import tkinter as tk
+from tkinter import ttk
+
+PREFETCH_ROWS = 64
+DEFAULT_ROW_HEIGHT = 20
+# Event state bits of Shift and Control (Command on macOS), which extend a selection
+_EXTEND_SELECTION = 0x0001 | 0x0004 | 0x0008
+
+
+class VirtualTreeview:
+    """Keeps a Treeview filled with the visible window of a KeysetPager's rows."""
+
+    def __init__(self, tree, scrollbar, pager, executor, prefetch=PREFETCH_ROWS):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.pager = pager
+        self.executor = executor
+        self.prefetch = prefetch
+
+        self.total = 0
+        self.top = 0
+        self.visible = 1
+        self._cache_start = 0
+        self._cache = []
+        self._items = []
+        self._item_by_id = {}
+        self._selected_ids = set()
+        self._focus_row = None
+        self._pending_focus = None
+
+        # Every cache change bumps the generation so late results can be recognised
+        self._generation = 0
+        self._reload_generation = 0
+        self._reloading = False
+        self._pending_changes = 0
+        self._on_loaded = None
+        self._channel = f"virtual-tree-{tree}"
+
+        self.tree.configure(yscrollcommand="")
+        self.scrollbar.configure(command=self.yview)
+
+        self.tree.bind("<Configure>", self._on_resize, add="+")
+        self.tree.bind("<<TreeviewSelect>>", self._on_select, add="+")
+        self.tree.bind("<ButtonPress-1>", self._on_click, add="+")
+        self.tree.bind("<Control-a>", self._on_select_all)
+        self.tree.bind("<Control-A>", self._on_select_all)
+        self.tree.bind("<MouseWheel>", self._on_mousewheel)
+        self.tree.bind("<Button-4>", lambda e: self._scroll_units(-3))
+        self.tree.bind("<Button-5>", lambda e: self._scroll_units(3))
+        for key in ("<Up>", "<Down>", "<Prior>", "<Next>", "<Home>", "<End>"):
+            self.tree.bind(key, self._on_key)
+
+    # --- Public API ---
+
+    def reload(self, keep_position=False, on_loaded=None):
+        """Re-read the row count and the visible window in the background."""
+        if not keep_position:
+            self.top = 0
+            self._selected_ids.clear()
+            self._focus_row = None
+        self._reloading = True
+        self._on_loaded = on_loaded
+        self._generation += 1
+        self._reload_generation += 1
+        generation = self._generation
+
+        # Snapshot the query so later sort/filter changes can't race the worker
+        pager = copy.copy(self.pager)
+        top, visible, prefetch = self.top, self.visible, self.prefetch
+
+        def load(conn, job):
+            total = pager.count(conn)
+            start = max(0, min(top, total - visible))
+            cache_start = max(0, start - prefetch)
+            rows = pager.page_at(conn, cache_start, start - cache_start + visible + prefetch, total)
+            return total, cache_start, rows
+
+        self.executor.submit(load, channel=self._channel,
+                             on_done=lambda result: self._loaded(generation, result))
+
+    def apply_change(self, row_id, old_row=None):
+        """Show an inserted, updated or deleted row without reloading the list.
+
+        Call this after the change is committed. `old_row` is the row as the
+        view showed it before an update or delete; leave it out for rows that
+        were not listed (new or restored rows). Only the changed row is read,
+        so the cost does not depend on the size of the table.
+        """
+        self.apply_changes([row_id], [old_row] if old_row is not None else [])
+
+    def apply_changes(self, row_ids, old_rows=()):
+        """Show a batch of changed rows at once, as apply_change does for one.
+
+        `row_ids` are the rows to show as they are now (inserted, updated or
+        restored; deleted ones are simply not found) and `old_rows` the rows
+        as the view showed them before the change. The new rows are read
+        with one query per few hundred ids and the view is redrawn once.
+        """
+        if self._reloading:
+            # A reload is already in flight; restart it so it sees the change
+            self.reload(keep_position=True)
+            return
+        pager = copy.copy(self.pager)
+        reload_generation = self._reload_generation
+        self._pending_changes += 1
+        # A scroll fetch already in flight may or may not see the change, so drop it
+        self._generation += 1
+        row_ids = list(row_ids)
+        old_rows = list(old_rows)
+        self.executor.submit(
+            lambda conn, job: pager.rows(conn, row_ids) if row_ids else [],
+            on_done=lambda rows: self._changed(reload_generation, old_rows, rows),
+            on_error=lambda e: self._changed(None, (), ()))
+
+    def focused_row(self):
+        """Return the values of the focused row, even if it has scrolled out of view."""
+        return self._focus_row
+
+    def selected_ids(self):
+        """Return the ids of all selected rows, visible or not."""
+        return set(self._selected_ids)
+
+    def select_all(self):
+        """Select every row in the list, including those not read yet."""
+        pager = copy.copy(self.pager)
+        reload_generation = self._reload_generation
+
+        def selected(row_ids):
+            if reload_generation == self._reload_generation:
+                self._selected_ids = set(row_ids)
+                self._show(self.top)
+
+        self.executor.submit(lambda conn, job: pager.ids(conn), on_done=selected)
+
+    def clear_selection(self):
+        self._selected_ids.clear()
+        self.tree.selection_set([])
+
+    def item_for_id(self, row_id):
+        """Return the Treeview item currently showing a row, or None if it is off-screen."""
+        return self._item_by_id.get(row_id)
+
+    def yview(self, *args):
+        """Scrollbar command: handles 'moveto' and 'scroll' requests."""
+        if not args:
+            return
+        if args[0] == "moveto":
+            self._show(int(float(args[1]) * self.total))
+        elif args[0] == "scroll":
+            amount = int(args[1])
+            if args[2] == "pages":
+                amount *= self.visible
+            self._show(self.top + amount)
+
+    # --- Window management ---
+
+    def _rows_that_fit(self):
+        height = self.tree.winfo_height()
+        if self._items:
+            bbox = self.tree.bbox(self._items[0])
+            if bbox:
+                return max(1, (height - bbox[1]) // bbox[3])
+        row_height = ttk.Style(self.tree).lookup("Treeview", "rowheight")
+        try:
+            row_height = int(row_height)
+        except (TypeError, ValueError):
+            row_height = DEFAULT_ROW_HEIGHT
+        # Leave room for the heading row, which is about one row tall
+        return max(1, height // row_height - 1)
+
+    def _show(self, top):
+        self.top = max(0, min(top, self.total - self.visible))
+        self._update_scrollbar()
+        if self._reloading or self._pending_changes:
+            return  # Rendered again once the reload or row change lands
+        start, end = self.top, min(self.top + self.visible, self.total)
+        if self._is_cached(start, end):
+            self._render()
+        else:
+            self._request(start, end)
+
+    def _is_cached(self, start, end):
+        return self._cache_start <= start and end <= self._cache_start + len(self._cache)
+
+    def _request(self, start, end):
+        """Fetch the rows needed for [start, end) on the executor, reading as little as possible."""
+        pager = copy.copy(self.pager)
+        cache_start, cache_end = self._cache_start, self._cache_start + len(self._cache)
+        want_start = max(0, start - self.prefetch)
+        want_end = min(self.total, end + self.prefetch)
+        total = self.total
+
+        if self._cache and cache_start <= start <= cache_end:
+            # Scrolled forward past the cached rows: continue after the last one
+            mode, key, limit = "after", pager.key(self._cache[-1]), want_end - cache_end
+        elif self._cache and start < cache_start <= end:
+            # Scrolled backward: continue before the first cached row
+            mode, key, limit = "before", pager.key(self._cache[0]), cache_start - want_start
+        else:
+            # Jumped somewhere else entirely
+            mode, key, limit = "at", None, want_end - want_start
+
+        def fetch(conn, job):
+            if mode == "after":
+                return pager.page_after(conn, key, limit)
+            if mode == "before":
+                return pager.page_before(conn, key, limit)
+            return pager.page_at(conn, want_start, limit, total)
+
+        generation = self._generation
+        self.executor.submit(fetch, channel=self._channel,
+                             on_done=lambda rows: self._fetched(generation, mode, want_start, limit, rows))
+
+    def _loaded(self, generation, result):
+        if generation != self._generation:
+            return
+        self.total, self._cache_start, self._cache = result
+        self._generation += 1
+        self._reloading = False
+        on_loaded, self._on_loaded = self._on_loaded, None
+        self._show(self.top)
+        if on_loaded:
+            on_loaded()
+
+    def _fetched(self, generation, mode, want_start, limit, rows):
+        if generation != self._generation:
+            self._show(self.top)  # The cache moved on; ask again from where it is now
+            return
+        if mode == "after":
+            self._cache.extend(rows)
+        elif mode == "before":
+            self._cache[:0] = rows
+            self._cache_start -= len(rows)
+        else:
+            self._cache = rows
+            self._cache_start = want_start
+        self._generation += 1
+
+        if len(rows) < limit:
+            # Rows were deleted by someone else since the count was taken
+            self.reload(keep_position=True)
+            return
+
+        # Drop rows far away from the window so the cache stays small
+        keep_start = max(self._cache_start, self.top - 2 * self.prefetch)
+        keep_end = self.top + self.visible + 2 * self.prefetch
+        self._cache = self._cache[keep_start - self._cache_start:keep_end - self._cache_start]
+        self._cache_start = keep_start
+        self._show(self.top)
+
+    def _changed(self, reload_generation, old_rows, new_rows):
+        self._pending_changes -= 1
+        if reload_generation is None:
+            self.reload(keep_position=True)  # Reading the rows failed; fall back to a full reload
+            return
+        if reload_generation == self._reload_generation and not self._reloading:
+            if old_rows:
+                self._remove_rows(old_rows)
+            for row in new_rows:
+                self._insert_row(row)
+            self._generation += 1
+        if not self._reloading:
+            self._show(self.top)
+
+    def _remove_rows(self, rows):
+        """Take rows out of the cache in one pass, keeping the visible rows where they are."""
+        removed_ids = {row[0] for row in rows}
+        kept = []
+        above_top = 0
+        for index, row in enumerate(self._cache):
+            if row[0] not in removed_ids:
+                kept.append(row)
+            elif self._cache_start + index < self.top:
+                above_top += 1
+        # Rows listed before the cache move it and the window up
+        before_cache = 0
+        if self._cache:
+            cached_ids = {row[0] for row in self._cache}
+            before_cache = sum(1 for row in rows
+                               if row[0] not in cached_ids and self.pager.comes_before(row, self._cache[0]))
+        self._cache = kept
+        self._cache_start -= before_cache
+        self.top -= above_top + before_cache
+        self.total -= len(removed_ids)
+        self._selected_ids -= removed_ids
+        if self._focus_row is not None and self._focus_row[0] in removed_ids:
+            self._focus_row = None
+
+    def _insert_row(self, row):
+        """Put a row into the cache at its sort position, if the cache reaches that far."""
+        self.total += 1
+        if self._focus_row is not None and self._focus_row[0] == row[0]:
+            self._focus_row = row
+        if not self._cache:
+            return
+        cache_end = self._cache_start + len(self._cache)
+        if self.pager.comes_before(row, self._cache[0]):
+            if self._cache_start == 0:
+                # The new first row of the whole list
+                self._cache.insert(0, row)
+                if self.top > 0:
+                    self.top += 1
+            else:
+                self._cache_start += 1
+                self.top += 1
+        elif self.pager.comes_before(self._cache[-1], row):
+            if cache_end == self.total - 1:
+                self._cache.append(row)
+        else:
+            low, high = 0, len(self._cache)
+            while low < high:
+                middle = (low + high) // 2
+                if self.pager.comes_before(self._cache[middle], row):
+                    low = middle + 1
+                else:
+                    high = middle
+            self._cache.insert(low, row)
+            if self._cache_start + low < self.top:
+                self.top += 1
+
+    def _render(self):
+        offset = self.top - self._cache_start
+        rows = self._cache[offset:offset + self.visible]
+
+        if self._pending_focus is not None and self.top <= self._pending_focus < self.top + len(rows):
+            self._focus_row = rows[self._pending_focus - self.top]
+            self._selected_ids = {self._focus_row[0]}
+            self._pending_focus = None
+
+        # Reuse the existing Treeview items and only add or remove the difference
+        while len(self._items) < len(rows):
+            self._items.append(self.tree.insert('', tk.END, values=()))
+        while len(self._items) > len(rows):
+            self.tree.delete(self._items.pop())
+
+        self._item_by_id = {}
+        selected_items = []
+        focus_item = None
+        for item, row in zip(self._items, rows):
+            self.tree.item(item, values=row)
+            self._item_by_id[row[0]] = item
+            if row[0] in self._selected_ids:
+                selected_items.append(item)
+            if self._focus_row is not None and row[0] == self._focus_row[0]:
+                focus_item = item
+
+        self.tree.selection_set(selected_items)
+        # An empty id focuses the root, so a scrolled-away row is never reported as focused
+        self.tree.focus(focus_item or "")
+        self.tree.yview_moveto(0)
+
+    def _update_scrollbar(self):
+        if self.total:
+            last = min(self.top + self.visible, self.total)
+            self.scrollbar.set(self.top / self.total, last / self.total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def _row_for_item(self, item):
+        return self._cache[self.top - self._cache_start + self._items.index(item)]
+
+    # --- Event handlers ---
+
+    def _on_resize(self, event=None):
+        visible = self._rows_that_fit()
+        if visible != self.visible:
+            self.visible = visible
+            self._show(self.top)
+
+    def _on_select(self, event=None):
+        selection = set(self.tree.selection())
+        for row_id, item in self._item_by_id.items():
+            if item in selection:
+                self._selected_ids.add(row_id)
+            else:
+                self._selected_ids.discard(row_id)
+        focus = self.tree.focus()
+        if focus in self._items:
+            self._focus_row = self._row_for_item(focus)
+
+    def _on_click(self, event):
+        # A plain click selects only the clicked row, so also drop selected rows scrolled out of view
+        if not event.state & _EXTEND_SELECTION and self.tree.identify_region(event.x, event.y) in ("cell", "tree"):
+            self._selected_ids.clear()
+
+    def _on_select_all(self, event=None):
+        self.select_all()
+        return "break"
+
+    def _on_mousewheel(self, event):
+        # Windows reports multiples of 120, macOS reports small deltas
+        step = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        self._scroll_units(-step * 3)
+        return "break"
+
+    def _scroll_units(self, amount):
+        self._show(self.top + amount)
+        return "break"
+
+    def _on_key(self, event):
+        if not self.total:
+            return "break"
+        current = self.top
+        if self._focus_row is not None and self._focus_row[0] in self._item_by_id:
+            current = self.top + self._items.index(self._item_by_id[self._focus_row[0]])
+
+        moves = {"Up": -1, "Down": 1, "Prior": -self.visible, "Next": self.visible}
+        if event.keysym == "Home":
+            target = 0
+        elif event.keysym == "End":
+            target = self.total - 1
+        else:
+            target = current + moves[event.keysym]
+        target = max(0, min(target, self.total - 1))
+
+        # The focus moves once the target row has been rendered
+        self._pending_focus = target
+        if target < self.top:
+            self._show(target)
+        elif target >= self.top + self.visible:
+            self._show(target - self.visible + 1)
+        else:
+            self._show(self.top)
+        return "break"